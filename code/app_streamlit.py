@@ -1,5 +1,5 @@
 import streamlit as st
-from generate_response_llm import build_context, generate_answer
+from generate_response_llm import build_context, generate_answer, load_worker
 import time
 
 # =====================================
@@ -11,14 +11,22 @@ import time
 st.set_page_config(page_title="Hybrid RAG Wikipedia QA", layout="wide")
 st.title("Hybrid RAG Wikipedia QA System")
 
+# Load the generator and the shared retrieval artifacts once per worker process (later reruns return at once)
+load_worker()
+
 query = st.text_input("Enter your question:")
+where = st.text_input("Filter (optional), e.g. source == 'fixed' and chunk_index < 3:")
 run = st.button("Get Answer")
 
 if run and query:
     start_time = time.time()
     with st.spinner('Retrieving and generating answer...'):
-        context, fused = build_context(query)
-        answer = generate_answer(query, context)
+        try:
+            context, fused = build_context(query, where=where.strip() or None)
+        except ValueError as e:
+            st.error(f"Invalid filter: {e}")
+            st.stop()
+        answer = generate_answer(query, fused)
     elapsed = time.time() - start_time
     st.info(f"Response time: {elapsed:.2f} seconds")
     st.subheader("Generated Answer")
@@ -0,0 +1,143 @@
+import gzip
+import hashlib
+import json
+import os
+
+# =====================================
+# Raw Article Cache
+# =====================================
+# Content-addressed local store of the raw articles downloaded by the chunker, so re-chunking
+# (new CHUNK_SIZE / CHUNK_OVERLAP, clean_text fixes, ...) never re-downloads Wikipedia.
+# Layout of data/article_cache/:
+#   objects/ab/abcdef....json.gz  gzip-compressed JSON {title, resolved_url, revid, summary, text},
+#                                 named by the sha256 of its uncompressed bytes (identical
+#                                 articles reached through different URLs are stored once)
+#   index.jsonl                   append-only {"url": ..., "sha256": ...} lines, last line wins;
+#                                 "sha256": null records a URL that could not be found
+# Usage: python code/article_cache.py  (prints cache statistics)
+
+ARTICLE_CACHE_DIR = os.path.join(os.getcwd(), 'data', 'article_cache')
+OBJECTS_DIR = 'objects'
+INDEX_FILE = 'index.jsonl'
+
+# Article fields kept in the cache (the URL lives in the index, not in the object)
+ARTICLE_FIELDS = ('title', 'resolved_url', 'revid', 'summary', 'text')
+
+
+class ArticleCacheMiss(LookupError):
+    """Raised in offline mode when an article is not in the local cache."""
+
+
+# Path of the object holding the article with the given content hash
+
+def object_path(cache_dir, sha):
+    return os.path.join(cache_dir, OBJECTS_DIR, sha[:2], sha + '.json.gz')
+
+
+# Load one article object ({'title', 'resolved_url', 'revid', 'summary', 'text'}) by content hash
+
+def read_article(cache_dir, sha):
+    with gzip.open(object_path(cache_dir, sha), 'rb') as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+class ArticleCache:
+    def __init__(self, cache_dir=ARTICLE_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.index = {}  # url -> sha256 (None = known missing page)
+        index_path = os.path.join(cache_dir, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line from an interrupted run
+                    self.index[entry['url']] = entry['sha256']
+
+    def __contains__(self, url):
+        return url in self.index and self.index[url] is not None
+
+    def __len__(self):
+        return sum(sha is not None for sha in self.index.values())
+
+    def _append_index(self, url, sha):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, INDEX_FILE), 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'url': url, 'sha256': sha}, ensure_ascii=False) + '\n')
+        self.index[url] = sha
+
+    # True if the URL was fetched before and the page did not exist
+    def known_missing(self, url):
+        return url in self.index and self.index[url] is None
+
+    # Cached article for a URL in the fetcher's shape ({'url', 'title', 'summary', 'text', ...}), or None
+    def get(self, url):
+        sha = self.index.get(url)
+        if sha is None:
+            return None
+        article = read_article(self.cache_dir, sha)
+        article['url'] = url
+        return article
+
+    # Store a fetched article (or record that the URL could not be found when article is None)
+    def put(self, url, article):
+        if article is None:
+            self._append_index(url, None)
+            return None
+        data = json.dumps({k: article.get(k) for k in ARTICLE_FIELDS}, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        sha = hashlib.sha256(data).hexdigest()
+        path = object_path(self.cache_dir, sha)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(gzip.compress(data, mtime=0))
+            os.replace(tmp_path, path)  # Objects appear atomically
+        if self.index.get(url) != sha:
+            self._append_index(url, sha)
+        return sha
+
+
+# Stream URLs through the cache in input order: each URL is yielded once its article is in the
+# cache (or known to be missing). Cached URLs are yielded immediately; misses are downloaded
+# concurrently through the fetcher (a bounded number ahead of the consumer) and added to the cache.
+# URLs recorded as missing are retried online. In offline mode (fetcher=None) nothing is
+# downloaded and any URL never fetched raises ArticleCacheMiss before anything is yielded.
+
+def cache_articles(urls, cache, fetcher=None):
+    urls = list(urls)
+    cached = [url in cache for url in urls]  # Decided up front so duplicate URLs stay aligned
+    misses = [url for url, hit in zip(urls, cached) if not hit]
+    if fetcher is None:
+        unseen = [url for url in misses if not cache.known_missing(url)]
+        if unseen:
+            raise ArticleCacheMiss(
+                f"{len(unseen)} of {len(urls)} articles are not in the article cache at {cache.cache_dir} "
+                f"(first: {unseen[0]}). Run once without --offline to download them."
+            )
+        misses = []
+    print(f"[LOG] Article cache: {len(urls) - len(misses)} hits, {len(misses)} to download")
+    fetched = fetcher.fetch_all(misses) if misses else iter(())
+    for url, hit in zip(urls, cached):
+        if not hit and fetcher is not None:
+            fetched_url, article = next(fetched)
+            cache.put(fetched_url, article)
+        yield url
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Show statistics of the raw article cache.")
+    parser.add_argument('--cache-dir', default=ARTICLE_CACHE_DIR, help='Article cache directory')
+    args = parser.parse_args()
+    cache = ArticleCache(args.cache_dir)
+    objects_dir = os.path.join(args.cache_dir, OBJECTS_DIR)
+    sizes = [os.path.getsize(os.path.join(root, name))
+             for root, _, names in os.walk(objects_dir) for name in names if name.endswith('.json.gz')]
+    print(f"[INFO] Article cache at {args.cache_dir}: {len(cache)} URLs, "
+          f"{sum(cache.known_missing(url) for url in cache.index)} known missing, "
+          f"{len(sizes)} objects ({sum(sizes) / 1e6:.1f} MB compressed)")
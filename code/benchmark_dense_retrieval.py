@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import numpy as np
+from benchmark_sparse_retrieval import time_queries
+from evaluation_metrics import QA_PATH
+from dense_retrieval_faiss import (BUILD_BATCH_SIZE, DENSE_MANIFEST_PATH, EMBEDDING_MODEL, FAISS_INDEX_PATH,
+                                   HNSW_EF_CONSTRUCTION, HNSW_M, INDEX_TYPES, PQ_M, PQ_NBITS, QUANTIZED_TYPES,
+                                   RESCORE_FACTOR, ChunkEncoder, create_index, embed_texts, index_codes,
+                                   read_dense_index, rescore, search_parameters)
+from embedding_cache import EMBEDDING_CACHE_DIR, EmbeddingCache
+from index_artifacts import CHUNKS_PATH, iter_chunks, read_manifest
+from streaming import batched
+
+# =====================================
+# Dense Retrieval ANN Benchmark
+# =====================================
+# This script compares the FAISS index types of dense_retrieval_faiss.py against the exact flat
+# index on the questions of generated_qa_pairs.json:
+# - recall@k: fraction of the exact top k chunk ids that the index also returns in its top k
+# - MRR: reciprocal rank of the first chunk from the question's source article (as in
+#   evaluate_rag_pipeline_dense.py), next to the MRR of the exact float search
+# - p50/p99 latency of single-query searches
+# - memory: size of the serialized index (the float vectors used for rescoring stay on disk)
+# IVF types are measured at several nprobe values and HNSW at several efSearch values, so the
+# report shows the recall/latency trade-off of the query-time knobs; the compressed types (sq8,
+# binary) are measured with and without float rescoring. Corpus vectors come from the
+# embedding cache (only uncached chunks are encoded); results are written to
+# data/faiss_index_report.json.
+# Usage:
+#   python code/benchmark_dense_retrieval.py [--index-types flat hnsw ivf ivfpq] [--top-k 10]
+#   python code/dense_retrieval_faiss.py --build --index-type ivf --report   (report on the built index)
+
+REPORT_PATH = os.path.join(os.getcwd(), 'data', 'faiss_index_report.json')
+RECALL_KS = (1, 5)  # Reported together with recall@top_k
+NPROBE_SWEEP = (1, 4, 16, 64)
+EF_SEARCH_SWEEP = (16, 32, 64, 128, 256)
+
+
+# Normalized embeddings of all corpus chunks, in chunk id order, through the embedding cache
+# Returns (vectors, URL of every chunk)
+
+def corpus_vectors(model_name, chunks_path=CHUNKS_PATH, embedding_cache_dir=EMBEDDING_CACHE_DIR):
+    encode = ChunkEncoder(model_name)
+    cache = EmbeddingCache(model_name, True, embedding_cache_dir) if embedding_cache_dir else None
+    parts = []
+    urls = []
+    for batch in batched(iter_chunks(chunks_path), BUILD_BATCH_SIZE):
+        parts.append(embed_texts([chunk['text'] for chunk in batch], encode, cache))
+        urls.extend(chunk['url'] for chunk in batch)
+    if not parts:
+        raise ValueError(f"No chunks found in {chunks_path}.")
+    return np.concatenate(parts), np.array(urls, dtype=object)
+
+
+# Normalized embeddings and source URLs of the first max_queries questions of generated_qa_pairs.json
+
+def question_vectors(model_name, max_queries, qa_path=QA_PATH):
+    with open(qa_path, 'r', encoding='utf-8') as f:
+        qa_pairs = json.load(f)[:max_queries]
+    vectors = ChunkEncoder(model_name)([qa['question'] for qa in qa_pairs])
+    return np.asarray(vectors, dtype=np.float32).reshape(len(qa_pairs), -1), [qa['source_url'] for qa in qa_pairs]
+
+
+# Exact top_k chunk ids of every query (brute-force inner product)
+
+def exact_top_k(vectors, queries, top_k):
+    import faiss
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    return index.search(queries, top_k)[1]
+
+
+# Mean fraction of the exact top k ids found in the top k ids of each query
+
+def recall_at_k(ids, exact_ids, k):
+    return float(np.mean([len(set(row[:k]) & set(exact[:k])) / k for row, exact in zip(ids, exact_ids)]))
+
+
+# Mean reciprocal rank of the first chunk of each question's source article
+
+def mean_reciprocal_rank(ids, chunk_urls, source_urls):
+    ranks = []
+    for row, url in zip(ids, source_urls):
+        hits = np.flatnonzero(chunk_urls[row[row >= 0]] == url)
+        ranks.append(1.0 / (hits[0] + 1) if len(hits) else 0.0)
+    return float(np.mean(ranks))
+
+
+# Build an index of the given type in memory (trained on the first train_size vectors, as
+# build_dense_index does); returns (index, build parameters)
+
+def build_index(index_type, vectors, **index_params):
+    index, params = create_index(index_type, vectors.shape[1], len(vectors), **index_params)
+    codes = index_codes(index_type, vectors)
+    if not index.is_trained:
+        index.train(codes[:params['train_size']])
+    index.add_with_ids(codes, np.arange(len(vectors), dtype=np.int64))
+    return index, params
+
+
+# Measure one index at every setting of its query-time knob (and, for compressed types, with and
+# without rescoring against the float vectors)
+# eval_set is (queries, exact top_k ids, chunk URLs, question source URLs); returns one report row
+# per setting
+
+def measure_index(index, index_type, params, eval_set, top_k, vectors=None):
+    import faiss
+    queries, exact_ids, chunk_urls, source_urls = eval_set
+    if index_type in ('ivf', 'ivfpq'):
+        settings = [{'nprobe': n} for n in sorted({min(n, params['nlist']) for n in NPROBE_SWEEP})]
+    elif index_type == 'hnsw':
+        settings = [{'ef_search': ef} for ef in EF_SEARCH_SWEEP]
+    elif index_type in QUANTIZED_TYPES and vectors is not None:
+        settings = [{'rescore': False}, {'rescore': True}]
+    else:
+        settings = [{}]
+    if isinstance(index, faiss.IndexBinary):
+        memory = len(faiss.serialize_index_binary(index))
+    else:
+        memory = len(faiss.serialize_index(index))
+    rows = []
+    for setting in settings:
+        knobs = {k: v for k, v in setting.items() if k != 'rescore'}
+        search_params = search_parameters(index_type, **knobs)
+
+        def search(q):
+            q = q[None, :]
+            if setting.get('rescore'):
+                _, ids = index.search(index_codes(index_type, q), top_k * RESCORE_FACTOR, params=search_params)
+                return rescore(q, ids, vectors, top_k)[1][0]
+            return index.search(index_codes(index_type, q), top_k, params=search_params)[1][0]
+
+        p50, p99, outputs = time_queries(search, queries)
+        row = {'index_type': index_type, **setting}
+        for k in sorted(set(RECALL_KS + (top_k,))):
+            if k <= top_k:
+                row[f'recall@{k}'] = recall_at_k(outputs, exact_ids, k)
+        row.update({'mrr': mean_reciprocal_rank(outputs, chunk_urls, source_urls), 'p50_ms': float(p50),
+                    'p99_ms': float(p99), 'memory_mb': memory / 1e6, 'index_params': params})
+        rows.append(row)
+    return rows
+
+
+def print_report(rows, top_k, exact_mrr):
+    print(f"[LOG] MRR of the exact float search: {exact_mrr:.4f}")
+    print(f"{'index':>6} {'knob':>14} | {'recall@1':>8} {'recall@5':>8} {f'recall@{top_k}':>9} {'MRR':>7} | "
+          f"{'p50':>8} {'p99':>8} | {'memory':>9}")
+    for row in rows:
+        if 'nprobe' in row:
+            knob = f"nprobe={row['nprobe']}"
+        elif 'ef_search' in row:
+            knob = f"ef={row['ef_search']}"
+        elif 'rescore' in row:
+            knob = 'rescored' if row['rescore'] else 'no rescore'
+        else:
+            knob = ''
+        recalls = [f"{row[f'recall@{k}']:.3f}" if f'recall@{k}' in row else '-' for k in (1, 5, top_k)]
+        print(f"{row['index_type']:>6} {knob:>14} | {recalls[0]:>8} {recalls[1]:>8} {recalls[2]:>9} {row['mrr']:>7.4f} | "
+              f"{row['p50_ms']:>6.2f}ms {row['p99_ms']:>6.2f}ms | {row['memory_mb']:>7.2f}MB")
+
+
+def write_report(rows, num_chunks, num_queries, top_k, exact_mrr, report_path=REPORT_PATH):
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump({'num_chunks': num_chunks, 'num_queries': num_queries, 'top_k': top_k, 'exact_mrr': exact_mrr,
+                   'results': rows}, f, indent=2)
+    print(f"[LOG] Report saved to {report_path}")
+
+
+# Evaluation set of a corpus: (queries, exact top_k ids, chunk URLs, source URLs) and the exact MRR
+
+def evaluation_set(model_name, vectors, chunk_urls, max_queries, top_k):
+    queries, source_urls = question_vectors(model_name, max_queries)
+    exact_ids = exact_top_k(vectors, queries, top_k)
+    return (queries, exact_ids, chunk_urls, source_urls), mean_reciprocal_rank(exact_ids, chunk_urls, source_urls)
+
+
+# Report on the persisted index (dense_retrieval_faiss.py --build --report): the built index is
+# compared with the flat index and the exact scan of the corpus vectors
+
+def report_persisted_index(top_k=10, max_queries=100, index_path=FAISS_INDEX_PATH, manifest_path=DENSE_MANIFEST_PATH,
+                           chunks_path=CHUNKS_PATH, report_path=REPORT_PATH):
+    manifest = read_manifest(manifest_path)
+    vectors, chunk_urls = corpus_vectors(manifest['model'], chunks_path)
+    eval_set, exact_mrr = evaluation_set(manifest['model'], vectors, chunk_urls, max_queries, top_k)
+    index_type = manifest.get('index_type', 'flat')
+    rows = []
+    if index_type != 'flat':
+        rows += measure_index(build_index('flat', vectors)[0], 'flat', {}, eval_set, top_k)
+    rows += measure_index(read_dense_index(index_path, index_type), index_type, manifest.get('index_params', {}),
+                          eval_set, top_k, vectors)
+    print_report(rows, top_k, exact_mrr)
+    write_report(rows, len(vectors), len(eval_set[0]), top_k, exact_mrr, report_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare recall@k, latency and memory of the FAISS index types.")
+    parser.add_argument('--index-types', nargs='+', choices=INDEX_TYPES, default=list(INDEX_TYPES), help='Index types to build')
+    parser.add_argument('--top-k', type=int, default=10, help='Number of results per query')
+    parser.add_argument('--max-queries', type=int, default=100, help='Number of questions from generated_qa_pairs.json')
+    parser.add_argument('--model', default=EMBEDDING_MODEL, help='Embedding model')
+    parser.add_argument('--nlist', type=int, default=None, help='IVF lists (default: about 4 * sqrt(chunks))')
+    parser.add_argument('--pq-m', type=int, default=PQ_M, help='IVF-PQ sub-quantizers per vector')
+    parser.add_argument('--pq-nbits', type=int, default=PQ_NBITS, help='IVF-PQ bits per sub-quantizer code')
+    parser.add_argument('--hnsw-m', type=int, default=HNSW_M, help='HNSW neighbours per node')
+    parser.add_argument('--ef-construction', type=int, default=HNSW_EF_CONSTRUCTION, help='HNSW candidate list size while building')
+    args = parser.parse_args()
+
+    vectors, chunk_urls = corpus_vectors(args.model)
+    eval_set, exact_mrr = evaluation_set(args.model, vectors, chunk_urls, args.max_queries, args.top_k)
+    print(f"[LOG] {len(vectors)} chunks, {len(eval_set[0])} queries, top_k={args.top_k}")
+    rows = []
+    for index_type in args.index_types:
+        print(f"[LOG] Building {index_type} index...")
+        index_params = {
+            'hnsw': {'hnsw_m': args.hnsw_m, 'ef_construction': args.ef_construction},
+            'ivf': {'nlist': args.nlist},
+            'ivfpq': {'nlist': args.nlist, 'pq_m': args.pq_m, 'pq_nbits': args.pq_nbits},
+        }.get(index_type, {})
+        index, params = build_index(index_type, vectors, **index_params)
+        rows += measure_index(index, index_type, params, eval_set, args.top_k, vectors)
+    print_report(rows, args.top_k, exact_mrr)
+    write_report(rows, len(vectors), len(eval_set[0]), args.top_k, exact_mrr)
+
+
+if __name__ == '__main__':
+    main()
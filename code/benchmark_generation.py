@@ -0,0 +1,72 @@
+import argparse
+import json
+import time
+from evaluation_metrics import QA_PATH
+import generate_response_llm
+from generate_response_llm import (GENERATION_BATCH_SIZE, MAX_INPUT_TOKENS, build_context, build_prompt, format_context,
+                                   generate_answer, generate_answers, get_tokenizer, load_worker, pack_prompt)
+from hybrid_retrieval import get_hybrid_retriever
+
+# =====================================
+# Answer Generation Benchmark
+# =====================================
+# Times answer generation for the questions of generated_qa_pairs.json (chunks from
+# build_context) one prompt at a time with generate_answer and in padded batches with
+# generate_answers at several batch sizes, and counts the batched answers that differ from the
+# single-prompt ones (padding can flip a greedy token, especially at bf16 / int8 precision).
+# First times prompt tokenization on the top-10 hybrid chunks: the former truncate -> decode ->
+# re-tokenize path against pack_prompt with a cold and a warm per-chunk token-count cache.
+# Usage:
+#   python code/benchmark_generation.py [--max-queries 32] [--batch-sizes 4 8 16]
+
+
+# Former prompt tokenization: the whole prompt truncated to MAX_INPUT_TOKENS (cutting off the
+# question at the end), decoded and tokenized again by the text2text-generation pipeline
+
+def truncated_prompt_ids(query, chunks):
+    tokenizer = get_tokenizer()
+    truncated = tokenizer(build_prompt(query, format_context(chunks)), truncation=True, max_length=MAX_INPUT_TOKENS)['input_ids']
+    return tokenizer(tokenizer.decode(truncated))['input_ids']
+
+
+def time_tokenization(questions, top_n=10):
+    ranked = [get_hybrid_retriever().search(question, top_n=top_n) for question in questions]
+    generate_response_llm._token_counts = None
+    paths = [('truncate+decode+retokenize', truncated_prompt_ids),
+             ('pack_prompt (cold cache)', lambda query, chunks: pack_prompt(query, chunks)[0]),
+             ('pack_prompt (warm cache)', lambda query, chunks: pack_prompt(query, chunks)[0])]
+    for name, fn in paths:
+        start = time.perf_counter()
+        lengths = [len(fn(question, chunks)) for question, chunks in zip(questions, ranked)]
+        elapsed = (time.perf_counter() - start) / len(questions) * 1000
+        print(f"[LOG] {name}: {elapsed:.2f}ms per prompt, {sum(lengths) / len(lengths):.0f} tokens on average")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare single-prompt and batched answer generation.")
+    parser.add_argument('--max-queries', type=int, default=32, help='Number of questions from generated_qa_pairs.json')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[4, GENERATION_BATCH_SIZE, 16],
+                        help='generate_answers batch sizes to time')
+    args = parser.parse_args()
+
+    load_worker()  # Model and retrieval artifacts, so neither load is timed
+    with open(QA_PATH, 'r', encoding='utf-8') as f:
+        questions = [qa['question'] for qa in json.load(f)[:args.max_queries]]
+    time_tokenization(questions)
+    contexts = [build_context(question)[1] for question in questions]
+
+    start = time.perf_counter()
+    reference = [generate_answer(question, chunks) for question, chunks in zip(questions, contexts)]
+    single = time.perf_counter() - start
+    print(f"[LOG] One prompt at a time: {single:.1f}s ({len(questions) / single:.2f} answers/s)")
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        answers = generate_answers(questions, contexts, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        mismatches = sum(a != b for a, b in zip(answers, reference))
+        print(f"[LOG] batch_size={batch_size}: {elapsed:.1f}s ({len(questions) / elapsed:.2f} answers/s, "
+              f"{single / elapsed:.2f}x), {mismatches} answers differ from the single-prompt path")
+
+
+if __name__ == '__main__':
+    main()
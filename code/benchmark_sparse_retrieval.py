@@ -0,0 +1,82 @@
+import argparse
+import json
+import tempfile
+import time
+import numpy as np
+from evaluation_metrics import QA_PATH
+from index_artifacts import CHUNKS_PATH, iter_chunks
+from sparse_retrieval_bm25 import BM25Index, tokenize, write_bm25_index
+
+# =====================================
+# Sparse Retrieval Latency Benchmark
+# =====================================
+# This script measures BM25 query latency (p50/p99) as the corpus grows.
+# Larger corpora are simulated by replicating wikipedia_chunks.jsonl; for each size it compares
+# full-corpus scoring (get_scores + sort, as the original retrieve_sparse did) with the
+# postings-based MaxScore engine (BM25Index.top_k) and checks that both return the same results.
+# Usage: python code/benchmark_sparse_retrieval.py [--scales 1 2 4 8] [--top-k 20]
+
+
+# Time fn over all queries and return (p50, p99) latency in milliseconds plus the results
+
+def time_queries(fn, queries):
+    latencies = []
+    outputs = []
+    for q in queries:
+        start = time.perf_counter()
+        outputs.append(fn(q))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.percentile(latencies, 50), np.percentile(latencies, 99), outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark BM25 query latency as the corpus grows.")
+    parser.add_argument('--scales', type=int, nargs='*', default=[1, 2, 4, 8], help='Corpus replication factors')
+    parser.add_argument('--top-k', type=int, default=20, help='Number of results per query')
+    parser.add_argument('--max-queries', type=int, default=100, help='Number of questions from generated_qa_pairs.json')
+    parser.add_argument('--rank-bm25', action='store_true', help='Also time rank_bm25.BM25Okapi (slow to build)')
+    args = parser.parse_args()
+
+    chunks = list(iter_chunks(CHUNKS_PATH))
+    with open(QA_PATH, 'r', encoding='utf-8') as f:
+        queries = [tokenize(qa['question']) for qa in json.load(f)[:args.max_queries]]
+
+    print(f"{'chunks':>10} | {'full p50':>9} {'full p99':>9} | {'maxscore p50':>12} {'maxscore p99':>12} | mismatches")
+    for scale in args.scales:
+        corpus = chunks * scale
+        with tempfile.TemporaryDirectory() as index_dir:
+            write_bm25_index(corpus, index_dir, fingerprint=f'benchmark-x{scale}')
+            index = BM25Index(index_dir)
+
+            def full_scan(q):
+                scores = index.get_scores(q)
+                top = np.argsort(-scores, kind='stable')[:args.top_k]
+                return list(top), list(scores[top])
+
+            def maxscore(q):
+                top, scores = index.top_k(q, args.top_k)
+                return list(top), list(scores)
+
+            full_p50, full_p99, full_out = time_queries(full_scan, queries)
+            ms_p50, ms_p99, ms_out = time_queries(maxscore, queries)
+            mismatches = sum(a != b for a, b in zip(full_out, ms_out))
+            print(f"{len(corpus):>10} | {full_p50:>7.2f}ms {full_p99:>7.2f}ms | "
+                  f"{ms_p50:>10.2f}ms {ms_p99:>10.2f}ms | {mismatches}")
+
+            if args.rank_bm25:
+                from rank_bm25 import BM25Okapi
+                bm25 = BM25Okapi([tokenize(c['text']) for c in corpus])
+
+                def rank_bm25_scan(q):
+                    scores = bm25.get_scores(q)
+                    top = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:args.top_k]
+                    return top, [scores[i] for i in top]
+
+                rb_p50, rb_p99, rb_out = time_queries(rank_bm25_scan, queries)
+                rb_mismatches = sum(list(a[0]) != list(b[0]) or list(a[1]) != list(b[1])
+                                    for a, b in zip(rb_out, ms_out))
+                print(f"{'':>10} | rank_bm25 p50 {rb_p50:.2f}ms p99 {rb_p99:.2f}ms | mismatches vs maxscore: {rb_mismatches}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import sys
+import numpy as np
+from benchmark_dense_retrieval import mean_reciprocal_rank
+from benchmark_sparse_retrieval import time_queries
+from dense_retrieval_faiss import DENSE_MANIFEST_PATH, DENSE_VECTORS_PATH, FAISS_INDEX_PATH, get_dense_retriever
+from evaluation_metrics import QA_PATH
+from index_artifacts import CHUNKS_PATH, check_fingerprint, check_same_corpus, read_manifest
+from metadata_filter import compile_filter
+from query_encoder import QUERY_ENCODER, get_query_encoder
+from rank_fusion import fuse, top_n_indices
+from sparse_retrieval_bm25 import get_sparse_retriever, tokenize
+
+# =====================================
+# Cascade Retrieval (BM25 -> dense rescoring)
+# =====================================
+# A CPU-only retrieval tier without any ANN search: BM25 selects a few hundred candidates and
+# their stored, normalized chunk embeddings (data/faiss_vectors.f32, written by
+# dense_retrieval_faiss.py --build) are gathered by chunk id and scored by dot product with the
+# query embedding. Results are ranked by the dense score.
+# The FAISS index is never opened: the vectors file is memory-mapped and a query touches only its
+# candidates' rows (candidates x dim x 4 bytes), so the resident memory is the BM25 postings and
+# the query encoder. Chunks that BM25 does not retrieve cannot be found, so recall is bounded by
+# the BM25 candidate list; a query matching fewer than `candidates` chunks gets only those (and can
+# return fewer than top_k results). A metadata filter (where=..., metadata_filter.py) masks the BM25
+# postings, so all candidates come from the filtered chunks.
+# --benchmark compares latency and MRR with BM25, dense and the RRF fusion of build_context's
+# former top-20 lists on generated_qa_pairs.json.
+# Usage:
+#   python code/cascade_retrieval.py [--candidates 200] [--benchmark]
+
+CASCADE_CANDIDATES = 200  # BM25 candidates rescored per query
+CANDIDATE_SWEEP = (50, 100, 200, 500)
+RRF_DEPTH = 20  # Per-retriever list length of the RRF path
+
+
+# Query-side cascade retriever
+# Opens the BM25 index (through the process-wide sparse retriever), the dense manifest and the
+# memory-mapped float vectors on first use; refuses vectors built from a different corpus
+
+class CascadeRetriever:
+    def __init__(self, candidates=CASCADE_CANDIDATES, sparse=None, manifest_path=DENSE_MANIFEST_PATH,
+                 vectors_path=DENSE_VECTORS_PATH, chunks_path=CHUNKS_PATH, encoder_mode=QUERY_ENCODER):
+        self.candidates = candidates
+        self.sparse = sparse
+        self.manifest_path = manifest_path
+        self.vectors_path = vectors_path
+        self.chunks_path = chunks_path
+        self.encoder_mode = encoder_mode
+        self.manifest = None
+        self._vectors = None
+
+    def load(self):
+        if self._vectors is not None:
+            return self
+        manifest = read_manifest(self.manifest_path)
+        check_fingerprint(manifest, 'dense', self.chunks_path)
+        self.sparse = (self.sparse or get_sparse_retriever()).load()
+        check_same_corpus(manifest, self.sparse.chunks.manifest, 'dense')
+        num_docs = self.sparse.index.num_docs
+        if not os.path.exists(self.vectors_path) or \
+                os.path.getsize(self.vectors_path) != num_docs * manifest['dim'] * 4:
+            raise ValueError(f"{self.vectors_path} is missing or does not match the corpus; "
+                             f"rebuild it with dense_retrieval_faiss.py --build.")
+        self.manifest = manifest
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(num_docs, manifest['dim']))
+        return self
+
+    # Process-wide query encoder of the vectors' model (shared with the dense retriever)
+    @property
+    def query_encoder(self):
+        return get_query_encoder(self.load().manifest['model'], self.encoder_mode)
+
+    # Normalized float32 query embeddings, one row per query (recent queries come from the cache)
+    def encode(self, queries, batch_size=32):
+        return self.query_encoder.encode(queries, batch_size)
+
+    # Top_k (chunk ids, dense scores, BM25 scores) of already encoded queries, one tuple per query
+    # Candidate rows are gathered in ascending id order (sequential reads of the mapped file);
+    # ties keep the lower chunk id first; mask is an optional bitset of allowed chunks
+    def rank_embedded(self, q_emb, tokenized_queries, top_k, mask=None):
+        self.load()
+        ranked = []
+        candidates = self.sparse.index.top_k_batch(tokenized_queries, self.candidates, mask)
+        for q, (ids, sparse_scores) in zip(q_emb, candidates):
+            # top_k_batch pads short lists with zero-score chunks in corpus order; those match no
+            # query term, so they are not candidates (as in the hybrid scorer)
+            matched = sparse_scores > 0
+            ids, sparse_scores = ids[matched], sparse_scores[matched]
+            order = np.argsort(ids)
+            ids, sparse_scores = ids[order], sparse_scores[order]
+            dense_scores = self._vectors[ids] @ q
+            top = top_n_indices(dense_scores, top_k, tie_key=ids)
+            ranked.append((ids[top], dense_scores[top], sparse_scores[top]))
+        return ranked
+
+    # Given a query, returns top_k chunks ranked by the dense score of the BM25 candidates
+    def search(self, query, top_k=5, where=None):
+        return self.search_batch([query], top_k=top_k, where=where)[0]
+
+    # Batched search: all queries are encoded in one call and their BM25 candidates retrieved in
+    # one top_k_batch pass; results carry 'score' (dense) and 'sparse_score'
+    def search_batch(self, queries, top_k=5, batch_size=32, where=None):
+        chunks = self.load().sparse.chunks
+        mask = None if where is None else compile_filter(where, chunks)
+        ranked = self.rank_embedded(self.encode(queries, batch_size), [tokenize(q) for q in queries], top_k, mask)
+        batch_results = []
+        for ids, dense_scores, sparse_scores in ranked:
+            results = []
+            for idx, score, sparse_score in zip(ids, dense_scores, sparse_scores):
+                meta = chunks.meta(idx)
+                meta['score'] = float(score)
+                meta['sparse_score'] = float(sparse_score)
+                results.append(meta)
+            batch_results.append(results)
+        return batch_results
+
+
+# Process-wide retriever used by retrieve_cascade (created on first query)
+_default_retriever = None
+
+
+def get_cascade_retriever():
+    global _default_retriever
+    if _default_retriever is None:
+        _default_retriever = CascadeRetriever()
+    return _default_retriever
+
+
+# Given a query, returns top_k chunks of the cascade (BM25 candidates ranked by dense score)
+
+def retrieve_cascade(query, top_k=5, where=None):
+    return get_cascade_retriever().search(query, top_k=top_k, where=where)
+
+
+# Batched cascade retrieval: returns one result list per query
+
+def retrieve_cascade_batch(queries, top_k=5, where=None):
+    return get_cascade_retriever().search_batch(queries, top_k=top_k, where=where)
+
+
+# Latency (query encoding excluded) and source-article MRR of BM25, dense, RRF of the top-20 lists
+# and the cascade at several candidate counts on the questions of generated_qa_pairs.json
+
+def benchmark(top_k=10, max_queries=100, candidates=CASCADE_CANDIDATES, candidate_sizes=CANDIDATE_SWEEP,
+              qa_path=QA_PATH, index_path=FAISS_INDEX_PATH, vectors_path=DENSE_VECTORS_PATH):
+    with open(qa_path, 'r', encoding='utf-8') as f:
+        qa_pairs = json.load(f)[:max_queries]
+    cascade = CascadeRetriever().load()
+    dense = get_dense_retriever().load()
+    chunks = cascade.sparse.chunks
+    chunk_urls = np.array([chunks.urls[i] for i in range(len(chunks.urls))], dtype=object)[np.asarray(chunks.url_ids)]
+    source_urls = [qa['source_url'] for qa in qa_pairs]
+    q_emb = cascade.encode([qa['question'] for qa in qa_pairs])
+    tokenized = [tokenize(qa['question']) for qa in qa_pairs]
+    rows = range(len(qa_pairs))
+    bm25 = cascade.sparse.index
+
+    def rrf(i):
+        dense_ids = dense.top_k(q_emb[i:i + 1], RRF_DEPTH)[1][0]
+        sparse_ids = bm25.top_k(tokenized[i], RRF_DEPTH)[0]
+        return fuse([dense_ids[dense_ids >= 0], sparse_ids], method='rrf', top_n=top_k)[0]
+
+    paths = [
+        ('bm25', lambda i: bm25.top_k(tokenized[i], top_k)[0]),
+        ('dense', lambda i: dense.top_k(q_emb[i:i + 1], top_k)[1][0]),
+        (f'rrf@{RRF_DEPTH}', rrf),
+    ]
+    for size in sorted(set(candidate_sizes) | {candidates}):
+        paths.append((f'cascade@{size}', lambda i, c=CascadeRetriever(size, cascade.sparse).load():
+                      c.rank_embedded(q_emb[i:i + 1], tokenized[i:i + 1], top_k)[0][0]))
+
+    print(f"[LOG] {len(qa_pairs)} queries, {len(chunks)} chunks, top_k={top_k} (query encoding not timed)")
+    print(f"{'path':>14} | {'MRR':>7} | {'p50':>8} {'p99':>8}")
+    for name, fn in paths:
+        p50, p99, outputs = time_queries(fn, rows)
+        mrr = mean_reciprocal_rank([np.asarray(ids) for ids in outputs], chunk_urls, source_urls)
+        print(f"{name:>14} | {mrr:>7.4f} | {p50:>6.2f}ms {p99:>6.2f}ms")
+    dim = cascade.manifest['dim']
+    print(f"[LOG] Memory: FAISS index {os.path.getsize(index_path) / 1e6:.1f}MB "
+          f"({dense.manifest.get('index_type', 'flat')}); the cascade reads {candidates * dim * 4 / 1e3:.0f}KB "
+          f"of the mapped {os.path.getsize(vectors_path) / 1e6:.1f}MB vectors file per query at {candidates} candidates")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="BM25 candidates re-scored with the stored chunk embeddings.")
+    parser.add_argument('--candidates', type=int, default=CASCADE_CANDIDATES, help='BM25 candidates rescored per query')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Compare latency and MRR with BM25, dense and RRF on generated_qa_pairs.json')
+    parser.add_argument('--top-k', type=int, default=10, help='Results per query in the benchmark')
+    parser.add_argument('--max-queries', type=int, default=100, help='Number of questions from generated_qa_pairs.json')
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.top_k, args.max_queries, args.candidates)
+    _default_retriever = CascadeRetriever(args.candidates)
+    # Example usage: interactive query
+    if sys.stdin.isatty():
+        # Interactive mode: allow user to query
+        query = input('Enter your query: ')
+        for r in retrieve_cascade(query, top_k=5):
+            print(f"Score: {r['score']:.4f} | BM25: {r['sparse_score']:.4f} | Title: {r['title']} | URL: {r['url']}")
+    else:
+        print("[INFO] Non-interactive mode detected. Skipping query input.")
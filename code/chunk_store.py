@@ -0,0 +1,256 @@
+import argparse
+import os
+import numpy as np
+from index_artifacts import CHUNKS_PATH, corpus_fingerprint, iter_chunks, read_manifest, write_manifest
+
+# =====================================
+# Columnar Chunk Store
+# =====================================
+# Memory-mapped, columnar replacement for loading the chunk corpus into Python dicts.
+# Chunk ids are integers (row numbers). All chunk texts live in one UTF-8 blob addressed by an
+# offsets array; titles and URLs are interned into string tables referenced by integer ids.
+# Everything is opened with mmap, so fetching a chunk's text is a zero-copy slice and memory per
+# worker stays flat as the corpus grows (the OS page cache holds one shared copy).
+# Usage (one-time conversion from the JSON corpus): python code/chunk_store.py --convert
+
+CHUNK_STORE_DIR = os.path.join(os.getcwd(), 'data', 'chunk_store')
+
+# Files making up the store
+TEXT_FILE = 'text.bin'                  # UTF-8 bytes of all chunk texts, concatenated
+TEXT_OFFSETS_FILE = 'text_offsets.npy'  # int64[N+1] byte offsets into text.bin
+TITLE_IDS_FILE = 'title_ids.npy'        # int32[N] index into the titles table
+URL_IDS_FILE = 'url_ids.npy'            # int32[N] index into the urls table
+CHUNK_INDEX_FILE = 'chunk_index.npy'    # int32[N] position of the chunk within its article
+TITLES_FILE = 'titles.bin'              # interned titles (blob + offsets)
+TITLE_OFFSETS_FILE = 'title_offsets.npy'
+URLS_FILE = 'urls.bin'                  # interned URLs (blob + offsets)
+URL_OFFSETS_FILE = 'url_offsets.npy'
+DELETED_FILE = 'deleted.npy'            # bool[N] tombstones of replaced/deleted chunks (incremental updates)
+URL_REVIDS_FILE = 'url_revids.npy'      # int64[U] indexed revision id per URL (-1 = unknown)
+MANIFEST_FILE = 'manifest.json'
+
+
+# Open a possibly empty binary blob as a read-only uint8 memmap (np.memmap rejects empty files)
+
+def _open_blob(path):
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode='r')
+
+
+# Read-only table of strings stored as a UTF-8 blob plus an offsets array
+
+class StringTable:
+    def __init__(self, blob_path, offsets_path):
+        self.blob = _open_blob(blob_path)
+        self.offsets = np.load(offsets_path, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return str(memoryview(self.blob[self.offsets[i]:self.offsets[i + 1]]), 'utf-8')
+
+
+# Write a list of strings as blob + offsets
+
+def _write_string_table(strings, blob_path, offsets_path):
+    encoded = [s.encode('utf-8') for s in strings]
+    with open(blob_path, 'wb') as f:
+        f.write(b''.join(encoded))
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    np.save(offsets_path, offsets)
+
+
+# Atomically replace an .npy file (readers that already mapped the old file keep their view)
+
+def _replace_npy(path, array):
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+# Write a chunk store from an iterable of chunk dicts (streamed: texts go straight to disk)
+# Chunk ids must be the row numbers 0..N-1 (as produced by preprocess_and_chunk_wikipedia.py)
+# revisions optionally maps URLs to the indexed revision id (kept by compaction)
+
+def write_chunk_store(chunks, store_dir=CHUNK_STORE_DIR, fingerprint=None, revisions=None):
+    os.makedirs(store_dir, exist_ok=True)
+    titles, urls = {}, {}
+    text_offsets = [0]
+    title_ids, url_ids, chunk_indices = [], [], []
+    with open(os.path.join(store_dir, TEXT_FILE), 'wb') as f:
+        for row, chunk in enumerate(chunks):
+            if str(chunk['chunk_id']) != str(row):
+                raise ValueError(f"Chunk ids must be consecutive row numbers; found {chunk['chunk_id']!r} at row {row}.")
+            data = chunk['text'].encode('utf-8')
+            f.write(data)
+            text_offsets.append(text_offsets[-1] + len(data))
+            title_ids.append(titles.setdefault(chunk['title'], len(titles)))
+            url_ids.append(urls.setdefault(chunk['url'], len(urls)))
+            chunk_indices.append(chunk['chunk_index'])
+    np.save(os.path.join(store_dir, TEXT_OFFSETS_FILE), np.array(text_offsets, dtype=np.int64))
+    np.save(os.path.join(store_dir, TITLE_IDS_FILE), np.array(title_ids, dtype=np.int32))
+    np.save(os.path.join(store_dir, URL_IDS_FILE), np.array(url_ids, dtype=np.int32))
+    np.save(os.path.join(store_dir, CHUNK_INDEX_FILE), np.array(chunk_indices, dtype=np.int32))
+    _write_string_table(list(titles), os.path.join(store_dir, TITLES_FILE), os.path.join(store_dir, TITLE_OFFSETS_FILE))
+    _write_string_table(list(urls), os.path.join(store_dir, URLS_FILE), os.path.join(store_dir, URL_OFFSETS_FILE))
+    # A freshly written store has no tombstones; drop those of a previous store in the same directory
+    if os.path.exists(os.path.join(store_dir, DELETED_FILE)):
+        os.remove(os.path.join(store_dir, DELETED_FILE))
+    url_revids = np.array([-1 if (revisions or {}).get(url) is None else revisions[url] for url in urls], dtype=np.int64)
+    np.save(os.path.join(store_dir, URL_REVIDS_FILE), url_revids)
+    write_manifest(os.path.join(store_dir, MANIFEST_FILE), {
+        'corpus_fingerprint': fingerprint,
+        'num_chunks': len(title_ids),
+        'num_titles': len(titles),
+        'num_urls': len(urls),
+    })
+    print(f'Chunk store saved to {store_dir} ({len(title_ids)} chunks, {len(urls)} articles)')
+
+
+# Append chunks to an existing store and tombstone replaced/deleted chunks (incremental updates)
+# New chunks get the next row numbers as chunk ids; texts are appended to text.bin and the small
+# per-chunk integer columns and string tables are rewritten. revisions maps URLs to the indexed
+# revision id. Deleted rows keep their data until compaction rewrites the store.
+
+def append_chunk_store(chunks, deleted_ids=(), revisions=None, store_dir=CHUNK_STORE_DIR, fingerprint=None):
+    store = ChunkStore(store_dir)
+    titles = {store.titles[i]: i for i in range(len(store.titles))}
+    urls = {store.urls[i]: i for i in range(len(store.urls))}
+    num_rows = len(store)
+    text_offsets = [int(store.text_offsets[-1])]
+    title_ids, url_ids, chunk_indices = [], [], []
+    with open(os.path.join(store_dir, TEXT_FILE), 'ab') as f:
+        for row, chunk in enumerate(chunks, start=num_rows):
+            if str(chunk['chunk_id']) != str(row):
+                raise ValueError(f"Appended chunk ids must continue the row numbers; found {chunk['chunk_id']!r} at row {row}.")
+            data = chunk['text'].encode('utf-8')
+            f.write(data)
+            text_offsets.append(text_offsets[-1] + len(data))
+            title_ids.append(titles.setdefault(chunk['title'], len(titles)))
+            url_ids.append(urls.setdefault(chunk['url'], len(urls)))
+            chunk_indices.append(chunk['chunk_index'])
+    total_rows = num_rows + len(title_ids)
+    deleted = np.zeros(total_rows, dtype=bool)
+    if store.deleted is not None:
+        deleted[:num_rows] = store.deleted
+    deleted[np.asarray(list(deleted_ids), dtype=np.int64)] = True
+    url_revids = np.full(len(urls), -1, dtype=np.int64)
+    url_revids[:len(store.urls)] = store.url_revids
+    for url, revid in (revisions or {}).items():
+        if url in urls:
+            url_revids[urls[url]] = -1 if revid is None else revid
+
+    def path(name):
+        return os.path.join(store_dir, name)
+
+    _replace_npy(path(TEXT_OFFSETS_FILE), np.concatenate([store.text_offsets, np.array(text_offsets[1:], dtype=np.int64)]))
+    _replace_npy(path(TITLE_IDS_FILE), np.concatenate([store.title_ids, np.array(title_ids, dtype=np.int32)]))
+    _replace_npy(path(URL_IDS_FILE), np.concatenate([store.url_ids, np.array(url_ids, dtype=np.int32)]))
+    _replace_npy(path(CHUNK_INDEX_FILE), np.concatenate([store.chunk_index, np.array(chunk_indices, dtype=np.int32)]))
+    _replace_npy(path(DELETED_FILE), deleted)
+    _replace_npy(path(URL_REVIDS_FILE), url_revids)
+    if len(titles) > len(store.titles):
+        _write_string_table(list(titles), path(TITLES_FILE + '.tmp'), path(TITLE_OFFSETS_FILE + '.tmp.npy'))
+        os.replace(path(TITLES_FILE + '.tmp'), path(TITLES_FILE))
+        os.replace(path(TITLE_OFFSETS_FILE + '.tmp.npy'), path(TITLE_OFFSETS_FILE))
+    if len(urls) > len(store.urls):
+        _write_string_table(list(urls), path(URLS_FILE + '.tmp'), path(URL_OFFSETS_FILE + '.tmp.npy'))
+        os.replace(path(URLS_FILE + '.tmp'), path(URLS_FILE))
+        os.replace(path(URL_OFFSETS_FILE + '.tmp.npy'), path(URL_OFFSETS_FILE))
+    write_manifest(path(MANIFEST_FILE), dict(store.manifest, corpus_fingerprint=fingerprint, num_chunks=total_rows,
+                                             num_deleted=int(deleted.sum()), num_titles=len(titles), num_urls=len(urls)))
+    print(f'Chunk store updated: {len(title_ids)} chunks appended, {int(deleted.sum())} deleted in total')
+
+
+# One-time converter from the chunk corpus (wikipedia_chunks.jsonl, or a JSON array) to the chunk store
+
+def convert_chunks_json(chunks_path=CHUNKS_PATH, store_dir=CHUNK_STORE_DIR):
+    write_chunk_store(iter_chunks(chunks_path), store_dir, fingerprint=corpus_fingerprint(chunks_path))
+
+
+# Read-only, memory-mapped view of the chunk store
+
+class ChunkStore:
+    def __init__(self, store_dir=CHUNK_STORE_DIR):
+        self.store_dir = store_dir
+        self.manifest = read_manifest(os.path.join(store_dir, MANIFEST_FILE))
+        self.text_blob = _open_blob(os.path.join(store_dir, TEXT_FILE))
+        self.text_offsets = self._load(TEXT_OFFSETS_FILE)
+        self.title_ids = self._load(TITLE_IDS_FILE)
+        self.url_ids = self._load(URL_IDS_FILE)
+        self.chunk_index = self._load(CHUNK_INDEX_FILE)
+        self.titles = StringTable(os.path.join(store_dir, TITLES_FILE), os.path.join(store_dir, TITLE_OFFSETS_FILE))
+        self.urls = StringTable(os.path.join(store_dir, URLS_FILE), os.path.join(store_dir, URL_OFFSETS_FILE))
+        # Tombstones and revision ids only exist after incremental updates
+        deleted_path = os.path.join(store_dir, DELETED_FILE)
+        self.deleted = np.load(deleted_path, mmap_mode='r') if os.path.exists(deleted_path) else None
+        revids_path = os.path.join(store_dir, URL_REVIDS_FILE)
+        self.url_revids = np.load(revids_path) if os.path.exists(revids_path) else np.full(len(self.urls), -1, dtype=np.int64)
+
+    def _load(self, name):
+        return np.load(os.path.join(self.store_dir, name), mmap_mode='r')
+
+    # Number of rows (chunk ids), including deleted chunks
+    def __len__(self):
+        return len(self.title_ids)
+
+    # Ids of deleted (tombstoned) chunks
+    def deleted_ids(self):
+        return np.zeros(0, dtype=np.int64) if self.deleted is None else np.flatnonzero(self.deleted)
+
+    # Zero-copy view of the UTF-8 bytes of a chunk's text
+    def text_bytes(self, chunk_id):
+        chunk_id = int(chunk_id)
+        return memoryview(self.text_blob[self.text_offsets[chunk_id]:self.text_offsets[chunk_id + 1]])
+
+    def text(self, chunk_id):
+        return str(self.text_bytes(chunk_id), 'utf-8')
+
+    def title(self, chunk_id):
+        return self.titles[self.title_ids[int(chunk_id)]]
+
+    def url(self, chunk_id):
+        return self.urls[self.url_ids[int(chunk_id)]]
+
+    # Chunk metadata in the same shape as the entries of chunk_metadata.json
+    def meta(self, chunk_id):
+        chunk_id = int(chunk_id)
+        return {
+            'chunk_id': str(chunk_id),
+            'url': self.url(chunk_id),
+            'title': self.title(chunk_id),
+            'chunk_index': int(self.chunk_index[chunk_id]),
+        }
+
+    # Metadata plus text, in the same shape as the records of wikipedia_chunks.jsonl
+    def chunk(self, chunk_id):
+        chunk = self.meta(chunk_id)
+        chunk['text'] = self.text(chunk_id)
+        return chunk
+
+
+# Process-wide chunk store (opened on first use)
+_default_store = None
+
+
+def get_chunk_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = ChunkStore()
+    return _default_store
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert wikipedia_chunks.jsonl into the memory-mapped chunk store.")
+    parser.add_argument('--convert', action='store_true', help='(Re)build data/chunk_store from wikipedia_chunks.jsonl')
+    parser.add_argument('--chunks-path', default=CHUNKS_PATH, help='Path of the chunk corpus (.jsonl or .json)')
+    parser.add_argument('--store-dir', default=CHUNK_STORE_DIR, help='Output directory of the chunk store')
+    args = parser.parse_args()
+    if args.convert:
+        convert_chunks_json(args.chunks_path, args.store_dir)
+    else:
+        store = ChunkStore(args.store_dir)
+        print(f"[INFO] Chunk store at {args.store_dir}: {len(store)} chunks, {len(store.urls)} articles.")
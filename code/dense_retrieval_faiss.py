@@ -1,67 +1,620 @@
-import json
+import argparse
+import math
 import os
-from sentence_transformers import SentenceTransformer
-import faiss
-import numpy as np
 import sys
+import numpy as np
+from chunk_store import CHUNK_STORE_DIR, ChunkStore
+from embedding_cache import EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_DTYPE, EmbeddingCache
+from index_artifacts import (CHUNK_META_PATH, CHUNKS_PATH, check_fingerprint, check_same_corpus, corpus_fingerprint,
+                             iter_chunks, read_manifest, write_chunk_metadata, write_manifest)
+from metadata_filter import compile_filter
+from query_encoder import QUERY_ENCODER, get_query_encoder
+from rank_fusion import top_n_indices
+from streaming import batched
 
 # =============================
 # Dense Retrieval (FAISS) Script
 # =============================
 # This script builds a dense vector index (FAISS) for Wikipedia chunks using a SentenceTransformer model.
-# It saves the index and chunk metadata for fast retrieval, and provides a sample retrieval function.
+# Building (--build) embeds the corpus once and saves the index, chunk metadata and a manifest.
+# Querying loads the persisted index lazily through DenseRetriever, so importing retrieve_dense
+# no longer re-embeds the corpus. Queries are encoded by query_encoder.py (the index's
+# SentenceTransformer with an LRU of recent queries by default; QUERY_ENCODER=int8 opts into a
+# quantized, traced copy of the model); chunk embeddings stay full precision.
+# Vectors are stored under their chunk ids (IndexIDMap). Incremental updates (incremental_index.py)
+# add the vectors of new chunks to a small delta index and tombstone replaced chunks through the
+# chunk store; queries search both indexes and skip deleted ids until compaction merges them.
+# Chunk embeddings are cached on disk by text hash (embedding_cache.py): a rebuild only encodes
+# chunks whose text is not in the cache, and does not load the model at all if every text is.
+# Index types (--index-type): 'flat' (exact brute-force scan), 'hnsw' (IndexHNSWFlat graph),
+# 'ivf' (IndexIVFFlat, inverted lists over k-means cells) and 'ivfpq' (IndexIVFPQ, product-quantized
+# codes). IVF quantizers are trained automatically on the first vectors of the corpus; nprobe and
+# efSearch are query-time knobs (DenseRetriever(nprobe=..., ef_search=...), --nprobe / --ef-search).
+# Compressed types: 'sq8' (IndexScalarQuantizer, one byte per dimension, 4x smaller) and 'binary'
+# (sign bits searched by Hamming distance, 32x smaller). Every build also saves the float vectors
+# to a raw file (row = chunk id, extended by incremental updates) that queries memory-map: the
+# compressed types rescore a shortlist of RESCORE_FACTOR * top_k candidates exactly with it, so only
+# the compressed codes and the touched rows need to be resident, and hybrid_retrieval.py scores any
+# candidate set with it.
+# --report compares recall@k, MRR, latency and memory against the exact index (benchmark_dense_retrieval.py).
+# Queries open the base index memory-mapped (FAISS IO_FLAG_MMAP_IFC for flat / HNSW / sq8 / binary
+# codes, IO_FLAG_MMAP for IVF inverted lists), so worker processes share one page-cache copy.
+# Metadata filters (where=..., see metadata_filter.py) are applied inside the search: the bitset
+# becomes a FAISS IDSelectorBitmap, and filters that allow at most FILTER_SCAN_FRACTION of the
+# chunks are answered by an exact scan of their float vectors instead, which gets faster the more
+# restrictive the filter is and keeps full recall on ANN index types.
 
 # Parameters for embedding model and file paths
 EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
-CHUNKS_PATH = os.path.join(os.getcwd(), 'data', 'wikipedia_chunks.json')
 FAISS_INDEX_PATH = os.path.join(os.getcwd(), 'data', 'faiss_index.bin')
-CHUNK_META_PATH = os.path.join(os.getcwd(), 'data', 'chunk_metadata.json')
+DENSE_MANIFEST_PATH = os.path.join(os.getcwd(), 'data', 'faiss_index.json')
+DENSE_DELTA_PATH = os.path.join(os.getcwd(), 'data', 'faiss_index.delta.bin')  # Vectors added by incremental updates
+DENSE_VECTORS_PATH = os.path.join(os.getcwd(), 'data', 'faiss_vectors.f32')  # Float vectors for exact scoring (row = chunk id)
+BUILD_BATCH_SIZE = 4096  # Chunks read and embedded per step while building
+
+# Approximate nearest-neighbour index parameters
+INDEX_TYPES = ('flat', 'hnsw', 'ivf', 'ivfpq', 'sq8', 'binary')
+TRAINED_TYPES = ('ivf', 'ivfpq', 'sq8')  # Index types that must be trained before vectors are added
+QUANTIZED_TYPES = ('sq8', 'binary')  # Index types whose results are rescored with the float vectors
+HNSW_M = 32                 # Graph neighbours per node
+HNSW_EF_CONSTRUCTION = 80   # Candidate list size while inserting into the graph
+HNSW_EF_SEARCH = 64         # Default candidate list size at query time
+IVF_NPROBE = 16             # Default number of inverted lists scanned per query
+PQ_M = 48                   # Sub-quantizers per vector (bytes per code at 8 bits); must divide the dimension
+PQ_NBITS = 8                # Bits per sub-quantizer code
+TRAIN_POINTS_PER_CENTROID = 64  # Training vectors per IVF list / PQ centroid (FAISS wants at least 39)
+SQ_TRAIN_SIZE = 65536       # Vectors used to fit the int8 value ranges
+RESCORE_FACTOR = 4          # Shortlist size (times top_k) rescored with the float vectors
+FILTER_SCAN_FRACTION = 0.05  # Filters allowing at most this fraction of chunks scan their vectors exactly
+
+
+# Encoder for chunk texts (normalized embeddings); the model is loaded on the first call
+
+class ChunkEncoder:
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self._model = None
+
+    def __call__(self, texts):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            print('Loading embedding model...')
+            self._model = SentenceTransformer(self.model_name)
+        return self._model.encode(texts, batch_size=32, normalize_embeddings=True)
+
+
+# Embed chunk texts through the embedding cache (or directly when cache is None)
+
+def embed_texts(texts, encode, cache=None):
+    embeddings = encode(texts) if cache is None else cache.embed(texts, encode)
+    return np.array(embeddings).astype('float32')
+
+
+# Codes stored by an index type: sign bits packed 8 per byte for 'binary', the float vectors otherwise
+
+def index_codes(index_type, vectors):
+    return np.packbits(vectors > 0, axis=1) if index_type == 'binary' else vectors
+
+
+# Exact inner products of shortlisted ids (-1 = padding) with the float vectors (array or memmap
+# indexed by id); returns the top_k (scores, ids) of each query
+
+def rescore(queries, ids, vectors, top_k):
+    rows = np.asarray(vectors[np.clip(ids, 0, None).ravel()], dtype=np.float32).reshape(*ids.shape, -1)
+    scores = np.einsum('qkd,qd->qk', rows, queries)
+    scores[ids < 0] = -np.inf
+    order = np.argsort(-scores, axis=1, kind='stable')[:, :top_k]
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+# Number of IVF lists for a corpus: about 4 * sqrt(N), keeping at least 39 vectors per list
+
+def default_nlist(num_chunks):
+    return max(1, min(int(4 * math.sqrt(num_chunks)), num_chunks // 39))
+
+
+# Create an empty index of the given type for normalized vectors (inner product = cosine
+# similarity), wrapped in an IndexIDMap so vectors are stored under their chunk ids
+# num_chunks (corpus size) sizes the IVF lists and the training sample.
+# Returns (index, build parameters); 'train_size' is the number of vectors to train on.
+
+def create_index(index_type, dim, num_chunks, nlist=None, pq_m=PQ_M, pq_nbits=PQ_NBITS, hnsw_m=HNSW_M,
+                 ef_construction=HNSW_EF_CONSTRUCTION):
+    import faiss
+    if index_type == 'flat':
+        return faiss.IndexIDMap(faiss.IndexFlatIP(dim)), {}
+    if index_type == 'hnsw':
+        base = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        base.hnsw.efConstruction = ef_construction
+        return faiss.IndexIDMap(base), {'hnsw_m': hnsw_m, 'ef_construction': ef_construction}
+    if index_type == 'sq8':
+        base = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        return faiss.IndexIDMap(base), {'train_size': min(num_chunks, SQ_TRAIN_SIZE)}
+    if index_type == 'binary':
+        if dim % 8:
+            raise ValueError(f"Binary codes need a dimension divisible by 8 (got {dim}).")
+        return faiss.IndexBinaryIDMap(faiss.IndexBinaryFlat(dim)), {}
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r} (choose from {', '.join(INDEX_TYPES)}).")
+    nlist = nlist or default_nlist(num_chunks)
+    quantizer = faiss.IndexFlatIP(dim)
+    if index_type == 'ivf':
+        params = {'nlist': nlist, 'train_size': min(num_chunks, TRAIN_POINTS_PER_CENTROID * nlist)}
+        return faiss.IndexIDMap(faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)), params
+    # Largest sub-quantizer count <= pq_m that divides the dimension; fewer bits on small corpora
+    m = max(d for d in range(1, min(pq_m, dim) + 1) if dim % d == 0)
+    train_size = min(num_chunks, TRAIN_POINTS_PER_CENTROID * max(nlist, 2 ** pq_nbits))
+    nbits = max(1, min(pq_nbits, int(math.log2(max(train_size // 39, 2)))))
+    params = {'nlist': nlist, 'pq_m': m, 'pq_nbits': nbits, 'train_size': train_size}
+    return faiss.IndexIDMap(faiss.IndexIVFPQ(quantizer, dim, nlist, m, nbits, faiss.METRIC_INNER_PRODUCT)), params
+
+
+# FAISS search parameters for an index type: an optional IDSelector plus the query-time knob of
+# the ANN types (nprobe for IVF, efSearch for HNSW). Returns None when there is nothing to set.
+
+def search_parameters(index_type, sel=None, nprobe=None, ef_search=None):
+    import faiss
+    if index_type in ('ivf', 'ivfpq'):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = nprobe or IVF_NPROBE
+    elif index_type == 'hnsw':
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = ef_search or HNSW_EF_SEARCH
+    elif sel is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if sel is not None:
+        params.sel = sel
+    return params
+
+
+# Train an index on the buffered (vectors, ids) batches, then add them
+
+def _train_and_add(index, pending):
+    vectors = np.concatenate([vectors for vectors, _ in pending])
+    print(f'Training {index.__class__.__name__} quantizers on {len(vectors)} vectors...')
+    index.train(vectors)
+    index.add_with_ids(vectors, np.concatenate([ids for _, ids in pending]))
+
+
+# Read a persisted base index (binary indexes have their own FAISS reader)
+# mmap=True maps the vector codes / inverted lists from the file instead of copying them into
+# process memory; the file must then stay in place (rebuilds replace it atomically, so open
+# readers keep the old version).
+
+def read_dense_index(index_path, index_type='flat', mmap=False):
+    import faiss
+    flags = 0
+    if mmap:
+        # IVF inverted lists are mapped by IO_FLAG_MMAP; IO_FLAG_MMAP_IFC maps flat codes
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if index_type in ('ivf', 'ivfpq') else faiss.IO_FLAG_MMAP_IFC
+    if index_type == 'binary':
+        return faiss.read_index_binary(index_path, flags)
+    return faiss.read_index(index_path, flags)
+
+
+# Build the dense index from the chunk corpus and persist it with its metadata and manifest
+# The corpus is streamed in batches of build_batch_size chunks (read -> embed -> add to FAISS), so
+# apart from the index itself memory is set by the batch size, not by the corpus size. IVF types
+# buffer the first train_size vectors (in corpus order) to train their quantizers before adding.
+# Compressed types also stream the float vectors to vectors_path for rescoring.
+# embedding_cache_dir=None disables the embedding cache.
+
+def build_dense_index(chunks_path=CHUNKS_PATH, index_path=FAISS_INDEX_PATH, meta_path=CHUNK_META_PATH,
+                      manifest_path=DENSE_MANIFEST_PATH, model_name=EMBEDDING_MODEL, build_batch_size=BUILD_BATCH_SIZE,
+                      delta_path=DENSE_DELTA_PATH, embedding_cache_dir=EMBEDDING_CACHE_DIR,
+                      embedding_cache_dtype=EMBEDDING_CACHE_DTYPE, index_type='flat', nprobe=IVF_NPROBE,
+                      ef_search=HNSW_EF_SEARCH, vectors_path=DENSE_VECTORS_PATH, **index_params):
+    encode = ChunkEncoder(model_name)
+    cache = EmbeddingCache(model_name, True, embedding_cache_dir, embedding_cache_dtype) if embedding_cache_dir else None
+    # IVF list count and training sample size depend on the corpus size (counted in a cheap first pass)
+    total = sum(1 for _ in iter_chunks(chunks_path)) if index_type in TRAINED_TYPES else None
+
+    # Compute dense embeddings batch by batch and add them to a FAISS index (cosine similarity)
+    print(f'Computing embeddings and building FAISS index ({index_type})...')
+    index = None
+    params = {}
+    pending = []  # Batches buffered until the index is trained
+    num_chunks = 0
+    with open(vectors_path + '.tmp', 'wb') as vectors_file:
+        for batch in batched(iter_chunks(chunks_path), build_batch_size):
+            embeddings = embed_texts([chunk['text'] for chunk in batch], encode, cache)
+            ids = np.arange(num_chunks, num_chunks + len(batch), dtype=np.int64)
+            if index is None:
+                index, params = create_index(index_type, embeddings.shape[1], total, **index_params)
+            vectors_file.write(embeddings.tobytes())
+            codes = index_codes(index_type, embeddings)
+            if index.is_trained:
+                index.add_with_ids(codes, ids)
+            else:
+                pending.append((codes, ids))
+                if sum(len(ids) for _, ids in pending) >= params['train_size']:
+                    _train_and_add(index, pending)
+                    pending = []
+            num_chunks += len(batch)
+            print(f'Embedded {num_chunks} chunks...')
+    if index is None:
+        raise ValueError(f"No chunks found in {chunks_path}.")
+    if pending:
+        _train_and_add(index, pending)
+    if cache is not None:
+        print(f'Embedding cache: {cache.hits} chunks reused, {cache.misses} encoded ({cache.path})')
+    dim = index.d
+
+    # Save the FAISS index to disk (vectors of earlier incremental updates are part of the new index)
+    _write_index(index, index_path)
+    if os.path.exists(delta_path):
+        os.remove(delta_path)
+    os.replace(vectors_path + '.tmp', vectors_path)
+    print(f'Float vectors saved to {vectors_path}')
+    print(f'FAISS index saved to {index_path}')
+
+    # Save chunk metadata (without text) for retrieval and display
+    write_chunk_metadata(iter_chunks(chunks_path), meta_path)
+
+    # Save the manifest last, so a partially written build is never mistaken for a current one
+    write_manifest(manifest_path, {
+        'corpus_fingerprint': corpus_fingerprint(chunks_path),
+        'model': model_name,
+        'normalize_embeddings': True,
+        'index_type': index_type,
+        'index_params': params,
+        'nprobe': min(nprobe, params['nlist']) if 'nlist' in params else None,
+        'ef_search': ef_search if index_type == 'hnsw' else None,
+        'num_chunks': num_chunks,
+        'dim': int(dim),
+    })
+    print(f'Index manifest saved to {manifest_path}')
 
-# Load preprocessed Wikipedia chunks
-with open(CHUNKS_PATH, 'r', encoding='utf-8') as f:
-    chunks = json.load(f)
 
-texts = [chunk['text'] for chunk in chunks]
+# Embed chunk texts with the model recorded in the index manifest (normalized float32 vectors)
 
-# Load the sentence embedding model
-print('Loading embedding model...')
-model = SentenceTransformer(EMBEDDING_MODEL)
+def embed_chunks(chunks, manifest_path=DENSE_MANIFEST_PATH, embedding_cache_dir=EMBEDDING_CACHE_DIR,
+                 embedding_cache_dtype=EMBEDDING_CACHE_DTYPE):
+    manifest = read_manifest(manifest_path)
+    cache = EmbeddingCache(manifest['model'], True, embedding_cache_dir, embedding_cache_dtype) if embedding_cache_dir else None
+    embeddings = embed_texts([chunk['text'] for chunk in chunks], ChunkEncoder(manifest['model']), cache)
+    if cache is not None:
+        print(f'Embedding cache: {cache.hits} chunks reused, {cache.misses} encoded')
+    return embeddings.reshape(len(chunks), manifest['dim'])
 
-# Compute dense embeddings for all chunks
-print('Computing embeddings...')
-embeddings = model.encode(texts, show_progress_bar=True, batch_size=32, normalize_embeddings=True)
-embeddings = np.array(embeddings).astype('float32')
 
-# Build a FAISS index for fast dense retrieval (cosine similarity)
-print('Building FAISS index...')
-dim = embeddings.shape[1]
-index = faiss.IndexFlatIP(dim)  # Cosine similarity (with normalized vectors)
-index.add(embeddings)
+# Write a FAISS index atomically (the tmp file is renamed over the old one)
 
-# Save the FAISS index to disk
-faiss.write_index(index, FAISS_INDEX_PATH)
-print(f'FAISS index saved to {FAISS_INDEX_PATH}')
+def _write_index(index, path):
+    import faiss
+    if isinstance(index, faiss.IndexBinary):
+        faiss.write_index_binary(index, path + '.tmp')
+    else:
+        faiss.write_index(index, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+# Add the vectors of new chunks (ids continuing the row numbers) to the delta index
+# Only the delta index is rewritten, so the cost is proportional to the vectors added since the
+# last compaction. Deleted chunks are not recorded here: the retriever skips the chunk store's
+# tombstones at query time.
+
+def update_dense_index(chunks, embeddings, fingerprint, index_path=FAISS_INDEX_PATH, delta_path=DENSE_DELTA_PATH,
+                       manifest_path=DENSE_MANIFEST_PATH, vectors_path=DENSE_VECTORS_PATH):
+    import faiss
+    manifest = read_manifest(manifest_path)
+    ids = np.array([int(chunk['chunk_id']) for chunk in chunks], dtype=np.int64)
+    if len(ids) and ids[0] != manifest['num_chunks']:
+        raise ValueError(f"New chunk ids must continue the row numbers (expected {manifest['num_chunks']}, got {ids[0]}).")
+    if os.path.exists(delta_path):
+        delta = faiss.read_index(delta_path)
+    else:
+        delta = faiss.IndexIDMap(faiss.IndexFlatIP(manifest['dim']))
+    if len(ids):
+        delta.add_with_ids(embeddings, ids)
+        _write_index(delta, delta_path)
+        _append_vectors(embeddings, manifest, vectors_path)
+    write_manifest(manifest_path, dict(manifest, corpus_fingerprint=fingerprint, num_chunks=manifest['num_chunks'] + len(ids),
+                                       num_delta_chunks=int(delta.ntotal)))
+    print(f'FAISS delta index updated: {len(ids)} vectors added ({delta.ntotal} in {delta_path})')
+
+
+# Append the float vectors of new chunks to the vectors file (rows continue the chunk ids)
+# A file that does not match the index (builds that predate it) is left alone
+
+def _append_vectors(embeddings, manifest, vectors_path=DENSE_VECTORS_PATH):
+    if not os.path.exists(vectors_path):
+        return
+    if os.path.getsize(vectors_path) != manifest['num_chunks'] * manifest['dim'] * 4:
+        print(f'[WARN] {vectors_path} does not match the FAISS index; rebuild it with --build.')
+        return
+    with open(vectors_path, 'ab') as f:
+        f.write(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes())
+
+
+# Chunk ids and vectors of a stored index, in batches (indexes built before IndexIDMap store
+# their vectors in chunk id order)
+
+def _iter_vectors(index, batch_size=BUILD_BATCH_SIZE):
+    import faiss
+    if isinstance(index, faiss.IndexIDMap):
+        ids, flat = faiss.vector_to_array(index.id_map), index.index
+    else:
+        ids, flat = np.arange(index.ntotal, dtype=np.int64), index
+    for start in range(0, index.ntotal, batch_size):
+        count = min(batch_size, index.ntotal - start)
+        yield ids[start:start + count], flat.reconstruct_n(start, count)
+
+
+# Merge the base and delta indexes into a new base index without the deleted chunks
+# deleted is the bool tombstone array over the old chunk ids; live chunks are renumbered in id
+# order, as compaction renumbers the corpus. Flat vectors are copied, never re-embedded. ANN
+# indexes are rebuilt from the compacted corpus at chunks_path instead (quantizers are retrained
+# for the new data and IVF-PQ codes cannot be decoded exactly); their vectors come from the
+# embedding cache.
+
+def compact_dense_index(deleted, fingerprint, index_path=FAISS_INDEX_PATH, delta_path=DENSE_DELTA_PATH,
+                        manifest_path=DENSE_MANIFEST_PATH, chunks_path=CHUNKS_PATH, vectors_path=DENSE_VECTORS_PATH):
+    import faiss
+    manifest = read_manifest(manifest_path)
+    index_type = manifest.get('index_type', 'flat')
+    if index_type != 'flat':
+        index_params = {k: v for k, v in manifest.get('index_params', {}).items()
+                        if k in ('pq_m', 'hnsw_m', 'ef_construction')}
+        build_dense_index(chunks_path, index_path, manifest_path=manifest_path, model_name=manifest['model'],
+                          delta_path=delta_path, index_type=index_type, nprobe=manifest.get('nprobe') or IVF_NPROBE,
+                          ef_search=manifest.get('ef_search') or HNSW_EF_SEARCH, vectors_path=vectors_path, **index_params)
+        return
+    new_ids = np.cumsum(~deleted) - 1  # old chunk id -> new chunk id
+    compacted = faiss.IndexIDMap(faiss.IndexFlatIP(manifest['dim']))
+    sources = [faiss.read_index(index_path)]
+    if os.path.exists(delta_path):
+        sources.append(faiss.read_index(delta_path))
+    with open(vectors_path + '.tmp', 'wb') as vectors_file:
+        # Base ids and delta ids are both ascending, so the live vectors are written in new id order
+        for source in sources:
+            for ids, vectors in _iter_vectors(source):
+                live = ~deleted[ids]
+                compacted.add_with_ids(vectors[live], new_ids[ids[live]])
+                vectors_file.write(np.ascontiguousarray(vectors[live], dtype=np.float32).tobytes())
+    _write_index(compacted, index_path)
+    os.replace(vectors_path + '.tmp', vectors_path)
+    if os.path.exists(delta_path):
+        os.remove(delta_path)
+    manifest.pop('num_delta_chunks', None)
+    write_manifest(manifest_path, dict(manifest, corpus_fingerprint=fingerprint, num_chunks=int(compacted.ntotal)))
+    print(f'FAISS index compacted: {compacted.ntotal} vectors ({int(deleted.sum())} deleted removed)')
+
+
+# Query-side dense retriever
+# Loads the persisted FAISS index (memory-mapped unless mmap=False), chunk store and embedding
+# model on first use and refuses to serve an index whose corpus fingerprint does not match the
+# current chunk file
+
+class DenseRetriever:
+    def __init__(self, index_path=FAISS_INDEX_PATH, store_dir=CHUNK_STORE_DIR,
+                 manifest_path=DENSE_MANIFEST_PATH, chunks_path=CHUNKS_PATH, delta_path=DENSE_DELTA_PATH,
+                 nprobe=None, ef_search=None, rescore=True, vectors_path=DENSE_VECTORS_PATH, mmap=True,
+                 encoder_mode=QUERY_ENCODER):
+        self.index_path = index_path
+        self.store_dir = store_dir
+        self.manifest_path = manifest_path
+        self.chunks_path = chunks_path
+        self.delta_path = delta_path
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.rescore = rescore
+        self.vectors_path = vectors_path
+        self.mmap = mmap
+        self.encoder_mode = encoder_mode
+        self.manifest = None
+        self._index = None
+        self._delta = None
+        self._selectors = []
+        self._params = None
+        self._delta_params = None
+        self._vectors = None
+        self._chunks = None
+
+    def load(self):
+        if self._index is not None:
+            return self
+        import faiss
+        manifest = read_manifest(self.manifest_path)
+        check_fingerprint(manifest, 'dense', self.chunks_path)
+        index_type = manifest.get('index_type', 'flat')
+        index = read_dense_index(self.index_path, index_type, mmap=self.mmap)
+        chunks = ChunkStore(self.store_dir)
+        check_same_corpus(manifest, chunks.manifest, 'dense')
+        num_vectors = index.ntotal
+        if manifest.get('num_delta_chunks'):
+            self._delta = faiss.read_index(self.delta_path)
+            num_vectors += self._delta.ntotal
+        if num_vectors != len(chunks):
+            raise ValueError(f"FAISS index has {num_vectors} vectors but the chunk store has {len(chunks)} chunks.")
+        if os.path.exists(self.vectors_path):
+            if os.path.getsize(self.vectors_path) == num_vectors * manifest['dim'] * 4:
+                self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(num_vectors, manifest['dim']))
+            elif index_type in QUANTIZED_TYPES:
+                raise ValueError(f"{self.vectors_path} does not match the FAISS index; rebuild it with --build.")
+        deleted = chunks.deleted_ids()
+        if len(deleted):
+            # Skip tombstoned chunks inside the search (results stay top_k long)
+            self._selectors = [faiss.IDSelectorBatch(deleted)]
+            self._selectors.append(faiss.IDSelectorNot(self._selectors[0]))  # Referenced here to keep them alive
+        self.manifest = manifest
+        self.set_search_params(self.nprobe, self.ef_search)
+        self._chunks = chunks
+        self._index = index
+        return self
+
+    # Query-time accuracy/speed trade-off of the ANN index types: nprobe (IVF lists scanned) and
+    # ef_search (HNSW candidate list size); None uses the value recorded at build time.
+    # rescore=False returns the compressed scores of 'sq8' / 'binary' indexes as they are;
+    # rescore=None keeps the current setting.
+    def set_search_params(self, nprobe=None, ef_search=None, rescore=None):
+        self.nprobe, self.ef_search = nprobe, ef_search
+        if rescore is not None:
+            self.rescore = rescore
+        if self.manifest is None:
+            return  # Applied on load
+        sel = self._selectors[-1] if self._selectors else None
+        self._params = search_parameters(self.manifest.get('index_type', 'flat'), sel,
+                                         nprobe or self.manifest.get('nprobe'), ef_search or self.manifest.get('ef_search'))
+        self._delta_params = search_parameters('flat', sel)  # The delta index is always flat
+
+    @property
+    def index(self):
+        return self.load()._index
+
+    @property
+    def chunks(self):
+        return self.load()._chunks
+
+    # Memory-mapped float vectors of all chunks (row = chunk id), or None for indexes built
+    # without the vectors file
+    @property
+    def vectors(self):
+        return self.load()._vectors
+
+    # Process-wide query encoder of the index's model (query_encoder.py; SentenceTransformer as the
+    # index was built unless QUERY_ENCODER or encoder_mode selects 'fp32' / 'int8')
+    @property
+    def query_encoder(self):
+        return get_query_encoder(self.load().manifest['model'], self.encoder_mode)
+
+    # Given a query, returns top_k most similar chunks with scores
+    # where: metadata filter expression or bitset (metadata_filter.py) restricting the chunks
+    def search(self, query, top_k=5, where=None):
+        return self.search_batch([query], top_k=top_k, where=where)[0]
+
+    # Batched search: all queries are encoded in one query encoder call and searched with a
+    # single index.search call; returns one result list per query
+    def search_batch(self, queries, top_k=5, batch_size=32, where=None):
+        D, I = self.top_k(self.encode(queries, batch_size), top_k, where)
+        batch_results = []
+        for row_ids, row_scores in zip(I, D):
+            results = []
+            for idx, score in zip(row_ids, row_scores):
+                if idx < 0:
+                    continue  # FAISS pads with -1 when fewer than top_k vectors exist
+                meta = self.chunks.meta(idx)
+                meta['score'] = float(score)
+                results.append(meta)
+            batch_results.append(results)
+        return batch_results
+
+    # Normalized float32 query embeddings, one row per query (recent queries come from the cache)
+    def encode(self, queries, batch_size=32):
+        return self.query_encoder.encode(queries, batch_size)
+
+    # Top_k (scores, chunk ids) of query embeddings over the base and delta indexes, without
+    # chunk metadata; ids are -1 where fewer than top_k live (and allowed) chunks exist
+    def top_k(self, q_emb, top_k, where=None):
+        self.load()
+        params, delta_params = self._params, self._delta_params
+        if where is not None:
+            allowed = compile_filter(where, self.chunks)
+            if self.chunks.deleted is not None:
+                allowed = allowed & ~self.chunks.deleted
+            ids = np.flatnonzero(allowed)
+            if self._vectors is not None and len(ids) <= FILTER_SCAN_FRACTION * len(allowed):
+                return self._scan(q_emb, ids, top_k)
+            params, delta_params, selector = self._filter_params(allowed)  # selector: keep alive until searched
+        D, I = self._search_base(q_emb, top_k, params)
+        if self._delta is not None:
+            # Merge the top_k of the base and delta indexes by score (base first on ties)
+            delta_D, delta_I = self._delta.search(q_emb, top_k, params=delta_params)
+            D, I = np.hstack([D, delta_D]), np.hstack([I, delta_I])
+            order = np.argsort(-D, axis=1, kind='stable')[:, :top_k]
+            D, I = np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+        return D, I
+
+    # Search parameters restricted to the chunks of a bitset (IDSelectorBitmap over chunk ids);
+    # returns (base params, delta params, objects that must stay alive during the search)
+    def _filter_params(self, allowed):
+        import faiss
+        bits = np.packbits(allowed, bitorder='little')
+        sel = faiss.IDSelectorBitmap(len(allowed), faiss.swig_ptr(bits))
+        index_type = self.manifest.get('index_type', 'flat')
+        params = search_parameters(index_type, sel, self.nprobe or self.manifest.get('nprobe'),
+                                   self.ef_search or self.manifest.get('ef_search'))
+        return params, search_parameters('flat', sel), (bits, sel)
+
+    # Exact top_k of a small set of chunk ids from the memory-mapped float vectors (rows gathered
+    # in id order); ties keep the lower chunk id first, short results are padded with -1
+    def _scan(self, q_emb, ids, top_k):
+        scores = self._vectors[ids] @ q_emb.T
+        D = np.full((len(q_emb), top_k), -np.inf, dtype=np.float32)
+        I = np.full((len(q_emb), top_k), -1, dtype=np.int64)
+        for row in range(len(q_emb)):
+            top = top_n_indices(scores[:, row], top_k, tie_key=ids)
+            D[row, :len(top)], I[row, :len(top)] = scores[top, row], ids[top]
+        return D, I
+
+    # Top_k (scores, ids) of the base index; compressed indexes search a shortlist and rescore it
+    # with the memory-mapped float vectors
+    def _search_base(self, q_emb, top_k, params=None):
+        index_type = self.load().manifest.get('index_type', 'flat')
+        rescoring = self.rescore and index_type in QUANTIZED_TYPES and self._vectors is not None
+        D, I = self.index.search(index_codes(index_type, q_emb), top_k * RESCORE_FACTOR if rescoring else top_k,
+                                 params=params or self._params)
+        if rescoring:
+            return rescore(q_emb, I, self._vectors, top_k)
+        if index_type == 'binary':
+            # Hamming distance -> approximate cosine similarity (angle ~ pi * differing bits / dim)
+            D = np.cos(np.pi * D / self.manifest['dim']).astype(np.float32)
+        return D, I
+
+
+# Process-wide retriever used by retrieve_dense (created on first query)
+_default_retriever = None
+
+
+def get_dense_retriever():
+    global _default_retriever
+    if _default_retriever is None:
+        _default_retriever = DenseRetriever()
+    return _default_retriever
 
-# Save chunk metadata (without text) for retrieval and display
-chunk_meta = [{k: v for k, v in chunk.items() if k != 'text'} for chunk in chunks]
-with open(CHUNK_META_PATH, 'w', encoding='utf-8') as f:
-    json.dump(chunk_meta, f, indent=2, ensure_ascii=False)
-print(f'Chunk metadata saved to {CHUNK_META_PATH}')
 
 # Example dense retrieval function for interactive use
-# Given a query, returns top_k most similar chunks with scores
-
-def retrieve_dense(query, top_k=5):
-    q_emb = model.encode([query], normalize_embeddings=True)
-    D, I = index.search(np.array(q_emb).astype('float32'), top_k)
-    results = []
-    for idx, score in zip(I[0], D[0]):
-        meta = chunk_meta[idx]
-        meta['score'] = float(score)
-        results.append(meta)
-    return results
+# Given a query, returns top_k most similar chunks with scores (where: optional metadata filter)
+
+def retrieve_dense(query, top_k=5, where=None):
+    return get_dense_retriever().search(query, top_k=top_k, where=where)
+
+
+# Batched dense retrieval: returns one result list per query (same results as retrieve_dense,
+# up to float rounding of padded batch encoding)
+
+def retrieve_dense_batch(queries, top_k=5, where=None):
+    return get_dense_retriever().search_batch(queries, top_k=top_k, where=where)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build or query the dense FAISS index.")
+    parser.add_argument('--build', action='store_true', help='Embed the corpus and (re)build the persisted index')
+    parser.add_argument('--no-embedding-cache', action='store_true', help='Encode every chunk instead of reusing cached embeddings')
+    parser.add_argument('--embedding-cache-dtype', choices=['float32', 'float16'], default=EMBEDDING_CACHE_DTYPE,
+                        help='Storage precision of the embedding cache')
+    parser.add_argument('--index-type', choices=INDEX_TYPES, default='flat', help='FAISS index type to build')
+    parser.add_argument('--nlist', type=int, default=None, help='IVF lists (default: about 4 * sqrt(chunks))')
+    parser.add_argument('--pq-m', type=int, default=PQ_M, help='IVF-PQ sub-quantizers per vector')
+    parser.add_argument('--pq-nbits', type=int, default=PQ_NBITS, help='IVF-PQ bits per sub-quantizer code')
+    parser.add_argument('--hnsw-m', type=int, default=HNSW_M, help='HNSW neighbours per node')
+    parser.add_argument('--ef-construction', type=int, default=HNSW_EF_CONSTRUCTION, help='HNSW candidate list size while building')
+    parser.add_argument('--nprobe', type=int, default=None, help=f'IVF lists scanned per query (build default: {IVF_NPROBE})')
+    parser.add_argument('--ef-search', type=int, default=None, help=f'HNSW candidate list size per query (build default: {HNSW_EF_SEARCH})')
+    parser.add_argument('--no-rescore', action='store_true', help='Do not rescore sq8/binary results with the float vectors')
+    parser.add_argument('--report', action='store_true',
+                        help='After building, compare recall@k, latency and memory with the exact index on generated_qa_pairs.json')
+    args = parser.parse_args()
+    if args.build:
+        build_dense_index(embedding_cache_dir=None if args.no_embedding_cache else EMBEDDING_CACHE_DIR,
+                          embedding_cache_dtype=args.embedding_cache_dtype, index_type=args.index_type,
+                          nprobe=args.nprobe or IVF_NPROBE, ef_search=args.ef_search or HNSW_EF_SEARCH, nlist=args.nlist,
+                          pq_m=args.pq_m, pq_nbits=args.pq_nbits, hnsw_m=args.hnsw_m, ef_construction=args.ef_construction)
+        if args.report:
+            from benchmark_dense_retrieval import report_persisted_index
+            report_persisted_index()
+    get_dense_retriever().set_search_params(args.nprobe, args.ef_search, rescore=not args.no_rescore)
     # Example usage: interactive query
     if sys.stdin.isatty():
         # Interactive mode: allow user to query
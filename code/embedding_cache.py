@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+# =====================================
+# Persistent Embedding Cache
+# =====================================
+# On-disk cache of chunk embeddings, so rebuilding the dense index after a small corpus change only
+# encodes the chunks whose text actually changed. Entries are keyed by (model id, normalization
+# flag, sha256 of the text); each (model, normalization, storage dtype) combination gets its own
+# directory under data/embedding_cache/:
+#   meta.json     {model, normalize_embeddings, dtype, dim}
+#   vectors.bin   row-major matrix of cached vectors (float32 or float16), memory-mapped for reads
+#   hashes.bin    32-byte sha256 text digests, one per row (the hash -> row index is built at open)
+# Both files are append-only; a row only counts once its hash is written, so an interrupted run
+# never leaves a half-written vector in the cache.
+# Usage: python code/embedding_cache.py  (prints cache statistics)
+
+EMBEDDING_CACHE_DIR = os.path.join(os.getcwd(), 'data', 'embedding_cache')
+EMBEDDING_CACHE_DTYPE = 'float32'  # float16 halves the cache size (vectors are rounded to fp16)
+VECTORS_FILE = 'vectors.bin'
+HASHES_FILE = 'hashes.bin'
+META_FILE = 'meta.json'
+HASH_SIZE = 32
+
+
+# Cache key of a text (sha256 of its UTF-8 bytes)
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+# Directory holding the cache of one model / normalization / storage dtype
+
+def cache_path(cache_dir, model_name, normalize, dtype):
+    key = json.dumps({'model': model_name, 'normalize_embeddings': normalize, 'dtype': dtype}, sort_keys=True)
+    name = model_name.replace('/', '__')
+    return os.path.join(cache_dir, f"{name}-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:12]}")
+
+
+class EmbeddingCache:
+    def __init__(self, model_name, normalize=True, cache_dir=EMBEDDING_CACHE_DIR, dtype=EMBEDDING_CACHE_DTYPE):
+        self.model_name = model_name
+        self.normalize = normalize
+        self.dtype = np.dtype(dtype)
+        self.path = cache_path(cache_dir, model_name, normalize, self.dtype.name)
+        self.dim = None
+        self.rows = {}  # text hash -> row
+        self.hits = 0
+        self.misses = 0
+        self._vectors = None
+        meta_path = os.path.join(self.path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                self.dim = json.load(f)['dim']
+            with open(os.path.join(self.path, HASHES_FILE), 'rb') as f:
+                hashes = f.read()
+            row_bytes = self.dim * self.dtype.itemsize
+            num_rows = min(len(hashes) // HASH_SIZE, os.path.getsize(os.path.join(self.path, VECTORS_FILE)) // row_bytes)
+            self.rows = {hashes[i * HASH_SIZE:(i + 1) * HASH_SIZE]: i for i in range(num_rows)}
+            self._truncate(num_rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    # Drop a torn tail left by an interrupted append
+    def _truncate(self, num_rows):
+        for name, size in ((HASHES_FILE, num_rows * HASH_SIZE), (VECTORS_FILE, num_rows * self.dim * self.dtype.itemsize)):
+            path = os.path.join(self.path, name)
+            if os.path.getsize(path) > size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+
+    # Memory-mapped view of the cached vectors (re-mapped after appends)
+    def vectors(self):
+        if self._vectors is None or len(self._vectors) < len(self.rows):
+            self._vectors = np.memmap(os.path.join(self.path, VECTORS_FILE), dtype=self.dtype, mode='r',
+                                      shape=(len(self.rows), self.dim)) if self.rows else None
+        return self._vectors
+
+    def _append(self, hashes, vectors):
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, META_FILE), 'w', encoding='utf-8') as f:
+                json.dump({'model': self.model_name, 'normalize_embeddings': self.normalize,
+                           'dtype': self.dtype.name, 'dim': self.dim}, f, indent=2)
+        with open(os.path.join(self.path, VECTORS_FILE), 'ab') as f:
+            f.write(np.ascontiguousarray(vectors, dtype=self.dtype).tobytes())
+        with open(os.path.join(self.path, HASHES_FILE), 'ab') as f:
+            f.write(b''.join(hashes))
+        for h in hashes:
+            self.rows[h] = len(self.rows)
+
+    # Embeddings (float32, one row per text) of a list of texts
+    # Cached texts are read from the cache; the others (each distinct text once) are encoded with
+    # encode(list of texts) -> array and added to the cache
+    def embed(self, texts, encode):
+        hashes = [text_hash(text) for text in texts]
+        missing = {}
+        for text, h in zip(texts, hashes):
+            if h not in self.rows and h not in missing:
+                missing[h] = text
+        if missing:
+            encoded = np.asarray(encode(list(missing.values())), dtype=np.float32)
+            self._append(list(missing), encoded)
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return np.asarray(self.vectors()[[self.rows[h] for h in hashes]], dtype=np.float32)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Show statistics of the embedding cache.")
+    parser.add_argument('--cache-dir', default=EMBEDDING_CACHE_DIR, help='Embedding cache directory')
+    args = parser.parse_args()
+    names = sorted(os.listdir(args.cache_dir)) if os.path.isdir(args.cache_dir) else []
+    if not names:
+        print(f"[INFO] No embedding cache at {args.cache_dir}.")
+    for name in names:
+        meta_path = os.path.join(args.cache_dir, name, META_FILE)
+        if not os.path.exists(meta_path):
+            continue
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        num_rows = os.path.getsize(os.path.join(args.cache_dir, name, HASHES_FILE)) // HASH_SIZE
+        size = os.path.getsize(os.path.join(args.cache_dir, name, VECTORS_FILE))
+        print(f"[INFO] {meta['model']} (normalize={meta['normalize_embeddings']}, {meta['dtype']}, dim {meta['dim']}): "
+              f"{num_rows} vectors ({size / 1e6:.1f} MB)")
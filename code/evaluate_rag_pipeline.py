@@ -1,8 +1,9 @@
 import json
 import os
 import csv
-from generate_response_llm import build_context, generate_answer
-from reciprocal_rank_fusion import reciprocal_rank_fusion, retrieve_dense, retrieve_sparse
+from evaluation_metrics import QA_PATH, compute_f1, compute_mrr
+from generate_response_llm import generate_answers
+from hybrid_retrieval import get_hybrid_retriever
 from rouge_score import rouge_scorer
 from sklearn.metrics import f1_score
 import numpy as np
@@ -14,7 +15,6 @@ import numpy as np
 # It computes MRR, F1, and ROUGE-L metrics for each question, saves results, and prints a summary.
 
 # File paths and evaluation parameters
-QA_PATH = os.path.join(os.getcwd(), 'data', 'generated_qa_pairs.json')
 RESULTS_PATH = os.path.join(os.getcwd(), 'data', 'evaluation_results.json')
 CSV_PATH = os.path.join(os.getcwd(), 'data', 'evaluation_results.csv')
 TOP_K = 10  # Number of top chunks to retrieve for evaluation
@@ -26,37 +26,21 @@ with open(QA_PATH, 'r', encoding='utf-8') as f:
 # Initialize ROUGE scorer
 scorer = rouge_scorer.RougeScorer(['rougeL'], use_stemmer=True)
 
-# Compute F1 score between predicted and ground truth answers (token overlap)
-def compute_f1(pred, gt):
-    pred_tokens = pred.lower().split()
-    gt_tokens = gt.lower().split()
-    common = set(pred_tokens) & set(gt_tokens)
-    if not pred_tokens or not gt_tokens:
-        return 0.0
-    precision = len(common) / len(pred_tokens)
-    recall = len(common) / len(gt_tokens)
-    if precision + recall == 0:
-        return 0.0
-    return 2 * (precision * recall) / (precision + recall)
+# Retrieve the top-K chunks for all questions at once with the hybrid scorer build_context uses
+# (dense and BM25 scores of one candidate set, fused with RRF)
+questions = [qa['question'] for qa in qa_pairs]
+all_fused = get_hybrid_retriever().search_batch(questions, top_n=TOP_K)
 
-# Compute Mean Reciprocal Rank (MRR) for retrieval
-# Returns 1/rank if the correct source URL is in the top-K, else 0
-def compute_mrr(gt_url, retrieved_chunks):
-    for rank, chunk in enumerate(retrieved_chunks, 1):
-        if chunk['url'] == gt_url:
-            return 1.0 / rank
-    return 0.0
+# Generate all answers with the LLM in padded batches (same answers as one prompt at a time);
+# each prompt holds the highest-ranked fused chunks that fit the token budget
+print(f"Generating {len(questions)} answers...")
+pred_answers = generate_answers(questions, all_fused)
 
 results = []
 for i, qa in enumerate(qa_pairs):
     print(f"Evaluating Q{i+1}/{len(qa_pairs)}: {qa['question']}")
-    # Retrieve top-K chunks using dense, sparse, and RRF fusion
-    dense_results = retrieve_dense(qa['question'], top_k=TOP_K)
-    sparse_results = retrieve_sparse(qa['question'], top_k=TOP_K)
-    fused = reciprocal_rank_fusion(dense_results, sparse_results, k=60, top_n=TOP_K)
-    # Generate answer using the LLM and retrieved context
-    context = "\n\n".join([f"Source: {r['title']}\n{r['text']}" for r in fused])
-    pred_answer = generate_answer(qa['question'], context)
+    fused = all_fused[i]
+    pred_answer = pred_answers[i]
     # Compute evaluation metrics
     mrr = compute_mrr(qa['source_url'], fused)
     f1 = compute_f1(pred_answer, qa['answer'])
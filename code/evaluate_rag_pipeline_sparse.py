@@ -1,51 +1,40 @@
 # Sparse Only Ablation
 import json
 import os
-from generate_response_llm import build_context, generate_answer
-from reciprocal_rank_fusion import retrieve_sparse
+from evaluation_metrics import QA_PATH, compute_f1, compute_mrr
+from generate_response_llm import generate_answers
+from reciprocal_rank_fusion import retrieve_sparse_batch
+from chunk_store import get_chunk_store
 from rouge_score import rouge_scorer
 import numpy as np
 
 
-QA_PATH = os.path.join(os.getcwd(), 'data', 'generated_qa_pairs.json')
 RESULTS_PATH = os.path.join(os.getcwd(), 'data', 'evaluation_results_sparse.json')
 TOP_K = 10
 
 with open(QA_PATH, 'r', encoding='utf-8') as f:
     qa_pairs = json.load(f)
-# Load all chunks for text lookup
-with open('data/wikipedia_chunks.json', 'r', encoding='utf-8') as f_chunks:
-    all_chunks = json.load(f_chunks)
-chunkid_to_text = {str(c['chunk_id']): c['text'] for c in all_chunks}
+# Memory-mapped chunk store for text lookup
+chunk_store = get_chunk_store()
 
 scorer = rouge_scorer.RougeScorer(['rougeL'], use_stemmer=True)
 
-def compute_f1(pred, gt):
-    pred_tokens = pred.lower().split()
-    gt_tokens = gt.lower().split()
-    common = set(pred_tokens) & set(gt_tokens)
-    if not pred_tokens or not gt_tokens:
-        return 0.0
-    precision = len(common) / len(pred_tokens)
-    recall = len(common) / len(gt_tokens)
-    if precision + recall == 0:
-        return 0.0
-    return 2 * (precision * recall) / (precision + recall)
+# Retrieve top-K chunks for all questions in one batched call
+all_sparse_results = retrieve_sparse_batch([qa['question'] for qa in qa_pairs], top_k=TOP_K)
 
-def compute_mrr(gt_url, retrieved_chunks):
-    for rank, chunk in enumerate(retrieved_chunks, 1):
-        if chunk['url'] == gt_url:
-            return 1.0 / rank
-    return 0.0
+for sparse_results in all_sparse_results:
+    for r in sparse_results:
+        r['text'] = chunk_store.text(r['chunk_id'])
+
+# Generate all answers in padded batches (same answers as one prompt at a time)
+print(f"Generating {len(qa_pairs)} answers...")
+pred_answers = generate_answers([qa['question'] for qa in qa_pairs], all_sparse_results)
 
 results = []
 for i, qa in enumerate(qa_pairs):
     print(f"Evaluating Q{i+1}/{len(qa_pairs)}: {qa['question']}")
-    sparse_results = retrieve_sparse(qa['question'], top_k=TOP_K)
-    for r in sparse_results:
-        r['text'] = chunkid_to_text.get(str(r['chunk_id']), '')
-    context = "\n\n".join([f"Source: {r['title']}\n{r['text']}" for r in sparse_results])
-    pred_answer = generate_answer(qa['question'], context)
+    sparse_results = all_sparse_results[i]
+    pred_answer = pred_answers[i]
     mrr = compute_mrr(qa['source_url'], sparse_results)
     f1 = compute_f1(pred_answer, qa['answer'])
     rouge = scorer.score(qa['answer'], pred_answer)['rougeL'].fmeasure
@@ -0,0 +1,35 @@
+import os
+
+# =====================================
+# Evaluation Metrics
+# =====================================
+# Location of the generated Q&A dataset and the answer / retrieval metrics shared by the
+# evaluation scripts (evaluate_rag_pipeline*.py) and the benchmarks that score answers
+# (fid_generation.py, model_loading.py) or read the questions.
+
+QA_PATH = os.path.join(os.getcwd(), 'data', 'generated_qa_pairs.json')
+
+
+# Compute F1 score between predicted and ground truth answers (token overlap)
+
+def compute_f1(pred, gt):
+    pred_tokens = pred.lower().split()
+    gt_tokens = gt.lower().split()
+    common = set(pred_tokens) & set(gt_tokens)
+    if not pred_tokens or not gt_tokens:
+        return 0.0
+    precision = len(common) / len(pred_tokens)
+    recall = len(common) / len(gt_tokens)
+    if precision + recall == 0:
+        return 0.0
+    return 2 * (precision * recall) / (precision + recall)
+
+
+# Compute Mean Reciprocal Rank (MRR) for retrieval
+# Returns 1/rank if the correct source URL is in the top-K, else 0
+
+def compute_mrr(gt_url, retrieved_chunks):
+    for rank, chunk in enumerate(retrieved_chunks, 1):
+        if chunk['url'] == gt_url:
+            return 1.0 / rank
+    return 0.0
@@ -0,0 +1,200 @@
+import argparse
+import json
+import time
+from collections import OrderedDict
+import numpy as np
+import torch
+from rouge_score import rouge_scorer
+from transformers.modeling_outputs import BaseModelOutput
+from evaluation_metrics import QA_PATH, compute_f1
+from generate_response_llm import (GENERATION_BATCH_SIZE, MAX_ANSWER_TOKENS, MODEL_NAME, build_context, build_prompt,
+                                   chunk_block, chunk_token_count, generate_answer, get_model, get_tokenizer, load_worker,
+                                   select_chunks)
+
+# =====================================
+# Fusion-in-Decoder Style Generation
+# =====================================
+# Optional generation mode that runs the Flan-T5 encoder on every retrieved chunk separately
+# instead of on one ~1000-token prompt, concatenates the per-chunk encoder states and lets the
+# decoder attend over all of them (Fusion-in-Decoder). Self-attention cost drops from quadratic in
+# the whole prompt to quadratic per passage, and chunk encodings can be reused across queries:
+#   cached  the question (instruction + "Question: ... Answer:") is one segment and every chunk is
+#           encoded on its own behind the question-independent prefix FID_CHUNK_PREFIX. Chunk states
+#           do not depend on the query, so they are kept in an LRU keyed by (model, chunk id,
+#           prefix); popular chunks (e.g. the intro chunk of an article) skip the encoder entirely.
+#   joint   every chunk is encoded together with the instruction and question (FiD as published).
+#           The states depend on the query, so nothing is cached.
+# Both modes use the chunks that select_chunks packs into the single prompt, so answers differ
+# from generate_answer only by how the context is encoded. Flan-T5 was not trained on
+# concatenated passage encodings; --evaluate compares F1 / ROUGE-L and latency against the
+# single-prompt path on generated_qa_pairs.json before the mode is used for serving.
+# Usage:
+#   python code/fid_generation.py [--mode cached]
+#   python code/fid_generation.py --evaluate [--max-queries 32]
+
+FID_MODES = ('cached', 'joint')
+FID_CHUNK_PREFIX = 'Context:\n'
+FID_PASSAGE_TOKENS = 512  # Tokens per encoded segment (chunks are ~300 words)
+FID_CACHE_SIZE = 128  # Chunk encodings kept per process (~1MB each for flan-t5-base)
+
+_encodings = OrderedDict()  # (model, chunk id, prefix) -> encoder states (tokens x d_model)
+cache_stats = {'hits': 0, 'misses': 0}
+
+
+# Encoder states of several texts in one padded encoder call, one (tokens x d_model) tensor each
+# (padding is masked out and cut off, so every segment gets the states of encoding it alone)
+
+def encode_segments(texts):
+    tokenizer = get_tokenizer()
+    inputs = tokenizer(texts, truncation=True, max_length=FID_PASSAGE_TOKENS, padding=True, return_tensors='pt')
+    with torch.inference_mode():
+        states = get_model().get_encoder()(**inputs).last_hidden_state
+    return [s[:n] for s, n in zip(states, inputs['attention_mask'].sum(dim=1).tolist())]
+
+
+# Encoder states of chunks behind FID_CHUNK_PREFIX, from the LRU where possible
+# Chunks without a chunk store id and truncated copies are encoded every time
+
+def chunk_encodings(chunks):
+    keys = [None if chunk.get('truncated') or 'chunk_id' not in chunk
+            else (MODEL_NAME, int(chunk['chunk_id']), FID_CHUNK_PREFIX) for chunk in chunks]
+    states = [None] * len(chunks)
+    for i, key in enumerate(keys):
+        if key in _encodings:
+            _encodings.move_to_end(key)
+            states[i] = _encodings[key]
+    missing = [i for i, s in enumerate(states) if s is None]
+    cache_stats['hits'] += len(chunks) - len(missing)
+    cache_stats['misses'] += len(missing)
+    if missing:
+        encoded = encode_segments([FID_CHUNK_PREFIX + chunk_block(chunks[i]) for i in missing])
+        for i, s in zip(missing, encoded):
+            states[i] = s
+            if keys[i] is not None:
+                _encodings[keys[i]] = s
+                if len(_encodings) > FID_CACHE_SIZE:
+                    _encodings.popitem(last=False)
+    return states
+
+
+def clear_cache():
+    _encodings.clear()
+    cache_stats.update(hits=0, misses=0)
+
+
+# Joint-mode passage of a query and one chunk, at most max_tokens tokens long
+# Like pack_prompt, the chunk text is cut (from its end) instead of the prompt, so the instruction
+# and the "Question: ... Answer:" tail are always encoded; the passage is checked after cutting,
+# since tokens can merge across the cut.
+
+def joint_passage(query, chunk, max_tokens=FID_PASSAGE_TOKENS):
+    tokenizer = get_tokenizer()
+    prompt = build_prompt(query, chunk_block(chunk))
+    excess = len(tokenizer(prompt)['input_ids']) - max_tokens
+    if excess <= 0:
+        return prompt
+    ids = tokenizer(chunk_block(chunk), add_special_tokens=False)['input_ids']
+    keep = len(ids) - excess
+    while keep > 0:
+        prompt = build_prompt(query, tokenizer.decode(ids[:keep], skip_special_tokens=True))
+        if len(tokenizer(prompt)['input_ids']) <= max_tokens:
+            return prompt
+        keep -= 1
+    return build_prompt(query, '')
+
+
+# Concatenated encoder states of a query and its packed chunks
+def encoder_states(query, chunks, mode='cached'):
+    if mode not in FID_MODES:
+        raise ValueError(f"Unknown FiD mode '{mode}'. Choose one of {FID_MODES}.")
+    if mode == 'joint':
+        segments = encode_segments([joint_passage(query, chunk) for chunk in chunks] or [build_prompt(query, '')])
+    else:
+        segments = encode_segments([build_prompt(query, '')]) + chunk_encodings(chunks)
+    return torch.cat(segments)
+
+
+# Generate answers for many (query, ranked chunks) pairs from per-chunk encodings
+# Queries are sorted by their estimated encoder length, so each batch pads little; the states of
+# a batch are padded with zeros and masked out of the decoder's cross-attention. Returns answers
+# in the input order, decoded as generate_answers does.
+
+def generate_answers_fid(queries, chunk_lists, mode='cached', batch_size=GENERATION_BATCH_SIZE):
+    packed = [select_chunks(query, chunks) for query, chunks in zip(queries, chunk_lists)]
+    order = sorted(range(len(queries)), key=lambda i: -sum(chunk_token_count(chunk) for chunk in packed[i]))
+    tokenizer, model = get_tokenizer(), get_model()
+    answers = [None] * len(queries)
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        states = [encoder_states(queries[i], packed[i], mode) for i in batch]
+        width = max(len(s) for s in states)
+        hidden = states[0].new_zeros((len(batch), width, states[0].shape[-1]))
+        mask = torch.zeros((len(batch), width), dtype=torch.long)
+        for row, s in enumerate(states):
+            hidden[row, :len(s)] = s
+            mask[row, :len(s)] = 1
+        with torch.inference_mode():
+            outputs = model.generate(encoder_outputs=BaseModelOutput(last_hidden_state=hidden), attention_mask=mask,
+                                     max_length=MAX_ANSWER_TOKENS, do_sample=False)
+        for i, output in zip(batch, outputs):
+            answers[i] = tokenizer.decode(output, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+    return answers
+
+
+# Generate an answer to a query from its ranked chunks with per-chunk encodings
+def generate_answer_fid(query, chunks, mode='cached'):
+    return generate_answers_fid([query], [chunks], mode=mode, batch_size=1)[0]
+
+
+# F1 / ROUGE-L against the reference answers and per-request generation latency of the
+# single-prompt path and both FiD modes, one request at a time (contexts from build_context)
+
+def evaluate(max_queries=32, modes=FID_MODES, qa_path=QA_PATH):
+    load_worker()  # So the first timed request does not load the model
+    with open(qa_path, 'r', encoding='utf-8') as f:
+        qa_pairs = json.load(f)[:max_queries]
+    questions = [qa['question'] for qa in qa_pairs]
+    contexts = [build_context(question)[1] for question in questions]
+    scorer = rouge_scorer.RougeScorer(['rougeL'], use_stemmer=True)
+    paths = [('single prompt', generate_answer)]
+    paths += [(f'fid {mode}', lambda query, chunks, mode=mode: generate_answer_fid(query, chunks, mode)) for mode in modes]
+    clear_cache()
+    reference = None
+    print(f"[LOG] {len(questions)} questions, generation only (retrieval not timed)")
+    print(f"{'path':>14} | {'F1':>6} {'ROUGE-L':>7} | {'same':>5} | {'p50':>8} {'mean':>8}")
+    for name, fn in paths:
+        answers, latencies = [], []
+        for question, chunks in zip(questions, contexts):
+            start = time.perf_counter()
+            answers.append(fn(question, chunks))
+            latencies.append((time.perf_counter() - start) * 1000)
+        reference = reference or answers
+        f1 = np.mean([compute_f1(a, qa['answer']) for a, qa in zip(answers, qa_pairs)])
+        rouge = np.mean([scorer.score(qa['answer'], a)['rougeL'].fmeasure for a, qa in zip(answers, qa_pairs)])
+        same = np.mean([a == b for a, b in zip(answers, reference)])
+        print(f"{name:>14} | {f1:>6.4f} {rouge:>7.4f} | {same:>5.0%} | "
+              f"{np.percentile(latencies, 50):>6.0f}ms {np.mean(latencies):>6.0f}ms")
+    lookups = cache_stats['hits'] + cache_stats['misses']
+    if lookups:
+        print(f"[LOG] Chunk encoding cache: {cache_stats['hits']}/{lookups} hits "
+              f"({cache_stats['hits'] / lookups:.0%}), {len(_encodings)} encodings kept")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fusion-in-Decoder style generation with cached chunk encodings.")
+    parser.add_argument('--mode', choices=FID_MODES, default='cached', help='How chunks are encoded')
+    parser.add_argument('--evaluate', action='store_true',
+                        help='Compare F1 / ROUGE-L and latency with the single-prompt path on generated_qa_pairs.json')
+    parser.add_argument('--max-queries', type=int, default=32, help='Number of questions from generated_qa_pairs.json')
+    args = parser.parse_args()
+    if args.evaluate:
+        evaluate(args.max_queries)
+    else:
+        load_worker()
+        # Example usage: interactive query
+        query = input('Enter your query: ')
+        context, fused = build_context(query)
+        print('\n--- Context Used ---')
+        print(context)
+        print('\n--- Generating Answer ---')
+        print(f'\nAnswer:\n{generate_answer_fid(query, fused, args.mode)}')
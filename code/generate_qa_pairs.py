@@ -1,8 +1,11 @@
 import json
 import os
 import random
-from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM
+from transformers import pipeline
 import torch
+from evaluation_metrics import QA_PATH
+from index_artifacts import CHUNKS_PATH, iter_chunks
+from model_loading import load_seq2seq, load_stats
 
 # =====================================
 # Automated Q&A Pair Generation Script
@@ -12,13 +15,10 @@ import torch
 
 # Model and data parameters
 MODEL_NAME = 'google/flan-t5-base'
-CHUNKS_PATH = os.path.join(os.getcwd(), 'data', 'wikipedia_chunks.json')
-QA_PATH = os.path.join(os.getcwd(), 'data', 'generated_qa_pairs.json')
 NUM_QA = 100  # Number of Q&A pairs to generate
 
 # Load preprocessed Wikipedia chunks
-with open(CHUNKS_PATH, 'r', encoding='utf-8') as f:
-    chunks = json.load(f)
+chunks = list(iter_chunks(CHUNKS_PATH))
 
 # Sample a diverse set of chunks for Q&A generation
 random.seed(42)
@@ -26,9 +26,9 @@ sampled_chunks = random.sample(chunks, min(NUM_QA, len(chunks)))
 
 # Load the language model and tokenizer for Q&A generation
 print('Loading LLM for Q&A generation...')
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_NAME)
-device = 0 if torch.cuda.is_available() else -1
+tokenizer, model = load_seq2seq(MODEL_NAME)
+# Dynamically quantized (int8) models only run on the CPU
+device = 0 if torch.cuda.is_available() and load_stats[-1]['precision'] != 'int8' else -1
 if device == 0:
     print('Using GPU for inference.')
 else:
@@ -1,55 +1,212 @@
 import os
-from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM
-from reciprocal_rank_fusion import reciprocal_rank_fusion, retrieve_dense, retrieve_sparse
+import numpy as np
+from chunk_store import get_chunk_store
+from dense_retrieval_faiss import get_dense_retriever
+from hybrid_retrieval import get_hybrid_retriever
+from index_artifacts import report_memory
+from sparse_retrieval_bm25 import get_sparse_retriever
 
 # =====================================
 # LLM-based Response Generation Script
 # =====================================
 # This script uses a seq2seq language model (e.g., Flan-T5) to generate answers to user queries
-# using context retrieved from the hybrid RAG pipeline (dense, sparse, and RRF fusion).
+# using context retrieved from the hybrid RAG pipeline (dense and BM25 scores of one candidate set,
+# fused with RRF by hybrid_retrieval.py).
 # It provides functions for context building and answer generation, and supports interactive use.
+# Nothing is loaded at import: the tokenizer, the generator and the retrievers are loaded on first
+# use (get_tokenizer / get_model / the retrievers' get_* functions), so scripts that only pack
+# prompts load the tokenizer alone. load_worker loads everything up front for serving: retrieval
+# artifacts (FAISS index, BM25 postings, chunk store) are opened memory-mapped, so every worker
+# process (Streamlit, evaluation) shares one page-cache copy of the corpus and only the models are
+# private, and the worker reports its memory once everything is loaded.
+# Prompts are packed to a token budget instead of truncated: the token count of every chunk is
+# computed once per process (cached by chunk id), the highest-ranked chunks that fit into
+# MAX_INPUT_TOKENS next to the instruction and the question are kept whole, and the packed prompt
+# is tokenized once and fed to model.generate as input ids. The question is never cut off and no
+# text is encoded only to be thrown away.
+# generate_answers batches many prompts (evaluation runs): prompts are sorted by length so each
+# padded batch wastes little compute and answers are returned in the original order. The greedy
+# outputs are expected to match generate_answer but are not guaranteed to (see generate_answers).
 
 # Model and retrieval parameters
 MODEL_NAME = 'google/flan-t5-base'  # You can change to another open-source model if needed
 MAX_INPUT_TOKENS = 1024
+MAX_ANSWER_TOKENS = 128
+GENERATION_BATCH_SIZE = 8  # Prompts per model.generate call in generate_answers
 TOP_N = 5
 
-# Load the language model and tokenizer for answer generation
-print('Loading LLM...')
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_NAME)
-generator = pipeline('text2text-generation', model=model, tokenizer=tokenizer)
+# Process-wide tokenizer and language model (loaded on first use)
+_tokenizer = None
+_model = None
+_worker_ready = False
 
-# Build context for a query by retrieving top-N chunks using RRF fusion
-# Returns the concatenated context string and the fused chunk metadata
+# Tokenizer of the generator, loaded without the model when only prompts are packed
 
-def build_context(query, top_n=TOP_N):
-    dense_results = retrieve_dense(query, top_k=20)
-    sparse_results = retrieve_sparse(query, top_k=20)
-    fused = reciprocal_rank_fusion(dense_results, sparse_results, k=60, top_n=top_n)
-    context = "\n\n".join([f"Source: {r['title']}\n{r['text']}" for r in fused])
-    return context, fused
+def get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        from transformers import AutoTokenizer
+        _tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    return _tokenizer
 
-# Generate an answer to a query using the provided context
-# Uses the LLM to produce a concise, factual answer based only on the context
+# Language model for answer generation (precision and threads from LLM_PRECISION /
+# LLM_INTRA_OP_THREADS / LLM_INTER_OP_THREADS, see model_loading.py)
 
-def generate_answer(query, context):
-    prompt = (
+def get_model():
+    global _tokenizer, _model
+    if _model is None:
+        from model_loading import load_seq2seq
+        print('Loading LLM...')
+        tokenizer, _model = load_seq2seq(MODEL_NAME)
+        _tokenizer = _tokenizer or tokenizer
+    return _model
+
+# Load the generator and open the shared retrieval artifacts and the query encoder, so the reported
+# memory is what this worker holds while serving (once per process)
+
+def load_worker():
+    global _worker_ready
+    if _worker_ready:
+        return
+    get_model()
+    get_dense_retriever().load().query_encoder.load()
+    get_sparse_retriever().load()
+    get_chunk_store()
+    get_hybrid_retriever().load()
+    report_memory('Worker ready')
+    _worker_ready = True
+
+# Build context for a query by retrieving top-N chunks with the hybrid scorer (both scores of
+# every candidate, fused with RRF); where optionally restricts the chunks (metadata_filter.py)
+# Returns the context string the LLM sees (the chunks that fit the token budget) and their metadata
+
+def build_context(query, top_n=TOP_N, where=None):
+    fused = get_hybrid_retriever().search(query, top_n=top_n, where=where)
+    packed = select_chunks(query, fused)
+    return format_context(packed), packed
+
+# Context block of ranked chunks (dicts with 'title' and 'text')
+
+def format_context(chunks):
+    return "\n\n".join([chunk_block(r) for r in chunks])
+
+def chunk_block(chunk):
+    return f"Source: {chunk['title']}\n{chunk['text']}"
+
+# Prompt asking the LLM for a concise, factual answer based only on the context
+
+def build_prompt(query, context):
+    return (
         f"You are a helpful assistant. Answer the following question using ONLY the provided context. "
         f"Be concise, factual, and do not add information not present in the context.\n\n"
         f"Context:\n{context}\n\nQuestion: {query}\nAnswer:"
     )
-    # Truncate prompt if too long for the model
-    inputs = tokenizer(prompt, return_tensors='pt', truncation=True, max_length=MAX_INPUT_TOKENS)
-    output = generator(tokenizer.decode(inputs['input_ids'][0]), max_length=128, do_sample=False)[0]['generated_text']
-    return output
+
+# Token counts of the chunk blocks, indexed by chunk id (-1 = not counted yet); chunks without an
+# id in the chunk store (e.g. built by hand) and truncated copies are counted every time
+_token_counts = None
+
+def chunk_token_count(chunk):
+    global _token_counts
+    tokenizer = get_tokenizer()
+    if _token_counts is None:
+        _token_counts = np.full(len(get_chunk_store()), -1, dtype=np.int32)
+    chunk_id = -1 if chunk.get('truncated') else int(chunk.get('chunk_id', -1))
+    if 0 <= chunk_id < len(_token_counts) and _token_counts[chunk_id] >= 0:
+        return int(_token_counts[chunk_id])
+    count = len(tokenizer(chunk_block(chunk), add_special_tokens=False)['input_ids'])
+    if 0 <= chunk_id < len(_token_counts):
+        _token_counts[chunk_id] = count
+    return count
+
+# Select the ranked chunks that fit a prompt of max_tokens tokens, by their cached counts
+# The instruction, "Question: ... Answer:" and EOS are always kept; chunks are taken in rank order
+# and skipped when they do not fit the remaining budget (a later, shorter chunk may still fit).
+# If not even the top chunk fits, a copy cut to the budget is returned (marked 'truncated').
+
+def select_chunks(query, chunks, max_tokens=MAX_INPUT_TOKENS):
+    tokenizer = get_tokenizer()
+    budget = max_tokens - len(tokenizer(build_prompt(query, ''))['input_ids'])
+    packed = []
+    for chunk in chunks:
+        count = chunk_token_count(chunk)
+        if count <= budget:
+            packed.append(chunk)
+            budget -= count
+    if not packed and chunks and budget > 0:
+        ids = tokenizer(chunk_block(chunks[0]), add_special_tokens=False)['input_ids'][:budget]
+        head = len(tokenizer(f"Source: {chunks[0]['title']}\n", add_special_tokens=False)['input_ids'])
+        packed = [dict(chunks[0], text=tokenizer.decode(ids[head:], skip_special_tokens=True), truncated=True)]
+    return packed
+
+# Token ids of the prompt of a query and its ranked chunks, packed by select_chunks
+# The packed prompt is tokenized once; should it come out longer than the summed counts (tokens
+# merging across chunk boundaries), the last packed chunk is dropped. Returns (input ids, chunks).
+
+def pack_prompt(query, chunks, max_tokens=MAX_INPUT_TOKENS):
+    tokenizer = get_tokenizer()
+    packed = select_chunks(query, chunks, max_tokens)
+    while True:
+        ids = tokenizer(build_prompt(query, format_context(packed)))['input_ids']
+        if len(ids) <= max_tokens:
+            return ids, packed
+        if not packed:
+            # The question alone exceeds the budget: keep its start and EOS
+            return ids[:max_tokens - 1] + ids[-1:], packed
+        packed = packed[:-1]
+
+# Token ids of the prompt of a query and a ready-made context string (what generate_answer took
+# before prompts were packed); the context is cut from its end instead of the question
+
+def context_prompt_ids(query, context, max_tokens=MAX_INPUT_TOKENS):
+    tokenizer = get_tokenizer()
+    budget = max_tokens - len(tokenizer(build_prompt(query, ''))['input_ids'])
+    context_ids = tokenizer(context, add_special_tokens=False)['input_ids']
+    if len(context_ids) > budget:
+        context = tokenizer.decode(context_ids[:max(budget, 0)], skip_special_tokens=True)
+    ids = tokenizer(build_prompt(query, context))['input_ids']
+    # Tokens can merge across the cut; keep the start and EOS as pack_prompt does
+    return ids if len(ids) <= max_tokens else ids[:max_tokens - 1] + ids[-1:]
+
+# Generate an answer to a query from its ranked chunks (dicts with 'title' and 'text')
+# Uses the LLM to produce a concise, factual answer based only on the packed context
+# A context string (the former signature, e.g. the first value of build_context) is still accepted.
+
+def generate_answer(query, chunks):
+    return generate_answers([query], [chunks], batch_size=1)[0]
+
+# Generate answers for many (query, ranked chunks or context string) pairs in padded batches
+# Prompts are sorted by token length (longest first, so the largest batch is allocated up front)
+# and each batch is padded to its longest prompt only; the attention mask hides the padding, so
+# greedy decoding is expected to give the answers of generate_answer. Padding still changes the
+# shapes (and summation order) of the batched kernels, so logits can differ in the last bits and
+# a near-tie can flip a greedy token, more likely with LLM_PRECISION=bf16 or int8 (model_loading.py).
+# benchmark_generation.py counts the answers that differ. Returns answers in the input order.
+
+def generate_answers(queries, chunk_lists, batch_size=GENERATION_BATCH_SIZE):
+    import torch
+    tokenizer = get_tokenizer()
+    ids = [context_prompt_ids(query, chunks) if isinstance(chunks, str) else pack_prompt(query, chunks)[0]
+           for query, chunks in zip(queries, chunk_lists)]
+    order = sorted(range(len(ids)), key=lambda i: -len(ids[i]))
+    answers = [None] * len(ids)
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        inputs = tokenizer.pad({'input_ids': [ids[i] for i in batch]}, return_tensors='pt')
+        with torch.inference_mode():
+            outputs = get_model().generate(**inputs, max_length=MAX_ANSWER_TOKENS, do_sample=False)
+        for i, output in zip(batch, outputs):
+            # Decoded as the text2text-generation pipeline does (padding after EOS is dropped)
+            answers[i] = tokenizer.decode(output, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+    return answers
 
 if __name__ == '__main__':
+    load_worker()
     # Example usage: interactive query
     query = input('Enter your query: ')
     context, fused = build_context(query)
     print('\n--- Context Used ---')
     print(context)
     print('\n--- Generating Answer ---')
-    answer = generate_answer(query, context)
+    answer = generate_answer(query, fused)
     print(f'\nAnswer:\n{answer}')
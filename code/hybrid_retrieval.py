@@ -0,0 +1,229 @@
+import argparse
+import sys
+import time
+import numpy as np
+from dense_retrieval_faiss import get_dense_retriever
+from metadata_filter import compile_filter
+from rank_fusion import NORMALIZATIONS, normalize_scores, top_n_indices
+from sparse_retrieval_bm25 import get_sparse_retriever, tokenize
+
+# =====================================
+# Hybrid Retrieval (single-pass scorer)
+# =====================================
+# Scores one candidate set with both retrievers instead of fusing two short top-k lists:
+# - candidates: the union of the dense top-C (FAISS index) and the sparse top-C (BM25), or the
+#   whole corpus when candidates is 0 or at least the number of chunks
+# - dense scores: exact inner products with the memory-mapped float vectors
+#   (data/faiss_vectors.f32), one matrix product per query batch
+# - sparse scores: the BM25 score vector of the query terms' postings
+# - fusion: 'combsum' (weighted sum of per-query normalized scores) or 'rrf' (weighted
+#   1 / (k + rank), ranks taken within the candidate set, tied scores sharing a rank and chunks
+#   without a BM25 match getting no sparse term), computed on whole arrays
+# - top-n: argpartition (rank_fusion.top_n_indices), ties broken by lower chunk id
+# Every candidate gets both scores, so a chunk ranked 25th by one retriever still counts, unlike
+# the fusion of two top-20 lists in reciprocal_rank_fusion.py. A metadata filter (where=...,
+# metadata_filter.py) restricts the candidates on both sides.
+# Latency: the default of 1000 candidates per retriever keeps scoring and fusion at a few ms per
+# query (fusing ~2000 candidates takes well under 1ms). Scoring the whole corpus is bound by memory
+# bandwidth: the dense pass alone is ~15ms per query at 100k x 384 float32 vectors, plus ranking
+# every chunk, so candidates=0 is meant for evaluation rather than serving. --benchmark measures
+# both on the local index.
+# Usage:
+#   python code/hybrid_retrieval.py [--candidates 1000] [--method rrf] [--benchmark]
+
+HYBRID_CANDIDATES = 1000  # Candidates per retriever (0 = score the whole corpus, ~15ms+ per query at 100k chunks)
+HYBRID_METHODS = ('combsum', 'rrf')
+DENSE_WEIGHT = 1.0
+SPARSE_WEIGHT = 1.0
+RRF_K = 60
+BENCHMARK_QUERIES = 50
+
+
+# 1-based ranks of scores within one candidate set; tied scores share the best (lowest) rank, so
+# the order of chunk ids does not decide between equal scores
+
+def score_ranks(scores):
+    ordered = np.sort(-np.asarray(scores, dtype=np.float64))
+    return np.searchsorted(ordered, -np.asarray(scores, dtype=np.float64), side='left') + 1.0
+
+
+# Fuse the dense and sparse scores of one candidate set (ids ascending)
+# With RRF, candidates without a BM25 score (no query term matched) get no sparse contribution,
+# as they would be missing from a BM25 ranked list.
+# Returns (chunk_ids, fused_scores, positions in ids) of the top_n candidates
+
+def fuse_scores(ids, dense_scores, sparse_scores, method='rrf', weights=(DENSE_WEIGHT, SPARSE_WEIGHT),
+                normalization='minmax', k=RRF_K, top_n=5):
+    if method == 'rrf':
+        matched = sparse_scores > 0
+        fused = weights[0] / (k + score_ranks(dense_scores))
+        fused[matched] += weights[1] / (k + score_ranks(sparse_scores[matched]))
+    elif method == 'combsum':
+        fused = (weights[0] * normalize_scores(dense_scores, normalization) +
+                 weights[1] * normalize_scores(sparse_scores, normalization))
+    else:
+        raise ValueError(f"Unknown hybrid method '{method}'. Choose one of {HYBRID_METHODS}.")
+    top = top_n_indices(fused, top_n, tie_key=ids)
+    return ids[top], fused[top], top
+
+
+# Query-side hybrid retriever over the dense and sparse retrievers (by default the process-wide
+# ones, so a worker holds one copy of each index)
+
+class HybridRetriever:
+    def __init__(self, candidates=HYBRID_CANDIDATES, method='rrf', weights=(DENSE_WEIGHT, SPARSE_WEIGHT),
+                 normalization='minmax', k=RRF_K, dense=None, sparse=None):
+        if method not in HYBRID_METHODS:
+            raise ValueError(f"Unknown hybrid method '{method}'. Choose one of {HYBRID_METHODS}.")
+        if normalization not in NORMALIZATIONS:
+            raise ValueError(f"Unknown normalization '{normalization}'. Choose one of {NORMALIZATIONS}.")
+        self.candidates = candidates
+        self.method = method
+        self.weights = weights
+        self.normalization = normalization
+        self.k = k
+        self.dense = dense
+        self.sparse = sparse
+        self._live = None
+
+    def load(self):
+        if self._live is not None:
+            return self
+        self.dense = (self.dense or get_dense_retriever()).load()
+        self.sparse = (self.sparse or get_sparse_retriever()).load()
+        if self.dense.vectors is None:
+            raise ValueError(f"{self.dense.vectors_path} is missing; rebuild the dense index with --build.")
+        if len(self.dense.vectors) != self.sparse.index.num_docs:
+            raise ValueError(f"Dense vectors ({len(self.dense.vectors)}) and BM25 documents "
+                             f"({self.sparse.index.num_docs}) do not match.")
+        deleted = self.dense.chunks.deleted
+        self._live = np.flatnonzero(~np.asarray(deleted)) if deleted is not None and deleted.any() \
+            else np.arange(len(self.dense.vectors), dtype=np.int64)
+        return self
+
+    # True when every live chunk is a candidate
+    @property
+    def full_corpus(self):
+        return not self.candidates or self.candidates >= len(self.load()._live)
+
+    # Candidate chunk ids (ascending) with their dense and sparse scores, one tuple per query
+    def score_batch(self, queries, batch_size=32, where=None):
+        return self.score_embedded(self.load().dense.encode(queries, batch_size), queries, where)
+
+    # score_batch for already encoded queries (q_emb row i belongs to queries[i])
+    def score_embedded(self, q_emb, queries, where=None):
+        self.load()
+        vectors = self.dense.vectors
+        mask = None if where is None else compile_filter(where, self.dense.chunks)
+        if self.full_corpus:
+            live = self._live if mask is None else self._live[mask[self._live]]
+            # One pass over the vectors for the whole query batch
+            dense_all = np.asarray(vectors @ q_emb.T) if len(live) == len(vectors) else np.asarray(vectors[live] @ q_emb.T)
+        else:
+            dense_ids = self.dense.top_k(q_emb, self.candidates, mask)[1]
+        scored = []
+        for i, query in enumerate(queries):
+            sparse_all = self.sparse.index.get_scores(tokenize(query), mask)
+            if self.full_corpus:
+                scored.append((live, dense_all[:, i], sparse_all[live]))
+                continue
+            # Sparse candidates: chunks matching a query term, the top-C of them (lower doc id first
+            # on ties, as BM25Index.top_k) if there are more
+            matched = np.flatnonzero(sparse_all > 0)
+            if self.sparse.index.deleted is not None:
+                matched = matched[~self.sparse.index.deleted[matched]]
+            if len(matched) > self.candidates:
+                matched = matched[top_n_indices(sparse_all[matched], self.candidates, tie_key=matched)]
+            row = dense_ids[i]
+            ids = np.union1d(row[row >= 0], matched)
+            scored.append((ids, vectors[ids] @ q_emb[i], sparse_all[ids]))
+        return scored
+
+    # Given a query, returns the top_n chunks by fused score (where: optional metadata filter)
+    def search(self, query, top_n=5, where=None):
+        return self.search_batch([query], top_n=top_n, where=where)[0]
+
+    # Batched search: one result list per query with 'dense_score', 'sparse_score' and
+    # 'fused_score' (and 'rrf_score' for RRF) and the chunk text
+    def search_batch(self, queries, top_n=5, batch_size=32, where=None):
+        chunks = self.load().dense.chunks
+        batch_results = []
+        for ids, dense_scores, sparse_scores in self.score_batch(queries, batch_size, where):
+            top_ids, fused, top = fuse_scores(ids, dense_scores, sparse_scores, self.method, self.weights,
+                                              self.normalization, self.k, top_n)
+            results = []
+            for cid, score, pos in zip(top_ids, fused, top):
+                meta = chunks.meta(cid)
+                meta['dense_score'] = float(dense_scores[pos])
+                meta['sparse_score'] = float(sparse_scores[pos])
+                meta['fused_score'] = float(score)
+                if self.method == 'rrf':
+                    meta['rrf_score'] = float(score)
+                meta['text'] = chunks.text(cid)
+                results.append(meta)
+            batch_results.append(results)
+        return batch_results
+
+
+# Process-wide retriever used by retrieve_hybrid (created on first query)
+_default_retriever = None
+
+
+def get_hybrid_retriever():
+    global _default_retriever
+    if _default_retriever is None:
+        _default_retriever = HybridRetriever()
+    return _default_retriever
+
+
+# Given a query, returns the top_n chunks of the hybrid scorer
+
+def retrieve_hybrid(query, top_n=5, where=None):
+    return get_hybrid_retriever().search(query, top_n=top_n, where=where)
+
+
+# Per-query latency of scoring and fusion (query encoding excluded) at several candidate set sizes
+
+def benchmark(queries, candidate_sizes, method='rrf', top_n=5):
+    dense = get_dense_retriever().load()
+    q_emb = dense.encode(queries)
+    print(f"[LOG] {len(queries)} queries, {len(dense.vectors)} chunks, method={method}")
+    for candidates in candidate_sizes:
+        retriever = HybridRetriever(candidates, method).load()
+        timings = []
+        for i, query in enumerate(queries):
+            start = time.perf_counter()
+            ids, dense_scores, sparse_scores = retriever.score_embedded(q_emb[i:i + 1], [query])[0]
+            fuse_scores(ids, dense_scores, sparse_scores, method, top_n=top_n)
+            timings.append((time.perf_counter() - start) * 1000)
+        label = 'all' if retriever.full_corpus else candidates
+        print(f"[LOG] candidates={label}: p50 {np.percentile(timings, 50):.2f}ms, p99 {np.percentile(timings, 99):.2f}ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Hybrid dense + BM25 retrieval over a shared candidate set.")
+    parser.add_argument('--candidates', type=int, default=HYBRID_CANDIDATES, help='Candidates per retriever (0 = whole corpus)')
+    parser.add_argument('--method', choices=HYBRID_METHODS, default='rrf', help='Score fusion method')
+    parser.add_argument('--normalization', choices=NORMALIZATIONS, default='minmax', help='Score normalization for combsum')
+    parser.add_argument('--dense-weight', type=float, default=DENSE_WEIGHT, help='Weight of the dense scores')
+    parser.add_argument('--sparse-weight', type=float, default=SPARSE_WEIGHT, help='Weight of the BM25 scores')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Time scoring at several candidate set sizes on generated_qa_pairs.json questions')
+    args = parser.parse_args()
+    if args.benchmark:
+        import json
+        from evaluation_metrics import QA_PATH
+        with open(QA_PATH, 'r', encoding='utf-8') as f:
+            questions = [qa['question'] for qa in json.load(f)[:BENCHMARK_QUERIES]]
+        benchmark(questions, (100, args.candidates, 0), args.method)
+    _default_retriever = HybridRetriever(args.candidates, args.method, (args.dense_weight, args.sparse_weight),
+                                         args.normalization)
+    # Example usage: interactive query
+    if sys.stdin.isatty():
+        # Interactive mode: allow user to query
+        query = input('Enter your query: ')
+        for r in retrieve_hybrid(query, top_n=5):
+            print(f"Fused: {r['fused_score']:.4f} | Dense: {r['dense_score']:.4f} | BM25: {r['sparse_score']:.4f} | "
+                  f"Title: {r['title']} | URL: {r['url']}")
+    else:
+        print("[INFO] Non-interactive mode detected. Skipping query input.")
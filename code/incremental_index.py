@@ -0,0 +1,218 @@
+import argparse
+import json
+import os
+import numpy as np
+from article_cache import ARTICLE_CACHE_DIR, ArticleCache
+from chunk_store import CHUNK_STORE_DIR, ChunkStore, append_chunk_store, write_chunk_store
+from chunking import CHUNK_OVERLAP, CHUNK_SIZE, chunk_article
+from dense_retrieval_faiss import compact_dense_index, embed_chunks, update_dense_index
+from index_artifacts import (CHUNK_META_PATH, CHUNKS_PATH, TOMBSTONE_KEY, corpus_fingerprint, iter_chunks,
+                             write_chunk_metadata)
+from sparse_retrieval_bm25 import BM25_INDEX_DIR, BM25Index, update_bm25_index, write_bm25_index
+from wikipedia_fetcher import DEFAULT_MAX_RETRIES, DEFAULT_RATE, DEFAULT_WORKERS, WIKI_API_URL, WikipediaFetcher
+
+# =====================================
+# Incremental Index Updates
+# =====================================
+# Adds, replaces and deletes articles in the corpus, the chunk store, the FAISS index and the BM25
+# index without a full rebuild, keyed by article URL and Wikipedia revision id:
+# - Latest revision ids are looked up in bulk (50 titles per request, no article text); only
+#   articles whose revision differs from the indexed one are downloaded and re-chunked.
+# - Chunks of a changed article get new chunk ids (appended rows); its old chunks are tombstoned.
+#   Pages that no longer exist are deleted. The corpus records both as appended JSONL lines
+#   ({"deleted_chunk_id": ...} for tombstones).
+# - Only new chunks are embedded (FAISS delta index) and tokenized (BM25 delta segment); deleted
+#   chunks are skipped at query time and leave the BM25 statistics.
+# Compaction (--compact, or automatically once --compact-threshold of the chunk ids are deleted)
+# rewrites the corpus without deleted chunks, renumbers the chunk ids and rebuilds the chunk store
+# and indexes from the stored vectors (nothing is re-embedded; ANN index types are retrained from
+# the embedding cache).
+# Usage:
+#   python code/incremental_index.py --refresh               (check every indexed article)
+#   python code/incremental_index.py --add URL [URL ...]     (add new or refresh given articles)
+#   python code/incremental_index.py --delete URL [URL ...]
+#   python code/incremental_index.py --compact
+
+COMPACT_THRESHOLD = 0.2  # Compact once this fraction of the chunk ids is deleted
+TOMBSTONE_PREFIX = '{"' + TOMBSTONE_KEY + '"'  # Start of a tombstone line in the JSONL corpus
+
+
+# Live chunk ids of the given URLs ({url: [chunk ids]}) and the chunk store's URL table ({url: url id})
+
+def live_chunk_ids(store, urls):
+    url_ids = {store.urls[i]: i for i in range(len(store.urls))}
+    wanted = {url_ids[url]: url for url in urls if url in url_ids}
+    rows = np.flatnonzero(np.isin(store.url_ids, np.array(list(wanted), dtype=np.int64)))
+    if store.deleted is not None:
+        rows = rows[~store.deleted[rows]]
+    live = {url: [] for url in urls}
+    for row in rows:
+        live[wanted[int(store.url_ids[row])]].append(int(row))
+    return live, url_ids
+
+
+# Revision id of the indexed version of an article; falls back to the raw article cache for
+# articles indexed before revision ids were recorded in the chunk store
+
+def indexed_revision(store, url_ids, cache, url):
+    revid = int(store.url_revids[url_ids[url]])
+    if revid >= 0:
+        return revid
+    article = cache.get(url)
+    return article.get('revid') if article else None
+
+
+# Bring the given articles up to date and delete delete_urls
+# Returns the number of (new chunks, deleted chunks)
+
+def update_articles(urls, delete_urls=(), fetcher=None, cache=None, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP,
+                    chunks_path=CHUNKS_PATH, store_dir=CHUNK_STORE_DIR, bm25_dir=BM25_INDEX_DIR,
+                    compact_threshold=COMPACT_THRESHOLD):
+    cache = cache if cache is not None else ArticleCache()
+    delete_urls = list(dict.fromkeys(delete_urls))
+    urls = [url for url in dict.fromkeys(urls) if url not in delete_urls]
+    store = ChunkStore(store_dir)
+    live, url_ids = live_chunk_ids(store, urls + delete_urls)
+
+    # Compare the latest revision of every article with the indexed one
+    gone = {url for url in delete_urls if live[url]}
+    changed = []
+    revisions = {}  # url -> revision id recorded in the chunk store
+    latest = fetcher.latest_revisions(urls) if urls else {}
+    for url in urls:
+        if url not in latest:
+            print(f"[WARN] Could not look up the latest revision of {url}; skipping it.")
+            continue
+        revid = latest[url]
+        if revid is None:
+            if live[url]:
+                gone.add(url)  # Page no longer exists
+            continue
+        indexed = indexed_revision(store, url_ids, cache, url) if live[url] else None
+        if indexed != revid:
+            changed.append(url)
+        else:
+            revisions[url] = revid
+    print(f"[LOG] {len(urls)} articles checked: {len(changed)} new or changed, {len(gone)} to delete")
+
+    # Download and re-chunk the changed articles only
+    if changed:
+        for url, article in fetcher.fetch_all(changed):
+            cache.put(url, article)
+    new_chunks = []
+    next_id = len(store)
+    for url in changed:
+        article = cache.get(url)
+        if article is None:
+            if live[url]:
+                gone.add(url)
+            continue
+        chunks, _ = chunk_article(article, chunk_size, overlap)
+        for idx, text in enumerate(chunks):
+            new_chunks.append({'chunk_id': f'{next_id}', 'url': url, 'title': article['title'], 'chunk_index': idx, 'text': text})
+            next_id += 1
+        revisions[url] = article.get('revid')
+    for url in gone:
+        revisions[url] = None
+    deleted_ids = sorted({chunk_id for url in changed + sorted(gone) for chunk_id in live[url]})
+    if not new_chunks and not deleted_ids:
+        if revisions:
+            # Nothing to index, but remember the revision ids looked up in the article cache
+            append_chunk_store([], (), revisions, store_dir, fingerprint=store.manifest['corpus_fingerprint'])
+        print("[LOG] Index is up to date.")
+        return 0, 0
+
+    # Embed first: nothing is written if the embedding model cannot be loaded
+    embeddings = embed_chunks(new_chunks) if new_chunks else None
+    deleted = [(chunk_id, store.text(chunk_id)) for chunk_id in deleted_ids]
+
+    # Append the new chunks and the tombstones to the corpus, then patch every artifact
+    with open(chunks_path, 'a', encoding='utf-8') as f:
+        for chunk in new_chunks:
+            f.write(json.dumps(chunk, ensure_ascii=False) + '\n')
+        for chunk_id in deleted_ids:
+            f.write(json.dumps({TOMBSTONE_KEY: str(chunk_id)}) + '\n')
+    fingerprint = corpus_fingerprint(chunks_path)
+    append_chunk_store(new_chunks, deleted_ids, revisions, store_dir, fingerprint=fingerprint)
+    update_dense_index(new_chunks, embeddings, fingerprint)
+    update_bm25_index(new_chunks, deleted, bm25_dir, fingerprint=fingerprint)
+    print(f"[LOG] Incremental update: {len(new_chunks)} chunks added, {len(deleted_ids)} chunks deleted")
+
+    store = ChunkStore(store_dir)
+    if len(store.deleted_ids()) > compact_threshold * len(store):
+        print(f"[LOG] {len(store.deleted_ids())} of {len(store)} chunk ids are deleted; compacting...")
+        compact(chunks_path, store_dir, bm25_dir)
+    return len(new_chunks), len(deleted_ids)
+
+
+# Rewrite the corpus without deleted chunks (live chunks renumbered in order) and rebuild the
+# chunk store, FAISS index (from the stored vectors) and BM25 index from it
+
+def compact(chunks_path=CHUNKS_PATH, store_dir=CHUNK_STORE_DIR, bm25_dir=BM25_INDEX_DIR, meta_path=CHUNK_META_PATH):
+    store = ChunkStore(store_dir)
+    deleted = np.zeros(len(store), dtype=bool)
+    with open(chunks_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith(TOMBSTONE_PREFIX):
+                deleted[int(json.loads(line)[TOMBSTONE_KEY])] = True
+    revisions = {store.urls[i]: int(revid) for i, revid in enumerate(store.url_revids) if revid >= 0}
+
+    tmp_path = chunks_path + '.compact'
+    row = 0
+    num_live = 0
+    with open(chunks_path, 'r', encoding='utf-8') as src, open(tmp_path, 'w', encoding='utf-8') as dst:
+        for line in src:
+            if not line.strip() or line.startswith(TOMBSTONE_PREFIX):
+                continue
+            if not deleted[row]:
+                chunk = json.loads(line)
+                chunk['chunk_id'] = f'{num_live}'
+                dst.write(json.dumps(chunk, ensure_ascii=False) + '\n')
+                num_live += 1
+            row += 1
+    os.replace(tmp_path, chunks_path)
+    fingerprint = corpus_fingerprint(chunks_path)
+
+    bm25_manifest = BM25Index(bm25_dir).manifest
+    compact_dense_index(deleted, fingerprint, chunks_path=chunks_path)
+    write_chunk_store(iter_chunks(chunks_path), store_dir, fingerprint=fingerprint, revisions=revisions)
+    write_bm25_index(iter_chunks(chunks_path), bm25_dir, fingerprint, k1=bm25_manifest['k1'], b=bm25_manifest['b'],
+                     epsilon=bm25_manifest['epsilon'])
+    write_chunk_metadata(iter_chunks(chunks_path), meta_path)
+    print(f"[LOG] Compaction finished: {num_live} chunks kept, {int(deleted.sum())} removed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally add, refresh or delete articles in the indexes.")
+    parser.add_argument('--refresh', action='store_true', help='Check every indexed article for a new revision')
+    parser.add_argument('--add', nargs='+', default=[], metavar='URL', help='Add (or refresh) these articles')
+    parser.add_argument('--delete', nargs='+', default=[], metavar='URL', help='Delete these articles')
+    parser.add_argument('--compact', action='store_true', help='Remove deleted chunks from the corpus and indexes')
+    parser.add_argument('--compact-threshold', type=float, default=COMPACT_THRESHOLD,
+                        help='Compact automatically once this fraction of chunk ids is deleted')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Tokens per chunk (use the corpus setting)')
+    parser.add_argument('--chunk-overlap', type=int, default=CHUNK_OVERLAP, help='Overlap between consecutive chunks (tokens)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Maximum concurrent API requests (1 = sequential)')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help='Global API rate limit in requests/s (0 = unlimited)')
+    parser.add_argument('--max-retries', type=int, default=DEFAULT_MAX_RETRIES, help='Retries per API request (exponential backoff)')
+    parser.add_argument('--api-url', default=WIKI_API_URL, help='MediaWiki API endpoint (e.g. a local stand-in server)')
+    parser.add_argument('--cache-dir', default=ARTICLE_CACHE_DIR, help='Raw article cache directory')
+    args = parser.parse_args()
+    if not (args.refresh or args.add or args.delete or args.compact):
+        parser.error('Nothing to do: use --refresh, --add, --delete and/or --compact.')
+
+    if args.refresh or args.add or args.delete:
+        urls = list(args.add)
+        if args.refresh:
+            store = ChunkStore()
+            urls = [store.urls[i] for i in range(len(store.urls))] + urls
+        fetcher = WikipediaFetcher(api_url=args.api_url, max_workers=args.workers, rate=args.rate, max_retries=args.max_retries)
+        update_articles(urls, args.delete, fetcher, ArticleCache(args.cache_dir), args.chunk_size, args.chunk_overlap,
+                        compact_threshold=args.compact_threshold)
+        print(f"[LOG] Wikipedia API round trips: {fetcher.request_count}")
+    if args.compact:
+        compact()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import sys
+
+# =====================================
+# Index Artifact Helpers
+# =====================================
+# Shared helpers for the persisted retrieval artifacts (FAISS index, chunk metadata, ...).
+# Every index is written together with a small JSON manifest that records the fingerprint
+# of the corpus it was built from, so query-side code can refuse to serve a stale index.
+
+DATA_DIR = os.path.join(os.getcwd(), 'data')
+CHUNKS_PATH = os.path.join(DATA_DIR, 'wikipedia_chunks.jsonl')  # One chunk per line
+CHUNK_META_PATH = os.path.join(DATA_DIR, 'chunk_metadata.json')
+TOMBSTONE_KEY = 'deleted_chunk_id'  # Corpus records {"deleted_chunk_id": ...} appended by incremental updates
+
+# Cache of computed fingerprints keyed by (path, size, mtime) so repeated checks in one
+# process do not re-hash an unchanged corpus file
+_fingerprint_cache = {}
+
+
+class StaleIndexError(RuntimeError):
+    """Raised when a persisted index was built from a different corpus than the current one."""
+
+
+# Compute a content fingerprint (sha256) of the corpus file, streaming it in 1 MiB blocks
+
+def corpus_fingerprint(path=CHUNKS_PATH):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _fingerprint_cache:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        _fingerprint_cache[key] = digest.hexdigest()
+    return _fingerprint_cache[key]
+
+
+# Write / read the JSON manifest stored next to an index artifact
+
+def write_manifest(path, manifest):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+
+def read_manifest(path):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Index manifest not found at {path}. Build the index first.")
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Stream the chunks of a corpus file one at a time
+# Accepts the JSONL corpus written by preprocess_and_chunk_wikipedia.py (read line by line) as
+# well as the older single JSON array format (loaded at once). Chunk ids are the record numbers,
+# so a corpus holding tombstones of incremental updates must be compacted before a full build.
+
+def iter_chunks(path=CHUNKS_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if TOMBSTONE_KEY in record:
+                        raise ValueError(f"{path} contains deleted chunks from incremental updates. "
+                                         f"Run python code/incremental_index.py --compact before a full rebuild.")
+                    yield record
+        else:
+            yield from json.load(f)
+
+
+# Save chunk metadata (all chunk fields except the text) next to the dense and sparse indexes
+# Chunks are streamed; the output is the same indented JSON array json.dump(..., indent=2) writes
+
+def write_chunk_metadata(chunks, path=CHUNK_META_PATH):
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for chunk in chunks:
+            meta = {k: v for k, v in chunk.items() if k != 'text'}
+            f.write((',\n  ' if count else '\n  ') + json.dumps(meta, indent=2, ensure_ascii=False).replace('\n', '\n  '))
+            count += 1
+        f.write('\n]' if count else ']')
+    print(f'Chunk metadata saved to {path}')
+
+
+# Compare the fingerprint recorded in a manifest with the current corpus file
+# Raises StaleIndexError on mismatch; warns (but allows serving) if the corpus file is absent
+
+def check_fingerprint(manifest, name, chunks_path=CHUNKS_PATH):
+    if not os.path.exists(chunks_path):
+        print(f"[WARN] Corpus file {chunks_path} not found; cannot verify that the {name} index is current.")
+        return
+    current = corpus_fingerprint(chunks_path)
+    if manifest.get('corpus_fingerprint') != current:
+        raise StaleIndexError(
+            f"The {name} index was built from a different corpus "
+            f"(index: {manifest.get('corpus_fingerprint')}, corpus: {current}). Rebuild the index."
+        )
+
+
+# Check that an index and the chunk store it serves were built from the same corpus
+
+def check_same_corpus(manifest, store_manifest, name):
+    if manifest.get('corpus_fingerprint') != store_manifest.get('corpus_fingerprint'):
+        raise StaleIndexError(
+            f"The {name} index and the chunk store were built from different corpora. "
+            f"Rebuild the index and re-run chunk_store.py --convert."
+        )
+
+
+# Memory of the current process in MB: resident set, its private (anonymous) part and the part
+# backed by mapped files. Memory-mapped artifacts show up as file-backed pages, which the OS page
+# cache shares between all workers; private memory is what each extra worker really costs.
+# Outside Linux only the peak resident set is available.
+
+def process_memory():
+    usage = {}
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'RssAnon', 'RssFile'):
+                    usage[key] = int(value.split()[0]) / 1024
+        return {'rss_mb': usage.get('VmRSS', 0.0), 'private_mb': usage.get('RssAnon', 0.0),
+                'file_backed_mb': usage.get('RssFile', 0.0)}
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'rss_mb': peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)}
+
+
+def report_memory(label):
+    usage = process_memory()
+    if 'private_mb' in usage:
+        print(f"[LOG] {label} (pid {os.getpid()}): RSS {usage['rss_mb']:.0f} MB = {usage['private_mb']:.0f} MB private "
+              f"+ {usage['file_backed_mb']:.0f} MB shared file-backed (memory-mapped artifacts, libraries)")
+    else:
+        print(f"[LOG] {label} (pid {os.getpid()}): peak RSS {usage['rss_mb']:.0f} MB")
+    return usage
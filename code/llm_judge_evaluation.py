@@ -2,7 +2,8 @@ import json
 import os
 import re
 import csv
-from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM
+from transformers import pipeline
+from model_loading import load_seq2seq
 
 
 # Parameters
@@ -15,11 +16,13 @@ criteria = [
     ("relevance", "Is the answer relevant to the question and context? (1=irrelevant, 5=fully relevant)")
 ]
 
-# Load or initialize the LLM pipeline for scoring and explanation
+# Load or initialize the LLM pipeline for scoring and explanation (precision and threads from
+# LLM_PRECISION / LLM_INTRA_OP_THREADS / LLM_INTER_OP_THREADS, see model_loading.py)
+tokenizer, model = load_seq2seq(MODEL_NAME)
 generator = pipeline(
     "text2text-generation",
-    model=MODEL_NAME,
-    tokenizer=AutoTokenizer.from_pretrained(MODEL_NAME)
+    model=model,
+    tokenizer=tokenizer
 )
 
 # Prompt templates
@@ -0,0 +1,211 @@
+import ast
+import json
+import operator
+import os
+from collections import OrderedDict
+from urllib.parse import urlparse
+import numpy as np
+
+# =====================================
+# Metadata Filters
+# =====================================
+# Compiles filter expressions over the chunk metadata into a bitset (bool array over chunk ids)
+# that the retrievers apply inside the search: a FAISS IDSelectorBitmap on the dense side and
+# postings masking on the BM25 side (see the `where` argument of the retrievers). Restricting a
+# query therefore returns the best matching chunks of the filtered set instead of whatever
+# survives post-filtering a short top-k list.
+# Expressions use Python syntax (parsed with ast, never evaluated) over these fields:
+#   title, url          article title / URL
+#   domain              host of the URL (e.g. 'en.wikipedia.org')
+#   source              'fixed' or 'random': the URL set of data/fixed_urls.json / data/random_urls.json
+#   chunk_index         position of the chunk within its article
+# Supported: == != in / not in (with a list, or 'text' in title for substrings), < <= > >= on
+# chunk_index (chained, e.g. 0 < chunk_index <= 3), title.startswith(...) / .endswith(...),
+# and / or / not and parentheses. Examples:
+#   source == 'fixed' and chunk_index < 3
+#   title in ['Alan Turing', 'Ada Lovelace'] or 'Computer' in title
+# String predicates are evaluated once per distinct title / URL and expanded to chunks through
+# the chunk store's id columns, so compiling costs one pass over the articles plus one vectorized
+# gather over the chunks; compiled bitsets are cached per expression.
+
+FIXED_URLS_PATH = os.path.join(os.getcwd(), 'data', 'fixed_urls.json')
+RANDOM_URLS_PATH = os.path.join(os.getcwd(), 'data', 'random_urls.json')
+FILTER_FIELDS = ('title', 'url', 'domain', 'source', 'chunk_index')
+FILTER_CACHE_SIZE = 64  # Compiled bitsets kept per process
+
+_COMPARISONS = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne,
+    ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+}
+_FLIPPED = {ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt, ast.GtE: ast.LtE, ast.Eq: ast.Eq, ast.NotEq: ast.NotEq}
+_compiled = OrderedDict()  # (store dir, corpus fingerprint, rows, expression) -> bitset
+
+
+# URL set of a JSON list file (empty if the file does not exist)
+
+def _load_url_set(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        return set(json.load(f))
+
+
+# Field values of one chunk store: per-chunk arrays for numeric fields, (distinct values,
+# per-chunk index into them) for string fields; string tables are read on first use
+
+class _FieldValues:
+    def __init__(self, store, fixed_urls_path=FIXED_URLS_PATH, random_urls_path=RANDOM_URLS_PATH):
+        self.store = store
+        self.fixed_urls_path = fixed_urls_path
+        self.random_urls_path = random_urls_path
+        self._tables = {}
+
+    def __call__(self, field):
+        if field == 'chunk_index':
+            return np.asarray(self.store.chunk_index), None
+        if field not in self._tables:
+            self._tables[field] = self._table(field)
+        return self._tables[field]
+
+    def _table(self, field):
+        store = self.store
+        if field == 'title':
+            return [store.titles[i] for i in range(len(store.titles))], np.asarray(store.title_ids)
+        urls = [store.urls[i] for i in range(len(store.urls))]
+        if field == 'url':
+            return urls, np.asarray(store.url_ids)
+        if field == 'domain':
+            return [urlparse(url).netloc for url in urls], np.asarray(store.url_ids)
+        fixed, random = _load_url_set(self.fixed_urls_path), _load_url_set(self.random_urls_path)
+        sources = ['fixed' if url in fixed else 'random' if url in random else '' for url in urls]
+        return sources, np.asarray(store.url_ids)
+
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise ValueError(f"Expected a literal in the filter expression, got '{ast.unparse(node)}'.") from None
+
+
+def _field(node):
+    if isinstance(node, ast.Name):
+        if node.id not in FILTER_FIELDS:
+            raise ValueError(f"Unknown filter field '{node.id}'. Choose one of {FILTER_FIELDS}.")
+        return node.id
+    return None
+
+
+# Bitset of one string predicate: evaluated on the distinct values, expanded through the ids
+
+def _string_mask(values, predicate):
+    table, ids = values
+    return np.fromiter((predicate(v) for v in table), dtype=bool, count=len(table))[ids]
+
+
+def _compare(fields, left, op, right):
+    field, value = _field(left), None
+    if field is None:
+        field = _field(right)
+        if field is None:
+            raise ValueError(f"A comparison needs a field: '{ast.unparse(left)} ... {ast.unparse(right)}'.")
+        value = _literal(left)
+        if isinstance(op, (ast.In, ast.NotIn)):
+            # 'text' in title: substring match
+            if field == 'chunk_index' or not isinstance(value, str):
+                raise ValueError(f"'... in {field}' needs a string and a string field.")
+            mask = _string_mask(fields(field), lambda v: value in v)
+            return ~mask if isinstance(op, ast.NotIn) else mask
+        if type(op) not in _FLIPPED:
+            raise ValueError(f"Unsupported comparison '{type(op).__name__}' in the filter expression.")
+        op = _FLIPPED[type(op)]()
+    else:
+        value = _literal(right)
+    column, ids = fields(field)
+    if isinstance(op, (ast.In, ast.NotIn)):
+        if isinstance(value, str) or not hasattr(value, '__iter__'):
+            raise ValueError(f"'{field} in ...' needs a list of values.")
+        if ids is None:
+            mask = np.isin(column, np.array(list(value)))
+        else:
+            value = set(value)
+            mask = _string_mask((column, ids), lambda v: v in value)
+        return ~mask if isinstance(op, ast.NotIn) else mask
+    compare = _COMPARISONS.get(type(op))
+    if compare is None:
+        raise ValueError(f"Unsupported comparison '{type(op).__name__}' in the filter expression.")
+    if ids is None:
+        return compare(column, value)
+    if compare not in (operator.eq, operator.ne):
+        raise ValueError(f"Field '{field}' only supports ==, != and in.")
+    return _string_mask((column, ids), lambda v: compare(v, value))
+
+
+def _evaluate(node, fields, num_chunks):
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body, fields, num_chunks)
+    if isinstance(node, ast.BoolOp):
+        masks = [_evaluate(value, fields, num_chunks) for value in node.values]
+        reduce = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        return reduce.reduce(masks)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return ~_evaluate(node.operand, fields, num_chunks)
+    if isinstance(node, ast.Compare):
+        # Chained comparisons (0 < chunk_index <= 3) are the conjunction of each pair
+        mask = np.ones(num_chunks, dtype=bool)
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            mask &= _compare(fields, left, op, right)
+            left = right
+        return mask
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and not node.keywords:
+        field = _field(node.func.value)
+        if field in ('title', 'url', 'domain') and node.func.attr in ('startswith', 'endswith') and len(node.args) == 1:
+            affix = _literal(node.args[0])
+            affix = tuple(affix) if isinstance(affix, list) else affix
+            return _string_mask(fields(field), lambda v: getattr(v, node.func.attr)(affix))
+    if isinstance(node, ast.Constant) and isinstance(node.value, bool):
+        return np.full(num_chunks, node.value)
+    raise ValueError(f"Unsupported filter expression: '{ast.unparse(node)}'.")
+
+
+# Compile a filter expression into a bitset over the chunk ids of a chunk store
+# Deleted chunks are not cleared here; the retrievers skip them as for unfiltered queries.
+# A bool array is returned as it is (after a length check), so callers can pass precompiled masks.
+
+def compile_filter(where, store, fixed_urls_path=FIXED_URLS_PATH, random_urls_path=RANDOM_URLS_PATH):
+    if not isinstance(where, str):
+        mask = np.asarray(where, dtype=bool)
+        if mask.shape != (len(store),):
+            raise ValueError(f"Filter bitset has shape {mask.shape}; expected ({len(store)},).")
+        return mask
+    key = (store.store_dir, store.manifest.get('corpus_fingerprint'), len(store), where)
+    if key in _compiled:
+        _compiled.move_to_end(key)
+        return _compiled[key]
+    try:
+        tree = ast.parse(where.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid filter expression '{where}': {e.msg}") from None
+    mask = _evaluate(tree, _FieldValues(store, fixed_urls_path, random_urls_path), len(store))
+    mask = np.broadcast_to(mask, (len(store),)).copy()
+    mask.flags.writeable = False
+    _compiled[key] = mask
+    if len(_compiled) > FILTER_CACHE_SIZE:
+        _compiled.popitem(last=False)
+    return mask
+
+
+if __name__ == '__main__':
+    import argparse
+    from chunk_store import get_chunk_store
+    parser = argparse.ArgumentParser(description="Compile a metadata filter expression and count the matching chunks.")
+    parser.add_argument('expression', help="Filter expression, e.g. \"source == 'fixed' and chunk_index < 3\"")
+    args = parser.parse_args()
+    store = get_chunk_store()
+    mask = compile_filter(args.expression, store)
+    if store.deleted is not None:
+        mask = mask & ~np.asarray(store.deleted)
+    matched = np.flatnonzero(mask)
+    titles = {store.title(i) for i in matched[:1000]}
+    print(f"[LOG] {len(matched)} of {len(store)} chunks match ({len(titles)}{'+' if len(matched) > 1000 else ''} articles)")
@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import torch
+from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+from evaluation_metrics import QA_PATH, compute_f1
+from index_artifacts import process_memory
+
+# =====================================
+# Generator Model Loading (CPU precision and threads)
+# =====================================
+# One loading layer for the seq2seq LLM of generate_response_llm.py, generate_qa_pairs.py and
+# llm_judge_evaluation.py, with a selectable precision:
+#   fp32   the checkpoint as published
+#   bf16   weights and activations in bfloat16 (half the memory); only used when the CPU has native
+#          bf16 support (AVX512-BF16 / AMX), since emulated bf16 is slower than fp32
+#   int8   PyTorch dynamic quantization of every nn.Linear (int8 weights, activations quantized on
+#          the fly); embeddings and layer norms stay fp32
+# and explicit intra-op (within one matmul) and inter-op (between independent ops) thread counts.
+# The scripts load their model at import time or on first use, so the settings come from the environment:
+#   LLM_PRECISION=int8 LLM_INTRA_OP_THREADS=4 LLM_INTER_OP_THREADS=1 python code/evaluate_rag_pipeline.py
+# Every load logs its time and the RSS it added.
+# --benchmark loads each precision in a fresh process, generates answers for generated_qa_pairs.json
+# with generate_answers, reports load time, RSS and tokens/s, and checks that mean F1 / ROUGE-L stay
+# within the tolerances of the fp32 answers.
+# Usage:
+#   python code/model_loading.py --benchmark [--precisions fp32 bf16 int8] [--max-queries 32]
+
+PRECISIONS = ('fp32', 'bf16', 'int8')
+LLM_PRECISION = os.environ.get('LLM_PRECISION', 'fp32')
+INTRA_OP_THREADS = int(os.environ.get('LLM_INTRA_OP_THREADS', 0))  # 0 = PyTorch default (physical cores)
+INTER_OP_THREADS = int(os.environ.get('LLM_INTER_OP_THREADS', 0))
+F1_TOLERANCE = 0.02  # Largest drop in mean F1 against fp32 accepted by --benchmark
+ROUGE_TOLERANCE = 0.02  # Largest drop in mean ROUGE-L against fp32
+
+# Settings and measurements of the models loaded by this process, one dict per load
+load_stats = []
+
+
+# True if the CPU computes bf16 natively (oneDNN check, falling back to the CPU flags)
+
+def bf16_supported():
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        if not os.path.exists('/proc/cpuinfo'):
+            return False
+        with open('/proc/cpuinfo', 'r') as f:
+            flags = f.read()
+        return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+
+# Set the PyTorch thread pools (0 keeps the default)
+# The inter-op pool can only be sized before its first use; later requests are reported and ignored.
+
+def configure_threads(intra_op_threads=INTRA_OP_THREADS, inter_op_threads=INTER_OP_THREADS):
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads and inter_op_threads != torch.get_num_interop_threads():
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            print(f"[WARN] Inter-op threads are already running ({torch.get_num_interop_threads()}); "
+                  f"set LLM_INTER_OP_THREADS before anything uses PyTorch.")
+
+
+# Load a seq2seq model and its tokenizer at the given precision, in eval mode
+# Returns (tokenizer, model); the settings, load time and added RSS are appended to load_stats.
+
+def load_seq2seq(model_name, precision=LLM_PRECISION, intra_op_threads=INTRA_OP_THREADS, inter_op_threads=INTER_OP_THREADS):
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}'. Choose one of {PRECISIONS}.")
+    if precision == 'bf16' and not bf16_supported():
+        print("[WARN] This CPU has no native bf16 support; loading fp32 instead.")
+        precision = 'fp32'
+    configure_threads(intra_op_threads, inter_op_threads)
+    rss_before = process_memory()['rss_mb']
+    start = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    dtype = torch.bfloat16 if precision == 'bf16' else torch.float32
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_name, torch_dtype=dtype)
+    if precision == 'int8':
+        # In place, so the fp32 Linear weights are released instead of kept next to the copy
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    model.eval()
+    stats = {
+        'model': model_name, 'precision': precision,
+        'intra_op_threads': torch.get_num_threads(), 'inter_op_threads': torch.get_num_interop_threads(),
+        'load_seconds': time.perf_counter() - start, 'rss_mb': process_memory()['rss_mb'] - rss_before,
+    }
+    load_stats.append(stats)
+    print(f"[LOG] Loaded {model_name} ({precision}, {stats['intra_op_threads']} intra-op / "
+          f"{stats['inter_op_threads']} inter-op threads) in {stats['load_seconds']:.1f}s, +{stats['rss_mb']:.0f} MB RSS")
+    return tokenizer, model
+
+
+# One benchmark run in this process (precision and threads from the environment): answers for the
+# first max_queries questions with generate_answers, written with the load stats to output_path
+
+def measure(max_queries, output_path):
+    from rouge_score import rouge_scorer
+    from generate_response_llm import build_context, generate_answers, get_tokenizer, load_worker
+    import model_loading  # The loader's module, not this script's __main__ copy
+    load_worker()  # Model and retrieval artifacts, so neither load is timed
+    with open(QA_PATH, 'r', encoding='utf-8') as f:
+        qa_pairs = json.load(f)[:max_queries]
+    questions = [qa['question'] for qa in qa_pairs]
+    contexts = [build_context(question)[1] for question in questions]
+    start = time.perf_counter()
+    answers = generate_answers(questions, contexts)
+    elapsed = time.perf_counter() - start
+    tokenizer = get_tokenizer()
+    scorer = rouge_scorer.RougeScorer(['rougeL'], use_stemmer=True)
+    result = dict(model_loading.load_stats[0])
+    result.update({
+        'answers': answers,
+        'seconds': elapsed,
+        'tokens_per_s': sum(len(tokenizer(a)['input_ids']) for a in answers) / elapsed,
+        'f1': sum(compute_f1(a, qa['answer']) for a, qa in zip(answers, qa_pairs)) / len(qa_pairs),
+        'rougeL': sum(scorer.score(qa['answer'], a)['rougeL'].fmeasure for a, qa in zip(answers, qa_pairs)) / len(qa_pairs),
+        'total_rss_mb': process_memory()['rss_mb'],  # Model, retrieval artifacts and encoder
+    })
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+
+# Run measure for every precision in a fresh process and compare against fp32
+# Returns True if every precision is within F1_TOLERANCE / ROUGE_TOLERANCE of fp32.
+
+def benchmark(precisions=PRECISIONS, max_queries=32, intra_op_threads=INTRA_OP_THREADS, inter_op_threads=INTER_OP_THREADS,
+              f1_tolerance=F1_TOLERANCE, rouge_tolerance=ROUGE_TOLERANCE):
+    precisions = ['fp32'] + [p for p in precisions if p != 'fp32']
+    results = {}
+    for precision in precisions:
+        print(f"\n[INFO] Measuring {precision}...")
+        env = os.environ.copy()
+        env.update(LLM_PRECISION=precision, LLM_INTRA_OP_THREADS=str(intra_op_threads),
+                   LLM_INTER_OP_THREADS=str(inter_op_threads))
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            output_path = f.name
+        try:
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', '--max-queries', str(max_queries),
+                            '--output', output_path], env=env, check=True)
+            with open(output_path, 'r', encoding='utf-8') as f:
+                results[precision] = json.load(f)
+        finally:
+            os.remove(output_path)
+
+    reference = results['fp32']
+    passed = True
+    print(f"\n{'precision':>9} | {'load':>6} {'model':>8} {'total RSS':>9} | {'tok/s':>6} {'speedup':>7} | "
+          f"{'F1':>6} {'ROUGE-L':>7} {'same':>5} | ok")
+    for precision in precisions:
+        r = results[precision]
+        ok = r['f1'] >= reference['f1'] - f1_tolerance and r['rougeL'] >= reference['rougeL'] - rouge_tolerance
+        passed &= ok
+        same = sum(a == b for a, b in zip(r['answers'], reference['answers'])) / len(r['answers'])
+        label = r['precision'] if r['precision'] == precision else f"{precision}->{r['precision']}"
+        print(f"{label:>9} | {r['load_seconds']:>5.1f}s {r['rss_mb']:>6.0f}MB {r['total_rss_mb']:>7.0f}MB | "
+              f"{r['tokens_per_s']:>6.1f} {reference['seconds'] / r['seconds']:>6.2f}x | "
+              f"{r['f1']:>6.4f} {r['rougeL']:>7.4f} {same:>5.0%} | {'yes' if ok else 'NO'}")
+    if not passed:
+        print(f"[WARN] Some precisions lose more than {f1_tolerance} F1 / {rouge_tolerance} ROUGE-L against fp32.")
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare generator precisions (fp32, bf16, int8) on CPU.")
+    parser.add_argument('--benchmark', action='store_true', help='Measure every precision in a fresh process')
+    parser.add_argument('--precisions', nargs='+', choices=PRECISIONS, default=list(PRECISIONS), help='Precisions to compare')
+    parser.add_argument('--max-queries', type=int, default=32, help='Number of questions from generated_qa_pairs.json')
+    parser.add_argument('--intra-op-threads', type=int, default=INTRA_OP_THREADS, help='Threads per op (0 = default)')
+    parser.add_argument('--inter-op-threads', type=int, default=INTER_OP_THREADS, help='Threads across ops (0 = default)')
+    parser.add_argument('--f1-tolerance', type=float, default=F1_TOLERANCE, help='Accepted mean F1 drop against fp32')
+    parser.add_argument('--rouge-tolerance', type=float, default=ROUGE_TOLERANCE, help='Accepted mean ROUGE-L drop against fp32')
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(args.max_queries, args.output)
+    elif args.benchmark:
+        sys.exit(0 if benchmark(args.precisions, args.max_queries, args.intra_op_threads, args.inter_op_threads,
+                                args.f1_tolerance, args.rouge_tolerance) else 1)
+    else:
+        parser.print_help()
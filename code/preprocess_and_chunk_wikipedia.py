@@ -1,11 +1,12 @@
-import wikipediaapi
+import argparse
 import json
 import os
-import re
-from nltk.tokenize import word_tokenize
-import requests
-from urllib.parse import unquote
 import time
+from article_cache import ARTICLE_CACHE_DIR, ArticleCache, cache_articles
+from chunking import CHUNK_OVERLAP, CHUNK_SIZE, chunk_cached_articles
+from index_artifacts import CHUNKS_PATH
+from streaming import CHECKPOINT_EVERY, JsonlCheckpointWriter, run_key
+from wikipedia_fetcher import DEFAULT_MAX_RETRIES, DEFAULT_RATE, DEFAULT_WORKERS, WIKI_API_URL, WikipediaFetcher
 
 # =========================
 # Wikipedia Chunking Script
@@ -13,182 +14,102 @@ import time
 # This script loads Wikipedia article URLs (fixed and/or random), downloads their content,
 # cleans and chunks the text, and saves the resulting chunks with metadata for RAG retrieval.
 # It supports command-line flags to select which URL sources to use.
+# The stages are streamed, so memory does not grow with the number of articles:
+# 1. Fetch: articles missing from the local raw article cache (article_cache.py) are downloaded
+#    concurrently by wikipedia_fetcher.py (bounded workers, global rate limit, retry with backoff).
+#    --offline never touches the network and fails fast if an article is not cached.
+# 2. Chunk: cached articles are cleaned and chunked on a process pool (chunking.py), a bounded
+#    number of articles ahead, and collected in input order.
+# 3. Write: chunks are appended to data/wikipedia_chunks.jsonl (one chunk per line) with a
+#    checkpoint every --checkpoint-every articles; an interrupted run with the same URLs and
+#    parameters resumes after the last checkpointed article (--restart starts over).
 
-# Chunking parameters
-CHUNK_SIZE = 300  # Number of tokens per chunk
-CHUNK_OVERLAP = 50  # Overlap between consecutive chunks (tokens)
-
-# Load fixed Wikipedia URLs (required for --use-fixed)
-with open(os.path.join(os.getcwd(), 'data', 'fixed_urls.json'), 'r') as f:
-    fixed_urls = json.load(f)
-
-# Parse command-line arguments to select which URLs to process
-import argparse
-parser = argparse.ArgumentParser(description="Chunk Wikipedia articles from fixed and/or random URLs.")
-parser.add_argument('--use-fixed', action='store_true', help='Include fixed_urls.json')
-parser.add_argument('--use-random', action='store_true', help='Include random_urls.json')
-args = parser.parse_args()
 
-# Build the list of URLs to process based on flags
-urls = []
-if args.use_fixed:
-    urls.extend(fixed_urls)
-if args.use_random:
-    random_urls_path = os.path.join(os.getcwd(), 'data', 'random_urls.json')
-    if os.path.exists(random_urls_path):
-        with open(random_urls_path, 'r', encoding='utf-8') as f:
-            random_urls = json.load(f)
-        urls.extend(random_urls)
-    else:
-        print(f"[WARN] random_urls.json not found, skipping random URLs.")
-if not urls:
-    raise ValueError("No URLs to process. Use --use-fixed and/or --use-random.")
+def main():
+    # Load fixed Wikipedia URLs (required for --use-fixed)
+    with open(os.path.join(os.getcwd(), 'data', 'fixed_urls.json'), 'r') as f:
+        fixed_urls = json.load(f)
 
-# Initialize Wikipedia API client
-wiki = wikipediaapi.Wikipedia(user_agent='HybridRAGStudent/1.0 (2024aa05851@wilp.bits-pilani.ac.in)', language='en')
+    # Parse command-line arguments to select which URLs to process
+    parser = argparse.ArgumentParser(description="Chunk Wikipedia articles from fixed and/or random URLs.")
+    parser.add_argument('--use-fixed', action='store_true', help='Include fixed_urls.json')
+    parser.add_argument('--use-random', action='store_true', help='Include random_urls.json')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Maximum concurrent API requests (1 = sequential)')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help='Global API rate limit in requests/s (0 = unlimited)')
+    parser.add_argument('--max-retries', type=int, default=DEFAULT_MAX_RETRIES, help='Retries per API request (exponential backoff)')
+    parser.add_argument('--api-url', default=WIKI_API_URL, help='MediaWiki API endpoint (e.g. a local stand-in server)')
+    parser.add_argument('--cache-dir', default=ARTICLE_CACHE_DIR, help='Raw article cache directory')
+    parser.add_argument('--offline', action='store_true', help='Only use the article cache; fail if an article is missing')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Tokens per chunk')
+    parser.add_argument('--chunk-overlap', type=int, default=CHUNK_OVERLAP, help='Overlap between consecutive chunks (tokens)')
+    parser.add_argument('--chunk-workers', type=int, default=None, help='Chunking processes (default: all cores, 1 = in-process)')
+    parser.add_argument('--checkpoint-every', type=int, default=CHECKPOINT_EVERY, help='Articles between checkpoints')
+    parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint and start over')
+    args = parser.parse_args()
 
-# Clean Wikipedia text: remove references, templates, and extra whitespace
-
-def clean_text(text):
-    text = re.sub(r'\[\d+\]', '', text)  # Remove [1], [2], etc.
-    text = re.sub(r'\{\{.*?\}\}', '', text, flags=re.DOTALL)  # Remove templates
-    text = re.sub(r'\n+', '\n', text)
-    text = re.sub(r'\s+', ' ', text)
-    return text.strip()
+    # Build the list of URLs to process based on flags
+    urls = []
+    if args.use_fixed:
+        urls.extend(fixed_urls)
+    if args.use_random:
+        random_urls_path = os.path.join(os.getcwd(), 'data', 'random_urls.json')
+        if os.path.exists(random_urls_path):
+            with open(random_urls_path, 'r', encoding='utf-8') as f:
+                random_urls = json.load(f)
+            urls.extend(random_urls)
+        else:
+            print(f"[WARN] random_urls.json not found, skipping random URLs.")
+    if not urls:
+        raise ValueError("No URLs to process. Use --use-fixed and/or --use-random.")
 
-# Split text into overlapping chunks of tokens for retrieval
+    # Resume from the last checkpoint of an interrupted run with the same inputs
+    writer = JsonlCheckpointWriter(CHUNKS_PATH, run_key(urls=urls, chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap),
+                                   checkpoint_every=args.checkpoint_every)
+    done, chunk_id = writer.resume(restart=args.restart)
+    todo = urls[done:]
 
-def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    words = word_tokenize(text)
-    chunks = []
-    i = 0
-    while i < len(words):
-        chunk = words[i:i+chunk_size]
-        if len(chunk) < 50:
-            break  # Skip very short trailing chunks
-        chunks.append(' '.join(chunk))
-        i += chunk_size - overlap
-    return chunks
+    # Stage 1: stream URLs through the raw article cache, downloading misses (online only)
+    article_cache = ArticleCache(args.cache_dir)
+    fetcher = None
+    if not args.offline:
+        fetcher = WikipediaFetcher(api_url=args.api_url, max_workers=args.workers, rate=args.rate, max_retries=args.max_retries)
+    cached_urls = cache_articles(todo, article_cache, fetcher)
 
-# Main chunking loop: download, clean, and chunk each Wikipedia article
-all_chunks = []
-chunk_id = 0
+    # Stage 2: clean and chunk the cached articles in parallel (results arrive in input order)
+    results = chunk_cached_articles(cached_urls, article_cache, args.chunk_size, args.chunk_overlap, args.chunk_workers)
 
-print(f"[LOG] Starting chunking for {len(urls)} Wikipedia articles...")
-for i, url in enumerate(urls):
-    if i % 25 == 0 and i > 0:
-        print(f"[LOG] Chunked {i}/{len(urls)} articles...")
-    # Try multiple title variants to maximize Wikipedia API hit rate
-    raw_title = url.split('/wiki/')[-1]
-    tried_titles = [raw_title]
-    if raw_title and not raw_title[0].isupper():
-        tried_titles.append(raw_title[0].upper() + raw_title[1:])
-    if '_' in raw_title:
-        tried_titles.append(raw_title.replace('_', ' '))
-    page = None
-    for t in tried_titles:
-        try:
-            candidate = wiki.page(t)
-            if candidate.exists():
-                page = candidate
-                break
-        except Exception as e:
-            print(f"[ERROR] Exception during wiki.page/exists for '{t}': {e}")
-            time.sleep(2)
-    used_fallback = False
-    fallback_title = None
-    # Fallback: use Wikipedia search API if direct lookup fails
-    if not page or not page.exists():
-        search_url = f"https://en.wikipedia.org/w/api.php?action=query&list=search&srsearch={raw_title}&format=json"
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                print(f"[DEBUG] Calling Wikipedia search API for URL: {url} | Query: {raw_title} (attempt {attempt+1})")
-                headers = {"User-Agent": "HybridRAGStudent/1.0 (2024aa05851@wilp.bits-pilani.ac.in)"}
-                resp = requests.get(search_url, timeout=8, headers=headers)
-                time.sleep(1.0)  # Avoid rate limiting
-                if resp.status_code == 200:
-                    data = resp.json()
-                    print(f"[DEBUG] Raw search API response for URL: {url} | Query: {raw_title}\n{json.dumps(data, indent=2, ensure_ascii=False)}")
-                    search_results = data.get('query', {}).get('search', [])
-                    if search_results:
-                        print(f"[DEBUG] Search results for URL: {url} | Query: {raw_title}")
-                        for idx, result in enumerate(search_results):
-                            print(f"    [{idx+1}] {result['title']}")
-                        top_title = search_results[0]['title']
-                        try:
-                            candidate = wiki.page(top_title)
-                            if candidate.exists():
-                                page = candidate
-                                used_fallback = True
-                                fallback_title = top_title
-                        except Exception as e:
-                            print(f"[ERROR] Exception during fallback wiki.page/exists for '{top_title}': {e}")
-                        break  # Success, exit retry loop
-                    else:
-                        print(f"[DEBUG] No search results for URL: {url} | Query: {raw_title}")
-                        break
-                else:
-                    print(f"[DEBUG] Wikipedia search API returned status {resp.status_code} for URL: {url} | Query: {raw_title}")
-            except Exception as e:
-                print(f"[WARN] Wikipedia search API failed for {raw_title} (attempt {attempt+1}): {e}")
-                time.sleep(2.0)  # Wait longer before retrying
-    if used_fallback:
-        print(f"[LOG] Fallback used for URL: {url} | Fallback title: {fallback_title}")
-    if not page or not page.exists():
-        print(f"[WARN] Page does not exist for URL: {url} (tried: {tried_titles})")
-        continue
-    title = page.title
-    try:
-        text = clean_text(page.text)
-    except Exception as e:
-        print(f"[ERROR] Exception during page.text for '{title}': {e}")
-        continue
-    # Extract intro/summary (first paragraph or summary attribute)
-    intro = ''
-    try:
-        if hasattr(page, 'summary') and page.summary:
-            intro = clean_text(page.summary)
-        else:
-            intro = text.split('\n\n')[0]
-    except Exception as e:
-        print(f"[ERROR] Exception during intro extraction for '{title}': {e}")
-        intro = ''
-    # Compose first chunk: title + intro
-    first_chunk = f"Title: {title}\nIntro: {intro}"
-    all_chunks.append({
-        'chunk_id': f'{chunk_id}',
-        'url': url,
-        'title': title,
-        'chunk_index': 0,
-        'text': first_chunk
-    })
-    chunk_id += 1
-    # Chunk the rest of the article (excluding intro)
-    rest_text = text[len(intro):].strip() if intro else text
-    if rest_text:
-        try:
-            chunks = chunk_text(rest_text)
+    # Stage 3: append chunks to the JSONL corpus, checkpointing after whole articles
+    num_articles = 0
+    num_tokens = 0
+    start = time.perf_counter()
+    print(f"[LOG] Starting chunking for {len(todo)} Wikipedia articles...")
+    for i, (url, result) in enumerate(results):
+        if i % 25 == 0 and i > 0:
+            print(f"[LOG] Chunked {i}/{len(todo)} articles...")
+        if result is not None:
+            title, chunks, article_tokens = result
             for idx, chunk in enumerate(chunks):
-                all_chunks.append({
+                writer.write({
                     'chunk_id': f'{chunk_id}',
                     'url': url,
                     'title': title,
-                    'chunk_index': idx + 1,  # +1 because 0 is the intro chunk
+                    'chunk_index': idx,  # 0 is the title + intro chunk
                     'text': chunk
                 })
                 chunk_id += 1
-            print(f"[LOG] Processed: {title} ({len(chunks)+1} chunks)")
-        except Exception as e:
-            print(f"[ERROR] Exception during chunking for '{title}': {e}")
-            print(f"[LOG] Processed: {title} (1 chunk - intro only)")
-    else:
-        print(f"[LOG] Processed: {title} (1 chunk - intro only)")
-print(f"[LOG] Finished chunking all articles. Total chunks: {len(all_chunks)}")
+            num_articles += 1
+            num_tokens += article_tokens
+            print(f"[LOG] Processed: {title} ({len(chunks)} chunks)" if len(chunks) > 1 else f"[LOG] Processed: {title} (1 chunk - intro only)")
+        writer.commit_article()
+    writer.finish()
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"[LOG] Finished chunking all articles. Total chunks: {chunk_id}")
+    print(f"[LOG] Throughput: {num_articles / elapsed:.1f} articles/s, {num_tokens / elapsed:.0f} tokens/s "
+          f"({num_articles} articles, {num_tokens} tokens in {elapsed:.2f}s)")
+    if fetcher is not None:
+        print(f"[LOG] Wikipedia API round trips: {fetcher.request_count} for {len(todo)} URLs")
+    print(f"Total chunks created: {chunk_id} (saved to {CHUNKS_PATH})")
 
-# Save all chunks with metadata to JSON file for downstream retrieval
-os.makedirs(os.path.join(os.getcwd(), 'data'), exist_ok=True)
-with open(os.path.join(os.getcwd(), 'data', 'wikipedia_chunks.json'), 'w', encoding='utf-8') as f:
-    json.dump(all_chunks, f, indent=2, ensure_ascii=False)
 
-print(f"Total chunks created: {len(all_chunks)}")
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+import numpy as np
+
+# =====================================
+# Query Encoder
+# =====================================
+# Low-latency query side of dense retrieval. Chunk embeddings are built by SentenceTransformer in
+# full precision (dense_retrieval_faiss.py --build) and stay untouched; queries are encoded by:
+#   reference  SentenceTransformer.encode, as the index was built (default)
+#   fp32       the same transformer run directly (tokenizer loaded once, mean pooling and L2
+#              normalization in torch), without the SentenceTransformer pipeline around it
+#   int8       fp32 with PyTorch dynamic int8 quantization of every nn.Linear, traced with
+#              torch.jit.trace
+# The lean modes change query embeddings slightly against an index built with the reference
+# encoder, so they are opt-in: QUERY_ENCODER=int8 python code/app_streamlit.py ... selects the mode
+# of the dense, hybrid, cascade and sharded retrievers (DenseRetriever(encoder_mode=...) per retriever).
+# Traced graphs are specialized to their input shape, so batches are padded to LENGTH_BUCKETS tokens
+# and a power-of-two number of rows (padding is masked out of the pooling) and one graph is traced
+# per shape on first use. Every mode keeps an LRU of recent query embeddings, so repeated queries
+# skip the encoder. The lean modes assume mean pooling, which all-MiniLM-L6-v2 uses; --compare
+# reports their cosine agreement with the reference encoder, the overlap of their dense top-k
+# with the reference top-k and their batch-size-1 latency on generated_qa_pairs.json, and fails
+# when a mode is below MIN_MEAN_COSINE or MIN_TOP_K_OVERLAP (check a mode before enabling it).
+# Usage:
+#   python code/query_encoder.py --compare [--max-queries 100]
+
+QUERY_ENCODER_MODES = ('reference', 'fp32', 'int8')
+QUERY_ENCODER = os.environ.get('QUERY_ENCODER', 'reference')  # Mode used by the dense, cascade and sharded retrievers
+MIN_MEAN_COSINE = 0.99  # Mean cosine with the reference embeddings a mode must reach in --compare
+MIN_TOP_K_OVERLAP = 0.9  # Mean overlap of the dense top-k with the reference top-k
+QUERY_CACHE_SIZE = 1024  # Query embeddings kept per encoder (0 disables the cache)
+QUERY_MAX_TOKENS = 256  # Longest query encoded (all-MiniLM-L6-v2 was trained on up to 256 tokens)
+LENGTH_BUCKETS = (16, 32, 64, 128, 256)  # Padded query lengths of the traced graphs
+
+
+# Query encoder of one model in one mode, with an LRU of recent query embeddings
+# The model and tokenizer are loaded on first use.
+
+class QueryEncoder:
+    def __init__(self, model_name, mode=QUERY_ENCODER, cache_size=QUERY_CACHE_SIZE, max_tokens=QUERY_MAX_TOKENS):
+        if mode not in QUERY_ENCODER_MODES:
+            raise ValueError(f"Unknown query encoder mode '{mode}'. Choose one of {QUERY_ENCODER_MODES}.")
+        self.model_name = model_name
+        self.mode = mode
+        self.cache_size = cache_size
+        self.max_tokens = max_tokens
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()  # query -> normalized float32 embedding
+        self._model = None
+        self._tokenizer = None
+        self._graphs = {}  # (rows, tokens) -> traced module
+
+    def load(self):
+        if self._model is not None:
+            return self
+        print(f'Loading query encoder ({self.mode})...')
+        if self.mode == 'reference':
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+            return self
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+        self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        model = AutoModel.from_pretrained(self.model_name, torchscript=self.mode == 'int8').eval()
+        if self.mode == 'int8':
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        self._model = model
+        if self.mode == 'int8':
+            self._graph(1, LENGTH_BUCKETS[0])  # Single short queries are the common case
+        return self
+
+    # Embedding dimension (loads the model)
+    @property
+    def dim(self):
+        model = self.load()._model
+        return model.get_sentence_embedding_dimension() if self.mode == 'reference' else model.config.hidden_size
+
+    # Normalized float32 query embeddings, one row per query; cached queries skip the encoder
+    def encode(self, queries, batch_size=32):
+        queries = list(queries)
+        embeddings = {}
+        for query in queries:
+            if query in self._cache:
+                self._cache.move_to_end(query)
+                embeddings[query] = self._cache[query]
+        missing = [query for query in dict.fromkeys(queries) if query not in embeddings]
+        self.hits += len(queries) - sum(query not in embeddings for query in queries)
+        self.misses += len(missing)
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            for query, embedding in zip(batch, self._embed(batch)):
+                embeddings[query] = embedding
+                if self.cache_size:
+                    self._cache[query] = embedding
+                    if len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+        if not queries:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([embeddings[query] for query in queries])
+
+    def _embed(self, texts):
+        self.load()
+        if self.mode == 'reference':
+            q_emb = self._model.encode(texts, batch_size=len(texts), normalize_embeddings=True)
+            return np.array(q_emb).astype('float32').reshape(len(texts), -1)
+        import torch
+        inputs = self._tokenizer(texts, padding=True, truncation=True, max_length=self.max_tokens, return_tensors='pt')
+        input_ids, mask = inputs['input_ids'], inputs['attention_mask']
+        with torch.inference_mode():
+            if self.mode == 'int8':
+                rows = 1 << (len(texts) - 1).bit_length()
+                tokens = next((b for b in LENGTH_BUCKETS if b >= input_ids.shape[1]), input_ids.shape[1])
+                padded_ids = input_ids.new_full((rows, tokens), self._tokenizer.pad_token_id)
+                padded_ids[:len(texts), :input_ids.shape[1]] = input_ids
+                mask = mask.new_zeros((rows, tokens))
+                mask[:len(texts), :input_ids.shape[1]] = inputs['attention_mask']
+                hidden = self._graph(rows, tokens)(padded_ids, mask)[0]
+            else:
+                hidden = self._model(input_ids=input_ids, attention_mask=mask)[0]
+            # Mean pooling over the real tokens, then L2 normalization (as SentenceTransformer does)
+            weights = mask.unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * weights).sum(dim=1) / weights.sum(dim=1).clamp(min=1e-9)
+            pooled = torch.nn.functional.normalize(pooled[:len(texts)], p=2, dim=1)
+        return pooled.numpy().astype(np.float32)
+
+    # Traced int8 model for (rows, tokens) inputs, traced on first use
+    def _graph(self, rows, tokens):
+        if (rows, tokens) not in self._graphs:
+            import torch
+            example = torch.ones((rows, tokens), dtype=torch.long)
+            with torch.no_grad():
+                self._graphs[(rows, tokens)] = torch.jit.trace(self._model, (example, example), check_trace=False)
+        return self._graphs[(rows, tokens)]
+
+    def clear_cache(self):
+        self._cache.clear()
+        self.hits = self.misses = 0
+
+
+# Process-wide encoders used by the retrievers, one per (model, mode), so dense, hybrid and
+# cascade retrieval share one model and one query cache
+_encoders = {}
+
+
+def get_query_encoder(model_name, mode=QUERY_ENCODER):
+    if (model_name, mode) not in _encoders:
+        _encoders[(model_name, mode)] = QueryEncoder(model_name, mode)
+    return _encoders[(model_name, mode)]
+
+
+# Cosine agreement, dense top-k overlap and batch-size-1 latency of every mode against the reference
+# encoder on the questions of generated_qa_pairs.json (query cache disabled while timing)
+# Returns True if every mode reaches min_cosine and min_overlap.
+
+def compare(max_queries=100, top_k=10, modes=QUERY_ENCODER_MODES, min_cosine=MIN_MEAN_COSINE,
+            min_overlap=MIN_TOP_K_OVERLAP):
+    from evaluation_metrics import QA_PATH
+    from dense_retrieval_faiss import get_dense_retriever
+    with open(QA_PATH, 'r', encoding='utf-8') as f:
+        questions = [qa['question'] for qa in json.load(f)[:max_queries]]
+    dense = get_dense_retriever().load()
+    model_name = dense.manifest['model']
+    reference = None
+    passed = True
+    print(f"[LOG] {len(questions)} queries, {model_name}, dense top_k={top_k}")
+    print(f"{'mode':>9} | {'cos mean':>8} {'cos min':>8} | {'top-k overlap':>13} | {'p50':>8} {'p99':>8} {'speedup':>7} | ok")
+    for mode in ['reference'] + [m for m in modes if m != 'reference']:
+        encoder = QueryEncoder(model_name, mode, cache_size=0).load()
+        encoder.encode(questions[:1])  # Warm-up
+        latencies = []
+        for question in questions:
+            start = time.perf_counter()
+            encoder.encode([question])
+            latencies.append((time.perf_counter() - start) * 1000)
+        q_emb = encoder.encode(questions)
+        ids = dense.top_k(q_emb, top_k)[1]
+        if reference is None:
+            reference = q_emb, ids, np.percentile(latencies, 50)
+        cosines = np.sum(q_emb * reference[0], axis=1)
+        overlap = np.mean([len(set(a) & set(b)) / top_k for a, b in zip(ids, reference[1])])
+        p50 = np.percentile(latencies, 50)
+        ok = cosines.mean() >= min_cosine and overlap >= min_overlap
+        passed &= ok
+        print(f"{mode:>9} | {cosines.mean():>8.5f} {cosines.min():>8.5f} | {overlap:>13.1%} | "
+              f"{p50:>6.2f}ms {np.percentile(latencies, 99):>6.2f}ms {reference[2] / p50:>6.2f}x | {'yes' if ok else 'NO'}")
+    cached = QueryEncoder(model_name, QUERY_ENCODER).load()
+    cached.encode(questions)
+    start = time.perf_counter()
+    for question in questions:
+        cached.encode([question])
+    print(f"[LOG] Cached query ({QUERY_ENCODER}): {(time.perf_counter() - start) / len(questions) * 1000:.3f}ms")
+    if not passed:
+        print(f"[WARN] Some modes are below a mean cosine of {min_cosine} or a top-{top_k} overlap of "
+              f"{min_overlap:.0%} with the reference encoder; keep QUERY_ENCODER=reference for them.")
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the lean query encoders with the reference SentenceTransformer.")
+    parser.add_argument('--compare', action='store_true', help='Report cosine agreement, top-k overlap and latency')
+    parser.add_argument('--max-queries', type=int, default=100, help='Number of questions from generated_qa_pairs.json')
+    parser.add_argument('--top-k', type=int, default=10, help='Dense results compared per query')
+    parser.add_argument('--min-cosine', type=float, default=MIN_MEAN_COSINE, help='Required mean cosine with the reference')
+    parser.add_argument('--min-overlap', type=float, default=MIN_TOP_K_OVERLAP, help='Required mean top-k overlap')
+    args = parser.parse_args()
+    if args.compare:
+        sys.exit(0 if compare(args.max_queries, args.top_k, min_cosine=args.min_cosine, min_overlap=args.min_overlap) else 1)
+    else:
+        parser.print_help()
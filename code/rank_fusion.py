@@ -0,0 +1,88 @@
+import numpy as np
+
+# =====================================
+# N-way Weighted Rank Fusion
+# =====================================
+# Fuses any number of ranked lists (dense, sparse, title match, ...) with per-retriever weights.
+# Supported methods:
+#   - 'rrf':     sum of weight / (k + rank)                       (ranks are 1-based)
+#   - 'combsum': sum of weight * normalized score
+#   - 'combmnz': combsum multiplied by the number of lists that returned the document
+# Scores can be normalized per list with 'minmax' or 'zscore' before CombSUM/CombMNZ.
+# All work is done on integer chunk-id arrays: one np.unique + bincount to aggregate and an
+# argpartition to select the top-n, so candidate depths of several hundred stay cheap.
+
+FUSION_METHODS = ('rrf', 'combsum', 'combmnz')
+NORMALIZATIONS = ('minmax', 'zscore', 'none')
+
+
+# Normalize one list of retrieval scores
+
+def normalize_scores(scores, normalization='minmax'):
+    if normalization not in NORMALIZATIONS:
+        raise ValueError(f"Unknown normalization '{normalization}'. Choose one of {NORMALIZATIONS}.")
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(scores) == 0 or normalization == 'none':
+        return scores
+    if normalization == 'minmax':
+        # Maps each list onto [0, 1]; a list of equal scores maps to 1
+        lo, hi = scores.min(), scores.max()
+        if hi == lo:
+            return np.ones_like(scores)
+        return (scores - lo) / (hi - lo)
+    # zscore
+    std = scores.std()
+    if std == 0:
+        return np.zeros_like(scores)
+    return (scores - scores.mean()) / std
+
+
+# Select the indices of the top_n largest values, ordered by (-value, tie_key)
+
+def top_n_indices(values, top_n, tie_key=None):
+    if tie_key is None:
+        tie_key = np.arange(len(values))
+    if top_n < len(values):
+        # Keep everything tied with the n-th value so the tie-break below stays exact
+        kth = np.partition(values, len(values) - top_n)[len(values) - top_n]
+        candidates = np.flatnonzero(values >= kth)
+    else:
+        candidates = np.arange(len(values))
+    order = np.lexsort((tie_key[candidates], -values[candidates]))
+    return candidates[order][:top_n]
+
+
+# Fuse ranked lists of integer chunk ids
+# ranked_ids: list of 1-D int arrays, each ordered best-first
+# weights: one weight per list (default 1.0 each)
+# scores: list of raw score arrays aligned with ranked_ids (required for combsum/combmnz)
+# Returns (chunk_ids, fused_scores) for the top_n documents. Ties are broken by the position
+# of the document's first occurrence across the input lists (earlier lists win).
+
+def fuse(ranked_ids, weights=None, method='rrf', scores=None, normalization='minmax', k=60, top_n=5):
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method '{method}'. Choose one of {FUSION_METHODS}.")
+    if weights is None:
+        weights = [1.0] * len(ranked_ids)
+    if len(weights) != len(ranked_ids):
+        raise ValueError(f"Got {len(weights)} weights for {len(ranked_ids)} ranked lists.")
+    if method != 'rrf' and (scores is None or len(scores) != len(ranked_ids)):
+        raise ValueError(f"Fusion method '{method}' needs one score array per ranked list.")
+
+    ids = [np.asarray(r, dtype=np.int64) for r in ranked_ids]
+    contributions = []
+    for i, list_ids in enumerate(ids):
+        if method == 'rrf':
+            contributions.append(weights[i] / (k + np.arange(1, len(list_ids) + 1)))
+        else:
+            contributions.append(weights[i] * normalize_scores(scores[i], normalization))
+    if not ids or sum(len(list_ids) for list_ids in ids) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    all_ids = np.concatenate(ids)
+    unique_ids, first_pos, inverse = np.unique(all_ids, return_index=True, return_inverse=True)
+    fused = np.bincount(inverse, weights=np.concatenate(contributions), minlength=len(unique_ids))
+    if method == 'combmnz':
+        fused *= np.bincount(inverse, minlength=len(unique_ids))
+    top = top_n_indices(fused, top_n, tie_key=first_pos)
+    return unique_ids[top], fused[top]
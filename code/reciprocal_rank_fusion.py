@@ -1,53 +1,49 @@
-import json
-import os
 import sys
-from dense_retrieval_faiss import retrieve_dense
-from sparse_retrieval_bm25 import retrieve_sparse
+from chunk_store import get_chunk_store
+from dense_retrieval_faiss import retrieve_dense, retrieve_dense_batch
+from sparse_retrieval_bm25 import retrieve_sparse, retrieve_sparse_batch
+from rank_fusion import fuse
 
 # =====================================
 # Reciprocal Rank Fusion (RRF) Script
 # =====================================
 # This script fuses dense and sparse retrieval results using the RRF algorithm.
-# It loads chunk metadata, combines results, and provides a sample interactive query.
+# fuse_results accepts any number of weighted result lists and RRF / CombSUM / CombMNZ
+# (implemented on integer chunk-id arrays in rank_fusion.py).
+# It looks up chunk text in the chunk store, combines results, and provides a sample interactive query.
+
+# Fuse any number of retriever result lists (lists of chunk dicts with 'chunk_id' and 'score')
+# method: 'rrf', 'combsum' or 'combmnz' (see rank_fusion.py); weights: one per result list
+# Returns the top_n chunk dicts with 'fused_score' (and 'rrf_score' for RRF) and their text
+
+def fuse_results(result_lists, weights=None, method='rrf', normalization='minmax', k=60, top_n=5):
+    ranked_ids = [[int(r['chunk_id']) for r in results] for results in result_lists]
+    scores = [[r.get('score', 0.0) for r in results] for results in result_lists]
+    fused_ids, fused_scores = fuse(ranked_ids, weights=weights, method=method, scores=scores,
+                                   normalization=normalization, k=k, top_n=top_n)
+    # Merge metadata for output (first list that returned a chunk provides its metadata)
+    id_to_meta = {}
+    for results in result_lists:
+        for r in results:
+            id_to_meta.setdefault(int(r['chunk_id']), r)
+    fused_results = []
+    for cid, score in zip(fused_ids, fused_scores):
+        meta = id_to_meta[int(cid)].copy()
+        meta['fused_score'] = float(score)
+        if method == 'rrf':
+            meta['rrf_score'] = float(score)
+        # Add text field from the memory-mapped chunk store
+        meta['text'] = get_chunk_store().text(cid)
+        fused_results.append(meta)
+    return fused_results
 
-# Load all chunk text for lookup (for display in fused results)
-CHUNKS_PATH = os.path.join(os.getcwd(), 'data', 'wikipedia_chunks.json')
-with open(CHUNKS_PATH, 'r', encoding='utf-8') as f:
-    _all_chunks = json.load(f)
-_chunkid_to_text = {c['chunk_id']: c['text'] for c in _all_chunks}
 
 # Reciprocal Rank Fusion algorithm
 # Combines ranked lists from dense and sparse retrievals into a single fused ranking
 # k: RRF constant (controls score decay), top_n: number of results to return
 
 def reciprocal_rank_fusion(dense_results, sparse_results, k=60, top_n=5):
-    # Create a set of all unique chunk IDs from both dense and sparse results
-    all_ids = set([r['chunk_id'] for r in dense_results] + [r['chunk_id'] for r in sparse_results])
-    scores = {}
-    for chunk_id in all_ids:
-        # Find the rank of the chunk in both dense and sparse results
-        rank_dense = next((i for i, r in enumerate(dense_results) if r['chunk_id'] == chunk_id), None)
-        rank_sparse = next((i for i, r in enumerate(sparse_results) if r['chunk_id'] == chunk_id), None)
-        score = 0.0
-        # Calculate score contribution from dense result rank
-        if rank_dense is not None:
-            score += 1.0 / (k + rank_dense + 1)
-        # Calculate score contribution from sparse result rank
-        if rank_sparse is not None:
-            score += 1.0 / (k + rank_sparse + 1)
-        scores[chunk_id] = score
-    # Sort all chunk IDs by their RRF score in descending order and take the top_n
-    sorted_ids = sorted(scores, key=lambda x: scores[x], reverse=True)[:top_n]
-    # Merge metadata for output
-    id_to_meta = {r['chunk_id']: r for r in dense_results + sparse_results}
-    fused_results = []
-    for cid in sorted_ids:
-        meta = id_to_meta[cid].copy()
-        meta['rrf_score'] = scores[cid]
-        # Add text field from original chunk
-        meta['text'] = _chunkid_to_text.get(cid, '')
-        fused_results.append(meta)
-    return fused_results
+    return fuse_results([dense_results, sparse_results], method='rrf', k=k, top_n=top_n)
 
 if __name__ == '__main__':
     # Example usage: interactive query
@@ -22,8 +22,9 @@ PIPELINE_STEPS = [
     ("Sample random Wikipedia URLs", "sample_random_wikipedia_urls.py"),
     ("Preprocess and chunk Wikipedia articles (fixed)", "preprocess_and_chunk_wikipedia.py --use-fixed"),
     ("Preprocess and chunk Wikipedia articles (random)", "preprocess_and_chunk_wikipedia.py --use-random"),
-    ("Build dense vector index (FAISS)", "dense_retrieval_faiss.py"),
-    ("Build sparse index (BM25)", "sparse_retrieval_bm25.py"),
+    ("Build memory-mapped chunk store", "chunk_store.py --convert"),
+    ("Build dense vector index (FAISS)", "dense_retrieval_faiss.py --build"),
+    ("Build sparse index (BM25)", "sparse_retrieval_bm25.py --build"),
     ("Reciprocal Rank Fusion (RRF)", "reciprocal_rank_fusion.py"),
     ("Generate Q&A pairs", "generate_qa_pairs.py"),
     ("Run full RAG evaluation pipeline", "evaluate_rag_pipeline.py"),
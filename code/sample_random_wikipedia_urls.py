@@ -1,65 +1,82 @@
 import json
 import os
-import random
-import requests
-import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
+from wikipedia_fetcher import MAX_TITLES_PER_REQUEST, WikipediaFetcher
 
 # Function to sample random Wikipedia article URLs
 # Ensures each article has at least min_words words and is not in the exclude list
 # Handles API errors, rate limiting, and logs progress
+# Candidates come 50 at a time from one generator=random request (with prop=info for the URL and
+# wikitext length); pages too short to possibly hold min_words words are skipped without ever
+# downloading their extract, so only plausible candidates cost an extracts request.
 
-def get_random_wikipedia_urls(n: int, min_words: int = 200, exclude_urls: List[str] = None, max_attempts_per_url: int = 300) -> List[str]:
+def get_random_wikipedia_urls(n: int, min_words: int = 200, exclude_urls: List[str] = None, max_attempts_per_url: int = 300,
+                              fetcher: WikipediaFetcher = None) -> List[str]:
     """
     Sample n random Wikipedia article URLs with at least min_words words in the main text.
     Excludes any URLs in exclude_urls.
     Returns a list of valid Wikipedia article URLs.
     """
+    fetcher = fetcher or WikipediaFetcher()
     S = set(exclude_urls) if exclude_urls else set()
     urls = []
     attempts = 0
     while len(urls) < n and attempts < n * max_attempts_per_url:
-        # Request a random Wikipedia article URL
-        resp = requests.get('https://en.wikipedia.org/wiki/Special:Random', allow_redirects=True, timeout=10, headers={"User-Agent": "HybridRAGStudent/1.0 (2024aa05851@wilp.bits-pilani.ac.in)"})
-        url = resp.url
-        # Skip if already sampled or in exclude list
-        if url in S or url in urls:
+        # Request a batch of random articles (main namespace) with their URLs and wikitext sizes
+        try:
+            data = fetcher.api_get({
+                'action': 'query',
+                'generator': 'random',
+                'grnnamespace': 0,
+                'grnlimit': MAX_TITLES_PER_REQUEST,
+                'prop': 'info',
+                'inprop': 'url',
+            })
+        except Exception as e:
+            print(f"[WARN] Random article request failed: {e}")
             attempts += 1
             continue
-        # Fetch article text using Wikipedia API to check length
-        api_url = f'https://en.wikipedia.org/w/api.php?action=query&prop=extracts&explaintext&format=json&redirects=1&titles={url.split("/wiki/")[-1]}'
-        try:
-            api_resp = requests.get(api_url, timeout=10, headers={"User-Agent": "HybridRAGStudent/1.0 (2024aa05851@wilp.bits-pilani.ac.in)"})
-            if api_resp.status_code != 200:
-                print(f"[WARN] API HTTP {api_resp.status_code} for {url}")
-                attempts += 1
-                time.sleep(2.0)
+        pages = list(data.get('query', {}).get('pages', {}).values())
+        attempts += max(1, len(pages))
+        candidates = []
+        for page in pages:
+            url = page.get('fullurl')
+            # Skip if already sampled or in exclude list
+            if not url or url in S or url in urls or url in [c['fullurl'] for c in candidates]:
                 continue
-            try:
-                data = api_resp.json()
-            except Exception as e_json:
-                print(f"[WARN] JSON decode failed for {url}: {e_json}\nResponse text: {api_resp.text[:200]}")
-                attempts += 1
-                time.sleep(2.0)
+            # Every word needs at least one character plus a separator, and markup only adds length
+            if page.get('length', 0) < 2 * min_words:
+                print(f"[SKIP] Too short: {url} ({page.get('length', 0)} bytes of wikitext)")
+                continue
+            candidates.append(page)
+        # Fetch article text of the remaining candidates to check length
+        with ThreadPoolExecutor(max_workers=fetcher.max_workers) as pool:
+            results = list(pool.map(lambda page: _extract_words(fetcher, page['title']), candidates))
+        for page, words in zip(candidates, results):
+            url = page['fullurl']
+            if words is None or len(urls) >= n:
                 continue
-            pages = data.get('query', {}).get('pages', {})
-            text = next(iter(pages.values())).get('extract', '')
             # Only keep articles with enough words
-            if len(text.split()) >= min_words:
+            if words >= min_words:
                 urls.append(url)
-                print(f"[LOG] Sampled: {url} ({len(text.split())} words)")
+                print(f"[LOG] Sampled: {url} ({words} words)")
             else:
-                print(f"[SKIP] Too short: {url} ({len(text.split())} words)")
-        except Exception as e:
-            print(f"[WARN] Failed to fetch or parse: {url} | {e}")
-            attempts += 1
-            time.sleep(2.0)
-            continue
-        attempts += 1
-        time.sleep(1.0)  # Be polite to Wikipedia servers
+                print(f"[SKIP] Too short: {url} ({words} words)")
     print(f"[LOG] Sampled {len(urls)} random Wikipedia URLs (target: {n})")
+    print(f"[LOG] Wikipedia API round trips: {fetcher.request_count}")
     return urls
 
+# Word count of an article's plain-text extract, or None if it could not be fetched
+
+def _extract_words(fetcher, title):
+    try:
+        page = fetcher.query_page(title)
+    except Exception as e:
+        print(f"[WARN] Failed to fetch or parse: {title} | {e}")
+        return None
+    return len(page.get('extract', '').split()) if page else None
+
 # Main entry point for script execution
 # Loads fixed URLs, samples random URLs, and saves them to disk
 
@@ -0,0 +1,284 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import numpy as np
+from chunk_store import CHUNK_STORE_DIR, ChunkStore
+from dense_retrieval_faiss import BUILD_BATCH_SIZE, EMBEDDING_MODEL, ChunkEncoder, create_index, embed_texts, read_dense_index
+from embedding_cache import EMBEDDING_CACHE_DIR, EmbeddingCache
+from index_artifacts import (CHUNKS_PATH, check_fingerprint, check_same_corpus, corpus_fingerprint, iter_chunks,
+                             read_manifest, report_memory, write_manifest)
+from query_encoder import get_query_encoder
+from sparse_retrieval_bm25 import (BM25_B, BM25_EPSILON, BM25_K1, BM25Index, apply_global_bm25_stats, global_bm25_stats,
+                                   tokenize, write_bm25_index)
+from streaming import batched
+
+# =====================================
+# Sharded Scatter-Gather Retrieval
+# =====================================
+# Splits the corpus into N shards of consecutive chunk ids, each with its own FAISS index (exact
+# inner product, vectors stored under their global chunk ids) and BM25 index, and serves them
+# from one worker process per shard:
+# - The coordinator (ShardedRetriever) encodes / tokenizes each query batch once, sends it to
+#   every shard in parallel and merges the per-shard top-k lists by (-score, chunk id).
+# - BM25 shards are rewritten with collection-wide statistics (df summed over shards, global
+#   document count and avgdl), so shard scores are comparable and equal to the single index.
+# - Results therefore match retrieve_dense / retrieve_sparse on the same corpus (up to the order
+#   of exactly tied dense scores), and RRF over the merged lists matches reciprocal_rank_fusion.
+# Each worker scans only its shard and FAISS runs single-threaded per worker, so query cost is
+# split across cores. Workers memory-map their FAISS and BM25 shard and report their memory.
+# Shards are built from a compacted corpus (run incremental_index.py --compact first).
+# Usage:
+#   python code/sharded_retrieval.py --build --num-shards 4
+#   python code/sharded_retrieval.py --benchmark   (compare with the single-index path)
+
+SHARDS_DIR = os.path.join(os.getcwd(), 'data', 'shards')
+NUM_SHARDS = 4
+SHARD_MANIFEST_FILE = 'manifest.json'
+SHARD_FAISS_FILE = 'faiss_index.bin'
+SHARD_BM25_DIR = 'bm25'
+
+
+def shard_dir(shards_dir, shard):
+    return os.path.join(shards_dir, f'shard_{shard:03d}')
+
+
+# Build num_shards shards of consecutive chunk ids from the corpus
+# Embeddings come from the embedding cache (only uncached chunks are encoded); the corpus is read
+# once for the dense indexes and once per shard for the BM25 indexes.
+
+def build_shards(num_shards=NUM_SHARDS, chunks_path=CHUNKS_PATH, shards_dir=SHARDS_DIR, model_name=EMBEDDING_MODEL,
+                 embedding_cache_dir=EMBEDDING_CACHE_DIR, k1=BM25_K1, b=BM25_B, epsilon=BM25_EPSILON):
+    import faiss
+    num_chunks = sum(1 for _ in iter_chunks(chunks_path))
+    if num_chunks < num_shards:
+        raise ValueError(f"Cannot split {num_chunks} chunks into {num_shards} shards.")
+    bounds = np.linspace(0, num_chunks, num_shards + 1).astype(np.int64)  # Shard s holds ids [bounds[s], bounds[s+1])
+    fingerprint = corpus_fingerprint(chunks_path)
+    dirs = [shard_dir(shards_dir, s) for s in range(num_shards)]
+    for path in dirs:
+        os.makedirs(path, exist_ok=True)
+
+    # Dense shards: one pass over the corpus, each batch split at the shard bounds
+    print(f'Building {num_shards} FAISS shards...')
+    encode = ChunkEncoder(model_name)
+    cache = EmbeddingCache(model_name, True, embedding_cache_dir) if embedding_cache_dir else None
+    indexes = None
+    start = 0
+    for batch in batched(iter_chunks(chunks_path), BUILD_BATCH_SIZE):
+        embeddings = embed_texts([chunk['text'] for chunk in batch], encode, cache)
+        if indexes is None:
+            indexes = [create_index('flat', embeddings.shape[1], num_chunks)[0] for _ in range(num_shards)]
+        ids = np.arange(start, start + len(batch), dtype=np.int64)
+        shards = np.searchsorted(bounds, ids, side='right') - 1
+        for s in np.unique(shards):
+            rows = shards == s
+            indexes[s].add_with_ids(embeddings[rows], ids[rows])
+        start += len(batch)
+    for s, index in enumerate(indexes):
+        faiss.write_index(index, os.path.join(dirs[s], SHARD_FAISS_FILE))
+    dim = indexes[0].d
+
+    # BM25 shards: local indexes first, then collection-wide idf / avgdl written into each
+    print(f'Building {num_shards} BM25 shards...')
+    bm25_dirs = [os.path.join(path, SHARD_BM25_DIR) for path in dirs]
+    for s, bm25_dir in enumerate(bm25_dirs):
+        write_bm25_index(islice(iter_chunks(chunks_path), int(bounds[s]), int(bounds[s + 1])), bm25_dir, fingerprint,
+                         k1=k1, b=b, epsilon=epsilon)
+    idf, num_docs, avgdl = global_bm25_stats(bm25_dirs, epsilon)
+    for bm25_dir in bm25_dirs:
+        apply_global_bm25_stats(bm25_dir, idf, num_docs, avgdl)
+
+    write_manifest(os.path.join(shards_dir, SHARD_MANIFEST_FILE), {
+        'corpus_fingerprint': fingerprint,
+        'model': model_name,
+        'normalize_embeddings': True,
+        'dim': int(dim),
+        'num_chunks': num_chunks,
+        'num_shards': num_shards,
+        'bounds': bounds.tolist(),
+        'bm25': {'k1': k1, 'b': b, 'epsilon': epsilon, 'avgdl': avgdl},
+    })
+    print(f'{num_shards} shards saved to {shards_dir}')
+
+
+# Per-process shard state (set by _init_shard)
+_shard = {}
+
+
+def _init_shard(path, doc_base):
+    import faiss
+    faiss.omp_set_num_threads(1)  # One core per shard worker
+    _shard['faiss'] = read_dense_index(os.path.join(path, SHARD_FAISS_FILE), mmap=True)
+    _shard['bm25'] = BM25Index(os.path.join(path, SHARD_BM25_DIR))
+    _shard['doc_base'] = doc_base
+    report_memory(f'Shard worker {os.path.basename(path)}')
+
+
+# Top_k (chunk ids, scores) of the shard for every query vector
+def _shard_dense(q_emb, top_k):
+    D, I = _shard['faiss'].search(q_emb, top_k)
+    return [(ids, scores) for ids, scores in zip(I, D)]
+
+
+# Top_k (chunk ids, scores) of the shard for every tokenized query
+def _shard_sparse(tokenized_queries, top_k):
+    index = _shard['bm25']
+    if len(tokenized_queries) == 1:
+        results = [index.top_k(tokenized_queries[0], top_k)]
+    else:
+        results = index.top_k_batch(tokenized_queries, top_k)
+    return [(doc_ids + _shard['doc_base'], scores) for doc_ids, scores in results]
+
+
+# Merge the per-shard top lists of one query into the global top_k, ordered by (-score, chunk id)
+# (FAISS pads missing results with id -1; those are dropped)
+
+def merge_top_k(shard_results, top_k):
+    ids = np.concatenate([ids for ids, _ in shard_results]).astype(np.int64)
+    scores = np.concatenate([scores for _, scores in shard_results]).astype(np.float64)
+    valid = ids >= 0
+    ids, scores = ids[valid], scores[valid]
+    order = np.lexsort((ids, -scores))[:top_k]
+    return ids[order], scores[order]
+
+
+# Query-side coordinator: one single-process pool per shard, started on first use
+# Refuses to serve shards whose corpus fingerprint does not match the current chunk file
+
+class ShardedRetriever:
+    def __init__(self, shards_dir=SHARDS_DIR, store_dir=CHUNK_STORE_DIR, chunks_path=CHUNKS_PATH):
+        self.shards_dir = shards_dir
+        self.store_dir = store_dir
+        self.chunks_path = chunks_path
+        self.manifest = None
+        self._pools = None
+        self._chunks = None
+        self._encoder = None
+
+    def load(self):
+        if self._pools is not None:
+            return self
+        manifest = read_manifest(os.path.join(self.shards_dir, SHARD_MANIFEST_FILE))
+        check_fingerprint(manifest, 'sharded', self.chunks_path)
+        chunks = ChunkStore(self.store_dir)
+        check_same_corpus(manifest, chunks.manifest, 'sharded')
+        # spawn: workers must not inherit OpenMP / BLAS thread state from the coordinator
+        context = multiprocessing.get_context('spawn')
+        self._pools = [ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_shard,
+                                           initargs=(shard_dir(self.shards_dir, s), manifest['bounds'][s]))
+                       for s in range(manifest['num_shards'])]
+        self.manifest = manifest
+        self._chunks = chunks
+        self._encoder = get_query_encoder(manifest['model'])
+        return self
+
+    def close(self):
+        for pool in self._pools or []:
+            pool.shutdown()
+        self._pools = None
+
+    def __enter__(self):
+        return self.load()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Send one task to every shard and merge the per-query results
+    def _scatter_gather(self, fn, queries, top_k):
+        futures = [pool.submit(fn, queries, top_k) for pool in self.load()._pools]
+        per_shard = [future.result() for future in futures]
+        return [merge_top_k([results[qi] for results in per_shard], top_k) for qi in range(len(queries))]
+
+    def _results(self, merged):
+        batch_results = []
+        for ids, scores in merged:
+            results = []
+            for idx, score in zip(ids, scores):
+                meta = self._chunks.meta(idx)
+                meta['score'] = float(score)
+                results.append(meta)
+            batch_results.append(results)
+        return batch_results
+
+    # Dense retrieval over all shards; same output as DenseRetriever.search_batch
+    def search_dense_batch(self, queries, top_k=5):
+        self.load()
+        q_emb = self._encoder.encode(queries)
+        return self._results(self._scatter_gather(_shard_dense, q_emb, top_k))
+
+    # BM25 retrieval over all shards; same output as SparseRetriever.search_batch
+    def search_sparse_batch(self, queries, top_k=5):
+        return self._results(self._scatter_gather(_shard_sparse, [tokenize(query) for query in queries], top_k))
+
+    def search_dense(self, query, top_k=5):
+        return self.search_dense_batch([query], top_k)[0]
+
+    def search_sparse(self, query, top_k=5):
+        return self.search_sparse_batch([query], top_k)[0]
+
+    # Dense and sparse retrieval fused with RRF, as reciprocal_rank_fusion does for one index
+    def search_rrf(self, query, top_k=20, k=60, top_n=5):
+        from reciprocal_rank_fusion import reciprocal_rank_fusion
+        return reciprocal_rank_fusion(self.search_dense(query, top_k), self.search_sparse(query, top_k), k=k, top_n=top_n)
+
+
+# Compare the sharded path with the single-index retrievers on generated_qa_pairs.json:
+# identical result ids and per-query latency / throughput, one query at a time and batched
+
+def benchmark(shards_dir=SHARDS_DIR, top_k=10, max_queries=100):
+    import json
+    from benchmark_sparse_retrieval import time_queries
+    from evaluation_metrics import QA_PATH
+    from dense_retrieval_faiss import DenseRetriever
+    from sparse_retrieval_bm25 import SparseRetriever
+    with open(QA_PATH, 'r', encoding='utf-8') as f:
+        questions = [qa['question'] for qa in json.load(f)[:max_queries]]
+    dense, sparse = DenseRetriever(), SparseRetriever()
+    with ShardedRetriever(shards_dir) as sharded:
+        runs = [
+            ('dense', lambda q: dense.search(q, top_k), lambda q: sharded.search_dense(q, top_k),
+             lambda: dense.search_batch(questions, top_k), lambda: sharded.search_dense_batch(questions, top_k)),
+            ('sparse', lambda q: sparse.search(q, top_k), lambda q: sharded.search_sparse(q, top_k),
+             lambda: sparse.search_batch(questions, top_k), lambda: sharded.search_sparse_batch(questions, top_k)),
+        ]
+        print(f"[LOG] {sharded.manifest['num_shards']} shards, {len(questions)} queries, top_k={top_k}")
+        print(f"{'':>7} | {'single p50':>10} {'p99':>8} | {'sharded p50':>11} {'p99':>8} | "
+              f"{'batch single':>12} {'sharded':>10} | mismatches")
+        for name, single_fn, sharded_fn, single_batch, sharded_batch in runs:
+            single_fn(questions[0]), sharded_fn(questions[0])  # Load indexes and models
+            p50, p99, single_out = time_queries(single_fn, questions)
+            s_p50, s_p99, sharded_out = time_queries(sharded_fn, questions)
+            start = time.perf_counter()
+            single_batch()
+            single_qps = len(questions) / (time.perf_counter() - start)
+            start = time.perf_counter()
+            sharded_batch()
+            sharded_qps = len(questions) / (time.perf_counter() - start)
+            mismatches = sum([r['chunk_id'] for r in a] != [r['chunk_id'] for r in b] for a, b in zip(single_out, sharded_out))
+            print(f"{name:>7} | {p50:>8.2f}ms {p99:>6.2f}ms | {s_p50:>9.2f}ms {s_p99:>6.2f}ms | "
+                  f"{single_qps:>8.0f} q/s {sharded_qps:>6.0f} q/s | {mismatches}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build or query sharded dense + BM25 indexes.")
+    parser.add_argument('--build', action='store_true', help='Split the corpus into shards and build their indexes')
+    parser.add_argument('--num-shards', type=int, default=NUM_SHARDS, help='Number of shards (one worker process each)')
+    parser.add_argument('--no-embedding-cache', action='store_true', help='Encode every chunk instead of reusing cached embeddings')
+    parser.add_argument('--benchmark', action='store_true', help='Compare results and latency with the single-index retrievers')
+    args = parser.parse_args()
+    if args.build:
+        build_shards(args.num_shards, embedding_cache_dir=None if args.no_embedding_cache else EMBEDDING_CACHE_DIR)
+    if args.benchmark:
+        benchmark()
+    # Example usage: interactive query
+    elif sys.stdin.isatty():
+        query = input('Enter your query: ')
+        with ShardedRetriever() as retriever:
+            for r in retriever.search_rrf(query):
+                print(f"RRF Score: {r['rrf_score']:.4f} | Title: {r['title']} | URL: {r['url']}")
+    else:
+        print("[INFO] Non-interactive mode detected. Skipping query input.")
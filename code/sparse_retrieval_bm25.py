@@ -1,54 +1,764 @@
+import argparse
 import json
+import math
 import os
+import shutil
 import sys
-from rank_bm25 import BM25Okapi
+import tempfile
+from array import array
+from collections import Counter
+import numpy as np
 from nltk.tokenize import word_tokenize
+from chunk_store import CHUNK_STORE_DIR, ChunkStore
+from index_artifacts import (CHUNK_META_PATH, CHUNKS_PATH, check_fingerprint, check_same_corpus, corpus_fingerprint,
+                             iter_chunks, read_manifest, write_chunk_metadata, write_manifest)
+from metadata_filter import compile_filter
+from streaming import batched
 
 # =============================
 # Sparse Retrieval (BM25) Script
 # =============================
 # This script builds a sparse BM25 index for Wikipedia chunks using tokenized text.
-# It saves chunk metadata for retrieval and provides a sample retrieval function.
+# Building (--build) tokenizes the corpus once and writes a compact inverted index to disk:
+# a sorted vocabulary (term id = position), contiguous doc-id / term-frequency postings arrays,
+# document lengths and precomputed IDF. Querying memory-maps these arrays, so startup cost does
+# not depend on corpus size and several worker processes share one page-cache copy.
+# Scores are identical to rank_bm25.BM25Okapi (k1=1.5, b=0.75, epsilon=0.25).
+# Metadata filters (where=..., see metadata_filter.py) mask every postings list before scoring.
 
 # Parameters for file paths
-CHUNKS_PATH = os.path.join(os.getcwd(), 'data', 'wikipedia_chunks.json')
-BM25_INDEX_PATH = os.path.join(os.getcwd(), 'data', 'bm25_index.json')  # (not used for saving index, but for consistency)
-CHUNK_META_PATH = os.path.join(os.getcwd(), 'data', 'chunk_metadata.json')
+BM25_INDEX_DIR = os.path.join(os.getcwd(), 'data', 'bm25_index')
 
-# Load preprocessed Wikipedia chunks
-with open(CHUNKS_PATH, 'r', encoding='utf-8') as f:
-    chunks = json.load(f)
+# BM25Okapi parameters (same defaults as rank_bm25)
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+SEGMENT_DOCS = 50000  # Documents per spilled postings segment while building
 
-texts = [chunk['text'] for chunk in chunks]
-chunk_meta = [{k: v for k, v in chunk.items() if k != 'text'} for chunk in chunks]
+# Files making up the on-disk inverted index (all arrays are .npy, opened with mmap_mode='r')
+TERMS_FILE = 'terms.bin'                # UTF-8 bytes of all terms, sorted, concatenated
+TERM_OFFSETS_FILE = 'term_offsets.npy'  # int64[V+1] byte offsets into terms.bin
+POSTINGS_OFFSETS_FILE = 'postings_offsets.npy'  # int64[V+1] offsets into the postings arrays
+POSTINGS_DOCS_FILE = 'postings_docs.npy'  # int32[P] doc ids, ascending within each term
+POSTINGS_TFS_FILE = 'postings_tfs.npy'    # int32[P] term frequency of the term in that doc
+DOC_LENS_FILE = 'doc_lens.npy'          # int32[N] tokens per document
+IDF_FILE = 'idf.npy'                    # float64[V] BM25Okapi idf (with epsilon floor)
+TERM_MAX_FILE = 'term_max.npy'          # float64[V] max score contribution of each term
+TERM_MAX_TF_FILE = 'term_max_tf.npy'    # int32[V] largest term frequency in each term's postings
+TERM_MIN_DL_FILE = 'term_min_dl.npy'    # int32[V] shortest document in each term's postings
+MANIFEST_FILE = 'manifest.json'
 
-# Tokenize the corpus for BM25
-print('Tokenizing corpus...')
-tokenized_corpus = [word_tokenize(text.lower()) for text in texts]
+# Incremental updates (incremental_index.py) are kept in an overlay directory inside the index:
+# new documents go to small delta segments (complete BM25 indexes with local doc ids) and the
+# collection statistics of the live documents are rewritten per update. A full build or a
+# compaction removes the overlay.
+UPDATES_DIR = 'updates'
+UPDATES_FILE = 'updates.json'           # segments [(name, first doc id)], counts, avgdl, fingerprint
+EXTRA_TERMS_FILE = 'extra_terms.json'   # terms missing from the base vocabulary (ids V, V+1, ...)
+DELETED_FILE = 'deleted.npy'            # bool[N] deleted documents
+ALL_DOC_LENS_FILE = 'doc_lens.npy'      # int32[N] lengths of base and delta documents
+LIVE_DF_FILE = 'df.npy'                 # int64[V'] live documents containing each term
+LIVE_IDF_FILE = 'idf.npy'               # float64[V'] idf over the live documents
+LIVE_TERM_MAX_FILE = 'term_max.npy'     # float64[V'] score upper bound of each term
+LIVE_MAX_TF_FILE = 'max_tf.npy'         # int32[V'] largest tf ever indexed for each term
+LIVE_MIN_DL_FILE = 'min_dl.npy'         # int32[V'] shortest document ever indexed for each term
+
+
+# Tokenize text exactly as the index (and the original BM25Okapi build) does
+
+def tokenize(text):
+    return word_tokenize(text.lower())
+
+
+# Build the inverted index from the chunk corpus and persist it to index_dir
+
+def build_bm25_index(chunks_path=CHUNKS_PATH, index_dir=BM25_INDEX_DIR, meta_path=CHUNK_META_PATH,
+                     k1=BM25_K1, b=BM25_B, epsilon=BM25_EPSILON):
+    # Stream preprocessed Wikipedia chunks (the corpus is read twice instead of held in memory)
+    write_bm25_index(iter_chunks(chunks_path), index_dir, corpus_fingerprint(chunks_path), k1=k1, b=b, epsilon=epsilon)
+    write_chunk_metadata(iter_chunks(chunks_path), meta_path)
+
+
+# Tokenize an iterable of chunks and write the inverted index files (plus manifest) to index_dir
+# Chunks are consumed as a stream: postings of every segment_docs documents are spilled to a
+# temporary segment file, and the segments are merged straight into the memory-mapped postings
+# arrays at the end. Memory is bounded by the segment size plus per-vocabulary-term and
+# per-document counters, and the files are identical to building from one in-memory list.
+
+def write_bm25_index(chunks, index_dir, fingerprint, k1=BM25_K1, b=BM25_B, epsilon=BM25_EPSILON,
+                     segment_docs=SEGMENT_DOCS):
+    os.makedirs(index_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=index_dir) as spill_dir:
+        # Tokenize the corpus and count term frequencies per document, one segment at a time
+        print('Tokenizing corpus...')
+        first_ids = {}  # term -> id in order of first occurrence
+        df = []         # first-occurrence id -> number of documents containing the term
+        doc_lens = array('i')
+        segments = []
+        for segment in batched(chunks, segment_docs):
+            seg_terms, seg_docs, seg_tfs = array('i'), array('i'), array('i')
+            for chunk in segment:
+                tokens = tokenize(chunk['text'])
+                doc_id = len(doc_lens)
+                doc_lens.append(len(tokens))
+                for term, tf in Counter(tokens).items():
+                    term_id = first_ids.setdefault(term, len(first_ids))
+                    if term_id == len(df):
+                        df.append(0)
+                    df[term_id] += 1
+                    seg_terms.append(term_id)
+                    seg_docs.append(doc_id)
+                    seg_tfs.append(tf)
+            path = os.path.join(spill_dir, f'segment_{len(segments):05d}.npz')
+            np.savez(path, terms=np.frombuffer(seg_terms, dtype=np.int32), docs=np.frombuffer(seg_docs, dtype=np.int32),
+                     tfs=np.frombuffer(seg_tfs, dtype=np.int32))
+            segments.append(path)
+        num_docs = len(doc_lens)
+        if num_docs == 0:
+            raise ValueError('Cannot build a BM25 index from an empty corpus.')
+        doc_lens = np.frombuffer(doc_lens, dtype=np.int32)
+        avgdl = int(doc_lens.sum(dtype=np.int64)) / num_docs
+
+        # IDF exactly as BM25Okapi._calc_idf: the average is accumulated in first-occurrence order
+        # and negative idfs are floored to epsilon * average_idf
+        idf_first = []
+        idf_sum = 0
+        for freq in df:
+            idf = math.log(num_docs - freq + 0.5) - math.log(freq + 0.5)
+            idf_first.append(idf)
+            idf_sum += idf
+        eps = epsilon * (idf_sum / len(idf_first))
+        idf_first = np.array([eps if idf < 0 else idf for idf in idf_first], dtype=np.float64)
+
+        # Sorted vocabulary (by UTF-8 bytes, so lookups can binary-search the raw blob)
+        print('Building inverted index...')
+        encoded_first = [term.encode('utf-8') for term in first_ids]
+        del first_ids
+        order = sorted(range(len(encoded_first)), key=encoded_first.__getitem__)
+        sorted_id = np.empty(len(order), dtype=np.int32)  # first-occurrence id -> sorted term id
+        sorted_id[order] = np.arange(len(order), dtype=np.int32)
+        encoded_terms = [encoded_first[i] for i in order]
+        del encoded_first
+        term_offsets = np.zeros(len(encoded_terms) + 1, dtype=np.int64)
+        term_offsets[1:] = np.cumsum([len(t) for t in encoded_terms])
+        idf = idf_first[order]
+        postings_offsets = np.zeros(len(encoded_terms) + 1, dtype=np.int64)
+        postings_offsets[1:] = np.cumsum(np.array(df, dtype=np.int64)[order])
+        num_postings = int(postings_offsets[-1])
+
+        # Merge the segments into the postings arrays: segments hold increasing doc ids, so
+        # appending each segment's postings behind the previous ones keeps doc ids ascending
+        # within each term. Also track the per-term score upper bound (largest single-occurrence
+        # contribution over its postings), used by BM25Index.top_k to prune documents.
+        post_docs = np.lib.format.open_memmap(os.path.join(index_dir, POSTINGS_DOCS_FILE), mode='w+',
+                                              dtype=np.int32, shape=(num_postings,))
+        post_tfs = np.lib.format.open_memmap(os.path.join(index_dir, POSTINGS_TFS_FILE), mode='w+',
+                                             dtype=np.int32, shape=(num_postings,))
+        term_max = np.full(len(encoded_terms), -np.inf)
+        term_max_tf = np.zeros(len(encoded_terms), dtype=np.int32)
+        term_min_dl = np.full(len(encoded_terms), np.iinfo(np.int32).max, dtype=np.int32)
+        cursor = postings_offsets[:-1].copy()
+        for path in segments:
+            with np.load(path) as segment:
+                seg_terms = sorted_id[segment['terms']]
+                seg_order = np.argsort(seg_terms, kind='stable')
+                seg_terms = seg_terms[seg_order]
+                seg_docs = segment['docs'][seg_order]
+                seg_tfs = segment['tfs'][seg_order]
+            if len(seg_terms) == 0:
+                continue
+            group_starts = np.flatnonzero(np.r_[True, seg_terms[1:] != seg_terms[:-1]])
+            group_terms = seg_terms[group_starts]
+            rank = np.arange(len(seg_terms)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(seg_terms)]))
+            dest = cursor[seg_terms] + rank
+            post_docs[dest] = seg_docs
+            post_tfs[dest] = seg_tfs
+            cursor[group_terms] += np.diff(np.r_[group_starts, len(seg_terms)])
+            tf = seg_tfs.astype(np.float64)
+            doc_len = doc_lens[seg_docs]
+            contrib = idf[seg_terms] * (tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len / avgdl)))
+            term_max[group_terms] = np.maximum(term_max[group_terms], np.maximum.reduceat(contrib, group_starts))
+            term_max_tf[group_terms] = np.maximum(term_max_tf[group_terms], np.maximum.reduceat(seg_tfs, group_starts))
+            term_min_dl[group_terms] = np.minimum(term_min_dl[group_terms], np.minimum.reduceat(doc_len, group_starts))
+        post_docs.flush()
+        post_tfs.flush()
+        del post_docs, post_tfs
+
+    with open(os.path.join(index_dir, TERMS_FILE), 'wb') as f:
+        f.write(b''.join(encoded_terms))
+    np.save(os.path.join(index_dir, TERM_OFFSETS_FILE), term_offsets)
+    np.save(os.path.join(index_dir, POSTINGS_OFFSETS_FILE), postings_offsets)
+    np.save(os.path.join(index_dir, DOC_LENS_FILE), doc_lens)
+    np.save(os.path.join(index_dir, IDF_FILE), idf)
+    np.save(os.path.join(index_dir, TERM_MAX_FILE), term_max)
+    np.save(os.path.join(index_dir, TERM_MAX_TF_FILE), term_max_tf)
+    np.save(os.path.join(index_dir, TERM_MIN_DL_FILE), term_min_dl)
+    shutil.rmtree(os.path.join(index_dir, UPDATES_DIR), ignore_errors=True)  # Updates of a previous index
+    write_manifest(os.path.join(index_dir, MANIFEST_FILE), {
+        'corpus_fingerprint': fingerprint,
+        'tokenizer': 'nltk.word_tokenize(lower)',
+        'k1': k1,
+        'b': b,
+        'epsilon': epsilon,
+        'num_docs': num_docs,
+        'num_terms': len(encoded_terms),
+        'num_postings': num_postings,
+        'avgdl': avgdl,
+    })
+    print(f'BM25 index saved to {index_dir} ({len(encoded_terms)} terms, {num_postings} postings)')
+
+
+# Atomically replace an .npy file (readers that already mapped the old file keep their view)
+
+def _replace_npy(path, array):
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+# Largest term frequency and shortest document in each term's postings
+# Read from the build output; indexes built before these files existed get one pass over the postings
+
+def _term_bounds(index):
+    max_tf_path = os.path.join(index.index_dir, TERM_MAX_TF_FILE)
+    min_dl_path = os.path.join(index.index_dir, TERM_MIN_DL_FILE)
+    if os.path.exists(max_tf_path) and os.path.exists(min_dl_path):
+        return np.load(max_tf_path), np.load(min_dl_path)
+    starts = np.asarray(index.postings_offsets[:-1])
+    max_tf = np.maximum.reduceat(np.asarray(index.postings_tfs), starts)
+    min_dl = np.minimum.reduceat(np.asarray(index.doc_lens)[np.asarray(index.postings_docs)], starts)
+    return max_tf.astype(np.int32), min_dl.astype(np.int32)
+
+
+# Apply an incremental update to the index in index_dir without rebuilding it
+# New chunks (ids continuing the row numbers) are tokenized into a new delta segment and deleted
+# documents (pairs of doc id and chunk text) are re-tokenized to patch the document frequencies,
+# so the work is proportional to the changed documents (plus one pass over the vocabulary for
+# the idf). df, idf and avgdl are those of the live documents, so scores match a full rebuild up
+# to float rounding of the average idf used for the epsilon floor. Per-term score upper bounds use
+# the largest tf and shortest document ever indexed for the term, which stay valid after deletions.
+
+def update_bm25_index(chunks, deleted=(), index_dir=BM25_INDEX_DIR, fingerprint=None):
+    index = BM25Index(index_dir)
+    updates_dir = os.path.join(index_dir, UPDATES_DIR)
+    k1, b, epsilon = index.k1, index.b, index.manifest['epsilon']
+    if index.updates is None:
+        # First update: start from the statistics of the base index
+        os.makedirs(updates_dir, exist_ok=True)
+        updates = {'segments': [], 'num_docs': index.num_docs, 'num_live': index.num_docs,
+                   'total_len': int(np.asarray(index.doc_lens).sum(dtype=np.int64))}
+        deleted_docs = np.zeros(index.num_docs, dtype=bool)
+        df = np.diff(np.asarray(index.postings_offsets)).astype(np.int64)
+        max_tf, min_dl = _term_bounds(index)
+    else:
+        updates = dict(index.updates)
+        deleted_docs = np.array(index.deleted)
+        df = np.load(os.path.join(updates_dir, LIVE_DF_FILE))
+        max_tf = np.load(os.path.join(updates_dir, LIVE_MAX_TF_FILE))
+        min_dl = np.load(os.path.join(updates_dir, LIVE_MIN_DL_FILE))
+    doc_lens = np.asarray(index.doc_lens)
+    extra_ids = {term: index.num_terms + j for j, term in enumerate(index.extra_terms)}
+
+    # Deleted documents leave the live statistics (their postings are filtered at query time)
+    for doc_id, text in deleted:
+        if deleted_docs[doc_id]:
+            continue
+        deleted_docs[doc_id] = True
+        updates['num_live'] -= 1
+        updates['total_len'] -= int(doc_lens[doc_id])
+        for term in set(tokenize(text)):
+            df[index.term_id(term)] -= 1
+
+    # New documents go to a delta segment; its terms are mapped onto the base (+ extra) vocabulary
+    chunks = list(chunks)
+    if chunks:
+        for row, chunk in enumerate(chunks, start=updates['num_docs']):
+            if str(chunk['chunk_id']) != str(row):
+                raise ValueError(f"New chunk ids must continue the row numbers; found {chunk['chunk_id']!r} at row {row}.")
+        name = f"delta_{len(updates['segments']) + 1:05d}"
+        write_bm25_index(chunks, os.path.join(updates_dir, name), None, k1=k1, b=b, epsilon=epsilon)
+        segment = BM25Index(os.path.join(updates_dir, name))
+        seg_ids = np.empty(segment.num_terms, dtype=np.int64)
+        for j in range(segment.num_terms):
+            term = segment.term(j)
+            tid = index.term_id(term)
+            seg_ids[j] = tid if tid >= 0 else extra_ids.setdefault(term, index.num_terms + len(extra_ids))
+        grow = index.num_terms + len(extra_ids) - len(df)
+        df = np.concatenate([df, np.zeros(grow, dtype=np.int64)])
+        max_tf = np.concatenate([max_tf, np.zeros(grow, dtype=np.int32)])
+        min_dl = np.concatenate([min_dl, np.full(grow, np.iinfo(np.int32).max, dtype=np.int32)])
+        seg_max_tf, seg_min_dl = _term_bounds(segment)
+        df[seg_ids] += np.diff(np.asarray(segment.postings_offsets))
+        max_tf[seg_ids] = np.maximum(max_tf[seg_ids], seg_max_tf)
+        min_dl[seg_ids] = np.minimum(min_dl[seg_ids], seg_min_dl)
+        doc_lens = np.concatenate([doc_lens, segment.doc_lens])
+        deleted_docs = np.concatenate([deleted_docs, np.zeros(len(chunks), dtype=bool)])
+        updates['segments'] = updates['segments'] + [[name, updates['num_docs']]]
+        updates['num_docs'] += len(chunks)
+        updates['num_live'] += len(chunks)
+        updates['total_len'] += int(segment.doc_lens.sum(dtype=np.int64))
+    if updates['num_live'] == 0:
+        raise ValueError('Cannot delete every document of the BM25 index.')
+
+    # Statistics of the live documents, as BM25Okapi computes them (idf floored at epsilon * average idf)
+    num_live = updates['num_live']
+    avgdl = updates['total_len'] / num_live
+    present = df > 0
+    raw_idf = np.log(num_live - df[present] + 0.5) - np.log(df[present] + 0.5)
+    eps = epsilon * raw_idf.mean()
+    idf = np.zeros(len(df))
+    idf[present] = np.where(raw_idf < 0, eps, raw_idf)
+    tf = max_tf.astype(np.float64)
+    term_max = idf * (tf * (k1 + 1) / (tf + k1 * (1 - b + b * min_dl / avgdl)))
+
+    # Arrays first, updates.json last: an interrupted update keeps the old fingerprint and is refused as stale
+    with open(os.path.join(updates_dir, EXTRA_TERMS_FILE + '.tmp'), 'w', encoding='utf-8') as f:
+        json.dump(list(extra_ids), f, ensure_ascii=False)
+    os.replace(os.path.join(updates_dir, EXTRA_TERMS_FILE + '.tmp'), os.path.join(updates_dir, EXTRA_TERMS_FILE))
+    for name, array in ((DELETED_FILE, deleted_docs), (ALL_DOC_LENS_FILE, doc_lens.astype(np.int32)),
+                        (LIVE_DF_FILE, df), (LIVE_IDF_FILE, idf), (LIVE_TERM_MAX_FILE, term_max),
+                        (LIVE_MAX_TF_FILE, max_tf), (LIVE_MIN_DL_FILE, min_dl)):
+        _replace_npy(os.path.join(updates_dir, name), array)
+    updates.update(avgdl=avgdl, num_terms=len(df), corpus_fingerprint=fingerprint)
+    write_manifest(os.path.join(updates_dir, UPDATES_FILE), updates)
+    print(f"BM25 index updated: {len(chunks)} documents added, {num_live} live of {updates['num_docs']}, "
+          f"{len(updates['segments'])} delta segments")
+
+
+# Collection statistics of BM25 indexes built over disjoint parts of one corpus (shards)
+# Returns ({term: idf}, number of documents, avgdl) as BM25Okapi computes them over all the
+# documents: df is summed per term, idf uses the same float expression and the epsilon floor uses
+# the average over the union vocabulary (summed in a different order than a single build, so
+# floored idfs can differ in the last bit).
+
+def global_bm25_stats(index_dirs, epsilon=BM25_EPSILON):
+    df = Counter()
+    num_docs = 0
+    total_len = 0
+    for index_dir in index_dirs:
+        index = BM25Index(index_dir)
+        if index.updates is not None:
+            raise ValueError(f"{index_dir} has incremental updates; rebuild the shards from a compacted corpus.")
+        for term_id, freq in enumerate(np.diff(np.asarray(index.postings_offsets)).tolist()):
+            df[index.term(term_id)] += freq
+        num_docs += index.num_docs
+        total_len += int(np.asarray(index.doc_lens).sum(dtype=np.int64))
+    idf_of_df = {freq: math.log(num_docs - freq + 0.5) - math.log(freq + 0.5) for freq in set(df.values())}
+    eps = epsilon * (sum(idf_of_df[freq] for freq in df.values()) / len(df))
+    idf = {term: eps if idf_of_df[freq] < 0 else idf_of_df[freq] for term, freq in df.items()}
+    return idf, num_docs, total_len / num_docs
+
+
+# Replace the idf, score upper bounds and avgdl of one shard's index with collection statistics
+# (global_bm25_stats), so scores of different shards are comparable and equal to those of one
+# index over the whole corpus. Upper bounds use each term's largest tf and shortest document.
+
+def apply_global_bm25_stats(index_dir, idf_by_term, num_docs, avgdl):
+    index = BM25Index(index_dir)
+    k1, b = index.k1, index.b
+    idf = np.array([idf_by_term[index.term(term_id)] for term_id in range(index.num_terms)], dtype=np.float64)
+    max_tf, min_dl = _term_bounds(index)
+    tf = max_tf.astype(np.float64)
+    term_max = idf * (tf * (k1 + 1) / (tf + k1 * (1 - b + b * min_dl / avgdl)))
+    _replace_npy(os.path.join(index_dir, IDF_FILE), idf)
+    _replace_npy(os.path.join(index_dir, TERM_MAX_FILE), term_max)
+    write_manifest(os.path.join(index_dir, MANIFEST_FILE), dict(index.manifest, avgdl=avgdl, collection_num_docs=num_docs))
+
+
+# Read-only view of the on-disk inverted index
+# All arrays are memory-mapped; nothing proportional to corpus size is read at open time.
+# If incremental updates were applied, their overlay is opened as well: postings of the delta
+# segments are appended to the base postings, deleted documents are filtered out and idf, term
+# upper bounds, document lengths and avgdl come from the overlay.
+
+class BM25Index:
+    def __init__(self, index_dir=BM25_INDEX_DIR):
+        self.index_dir = index_dir
+        self.manifest = read_manifest(os.path.join(index_dir, MANIFEST_FILE))
+        self.k1 = self.manifest['k1']
+        self.b = self.manifest['b']
+        self.avgdl = self.manifest['avgdl']
+        self.num_docs = self.manifest['num_docs']  # Rows, including deleted documents
+        self.num_live = self.num_docs
+        self.num_terms = self.manifest['num_terms']  # Base vocabulary size
+        self.terms = np.memmap(os.path.join(index_dir, TERMS_FILE), dtype=np.uint8, mode='r') \
+            if os.path.getsize(os.path.join(index_dir, TERMS_FILE)) else np.zeros(0, dtype=np.uint8)
+        self.term_offsets = self._load(TERM_OFFSETS_FILE)
+        self.postings_offsets = self._load(POSTINGS_OFFSETS_FILE)
+        self.postings_docs = self._load(POSTINGS_DOCS_FILE)
+        self.postings_tfs = self._load(POSTINGS_TFS_FILE)
+        self.doc_lens = self._load(DOC_LENS_FILE)
+        self.idf = self._load(IDF_FILE)
+        self.term_max = self._load(TERM_MAX_FILE)
+        self.updates = None
+        self.segments = []      # (delta segment index, doc id of its first document)
+        self.extra_terms = []   # Terms missing from the base vocabulary, ids num_terms + position
+        self._extra_ids = {}
+        self.deleted = None
+        if os.path.exists(os.path.join(index_dir, UPDATES_DIR, UPDATES_FILE)):
+            self._load_updates()
+
+    def _load(self, name):
+        return np.load(os.path.join(self.index_dir, name), mmap_mode='r')
+
+    def _load_updates(self):
+        updates_dir = os.path.join(self.index_dir, UPDATES_DIR)
+        self.updates = read_manifest(os.path.join(updates_dir, UPDATES_FILE))
+        with open(os.path.join(updates_dir, EXTRA_TERMS_FILE), 'r', encoding='utf-8') as f:
+            self.extra_terms = json.load(f)
+        self._extra_ids = {term: self.num_terms + j for j, term in enumerate(self.extra_terms)}
+        self.segments = [(BM25Index(os.path.join(updates_dir, name)), doc_base) for name, doc_base in self.updates['segments']]
+        self.deleted = np.load(os.path.join(updates_dir, DELETED_FILE), mmap_mode='r')
+        self.doc_lens = np.load(os.path.join(updates_dir, ALL_DOC_LENS_FILE), mmap_mode='r')
+        self.idf = np.load(os.path.join(updates_dir, LIVE_IDF_FILE), mmap_mode='r')
+        self.term_max = np.load(os.path.join(updates_dir, LIVE_TERM_MAX_FILE), mmap_mode='r')
+        self.num_docs = self.updates['num_docs']
+        self.num_live = self.updates['num_live']
+        self.avgdl = self.updates['avgdl']
+        self.manifest = dict(self.manifest, corpus_fingerprint=self.updates['corpus_fingerprint'],
+                             num_docs=self.num_docs, num_live=self.num_live, avgdl=self.avgdl)
+
+    def _term_bytes(self, term_id):
+        return self.terms[self.term_offsets[term_id]:self.term_offsets[term_id + 1]].tobytes()
+
+    def term(self, term_id):
+        if term_id < self.num_terms:
+            return self._term_bytes(term_id).decode('utf-8')
+        return self.extra_terms[term_id - self.num_terms]
+
+    # Binary search of the sorted vocabulary; returns the term id or -1 if absent
+    def term_id(self, term):
+        key = term.encode('utf-8')
+        lo, hi = 0, self.num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num_terms and self._term_bytes(lo) == key:
+            return lo
+        return self._extra_ids.get(term, -1)
+
+    # Doc ids (ascending) and term frequencies of one term, live documents only
+    # mask (bool array over doc ids, see metadata_filter.py) keeps only the allowed documents
+    def postings(self, term_id, mask=None):
+        if term_id < self.num_terms:
+            start, end = self.postings_offsets[term_id], self.postings_offsets[term_id + 1]
+            docs, tfs = self.postings_docs[start:end], self.postings_tfs[start:end]
+        else:
+            docs, tfs = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        if self.updates is None:
+            if mask is not None:
+                keep = mask[docs]
+                return docs[keep], tfs[keep]
+            return docs, tfs
+        # Delta segments hold increasing doc ids, so appending their postings keeps docs ascending
+        term = self.term(term_id)
+        all_docs, all_tfs = [docs.astype(np.int64)], [tfs]
+        for segment, doc_base in self.segments:
+            seg_tid = segment.term_id(term)
+            if seg_tid >= 0:
+                seg_docs, seg_tfs = segment.postings(seg_tid)
+                all_docs.append(seg_docs.astype(np.int64) + doc_base)
+                all_tfs.append(seg_tfs)
+        docs, tfs = np.concatenate(all_docs), np.concatenate(all_tfs)
+        live = ~self.deleted[docs]
+        if mask is not None:
+            live &= mask[docs]
+        return docs[live], tfs[live]
+
+    # BM25 contribution of one term to the documents in its postings, using the same float
+    # expression as BM25Okapi.get_scores so accumulated scores are bit-identical
+    def term_scores(self, term_id, docs, tfs):
+        tf = tfs.astype(np.float64)
+        doc_len = self.doc_lens[docs]
+        return self.idf[term_id] * (tf * (self.k1 + 1) /
+                                    (tf + self.k1 * (1 - self.b + self.b * doc_len / self.avgdl)))
+
+    # Full score vector over the corpus for a tokenized query (duplicate tokens count twice,
+    # unknown tokens contribute nothing); documents outside mask score 0
+    def get_scores(self, tokenized_query, mask=None):
+        scores = np.zeros(self.num_docs)
+        for token in tokenized_query:
+            tid = self.term_id(token)
+            if tid < 0:
+                continue
+            docs, tfs = self.postings(tid, mask)
+            scores[docs] += self.term_scores(tid, docs, tfs)
+        return scores
+
+    # Top-k documents for a tokenized query without scoring the whole corpus
+    # Only the postings of the query terms are read. Terms are processed in decreasing order of
+    # their score upper bound (term-at-a-time MaxScore): once the k-th best partial score exceeds
+    # the summed upper bounds of the remaining terms, no unseen document can enter the top-k, so
+    # the remaining (low-idf, long) postings lists are only probed for the surviving candidates.
+    # Candidate scores are then recomputed in query-token order, which makes the returned scores
+    # and tie order (lower doc id first) identical to sorting get_scores() over the full corpus.
+    # Returns (doc_ids, scores) arrays of length min(top_k, num_docs).
+    # mask restricts the search to the allowed documents: every postings list is masked before
+    # scoring, so a restrictive filter scores fewer documents and still returns top_k of them
+    # (as long as top_k are allowed).
+    def top_k(self, tokenized_query, top_k, mask=None):
+        top_k = min(top_k, self._num_allowed(mask))
+        if top_k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        token_ids = [tid for tid in (self.term_id(t) for t in tokenized_query) if tid >= 0]
+        terms = Counter(token_ids)
+        if any(self.idf[tid] < 0 for tid in terms):
+            # Pruning needs non-negative contributions; fall back to exhaustive scoring
+            scores = self.get_scores(tokenized_query, mask)
+            if self.deleted is not None:
+                scores[self.deleted] = -np.inf
+            if mask is not None:
+                scores[~mask] = -np.inf
+            top = np.argsort(-scores, kind='stable')[:top_k]
+            return top, scores[top]
+
+        # Phase 1: term-at-a-time accumulation with MaxScore pruning
+        ordered = sorted(terms.items(), key=lambda item: -item[1] * self.term_max[item[0]])
+        bounds = [count * self.term_max[tid] for tid, count in ordered]
+        remaining = [sum(bounds[i + 1:]) for i in range(len(bounds))]
+        acc = np.zeros(self.num_docs)
+        seen = []
+        theta = 0.0
+        candidates = None
+        for i, (tid, count) in enumerate(ordered):
+            docs, tfs = self.postings(tid, mask)
+            if candidates is None:
+                acc[docs] += count * self.term_scores(tid, docs, tfs)
+                seen.append(docs)
+                # The k-th best partial score among this term's documents is a lower bound on the
+                # final k-th best score, because partial scores only grow
+                if len(docs) >= top_k:
+                    theta = max(theta, self._threshold(acc[docs], top_k))
+                if theta > 0 and remaining[i] < theta:
+                    # Unseen documents can no longer reach the top-k: keep only live candidates
+                    touched = np.concatenate(seen) if len(seen) > 1 else np.asarray(docs)
+                    candidates = np.unique(touched[acc[touched] + remaining[i] >= theta])
+            else:
+                hit_cands, hit_pos = self._probe(docs, candidates)
+                acc[hit_cands] += count * self.term_scores(tid, hit_cands, tfs[hit_pos])
+                theta = max(theta, self._threshold(acc[candidates], top_k))
+                candidates = candidates[acc[candidates] + remaining[i] >= theta]
+
+        # Phase 2: exact scores, accumulated in query-token order like BM25Okapi.get_scores
+        if candidates is None:
+            candidates = np.unique(np.concatenate(seen)) if seen else np.zeros(0, dtype=np.int64)
+            if [tid for tid, _ in ordered] != token_ids:
+                # Accumulation order differed from the query order: rescore through a fresh buffer
+                acc = np.zeros(self.num_docs)
+                for tid in token_ids:
+                    docs, tfs = self.postings(tid, mask)
+                    acc[docs] += self.term_scores(tid, docs, tfs)
+            scores = acc[candidates]
+        else:
+            # Few candidates survived pruning: probe each query term's postings for them only
+            scores = np.zeros(len(candidates))
+            for tid in token_ids:
+                docs, tfs = self.postings(tid, mask)
+                hit_idx, hit_pos = self._probe(docs, candidates, return_index=True)
+                scores[hit_idx] += self.term_scores(tid, docs[hit_pos], tfs[hit_pos])
+
+        # Order by (-score, doc id); argpartition first so only the head needs a full sort
+        if len(candidates) > top_k:
+            kth = np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+            keep = scores >= kth
+            candidates, scores = candidates[keep], scores[keep]
+        order = np.lexsort((candidates, -scores))[:top_k]
+        doc_ids, top_scores = candidates[order].astype(np.int64), scores[order]
+
+        # Fewer matching documents than top_k: pad with zero-score documents in corpus order
+        if len(doc_ids) < top_k:
+            fill = self._zero_fill(doc_ids, top_k - len(doc_ids), mask)
+            doc_ids = np.concatenate([doc_ids, fill])
+            top_scores = np.concatenate([top_scores, np.zeros(len(fill))])
+        return doc_ids, top_scores
+
+    # Top-k documents for many tokenized queries at once
+    # Every (query, document, contribution) triple is gathered from the postings (each term's
+    # contributions are computed once even if several queries share it), summed per
+    # (query, document) pair with one bincount and ranked with one lexsort. bincount adds the
+    # contributions of a pair in query-token order, so scores are identical to top_k().
+    # Returns a list of (doc_ids, scores) pairs, one per query; mask applies to every query.
+    def top_k_batch(self, tokenized_queries, top_k, mask=None):
+        top_k = min(top_k, self._num_allowed(mask))
+        if top_k <= 0:
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0)) for _ in tokenized_queries]
+        term_cache = {}
+        keys, contribs = [], []
+        for qi, tokenized_query in enumerate(tokenized_queries):
+            for token in tokenized_query:
+                tid = self.term_id(token)
+                if tid < 0:
+                    continue
+                if tid not in term_cache:
+                    docs, tfs = self.postings(tid, mask)
+                    term_cache[tid] = (docs.astype(np.int64), self.term_scores(tid, docs, tfs))
+                docs, contrib = term_cache[tid]
+                keys.append(qi * self.num_docs + docs)
+                contribs.append(contrib)
+        if keys:
+            pair_keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+            pair_scores = np.bincount(inverse, weights=np.concatenate(contribs), minlength=len(pair_keys))
+        else:
+            pair_keys, pair_scores = np.zeros(0, dtype=np.int64), np.zeros(0)
+        pair_queries, pair_docs = np.divmod(pair_keys, self.num_docs)
+
+        # Sort by (query, -score, doc id) and cut each query's segment at top_k
+        order = np.lexsort((pair_docs, -pair_scores, pair_queries))
+        pair_queries, pair_docs, pair_scores = pair_queries[order], pair_docs[order], pair_scores[order]
+        bounds = np.searchsorted(pair_queries, np.arange(len(tokenized_queries) + 1))
+        results = []
+        for qi in range(len(tokenized_queries)):
+            doc_ids = pair_docs[bounds[qi]:bounds[qi + 1]][:top_k]
+            scores = pair_scores[bounds[qi]:bounds[qi + 1]][:top_k]
+            if len(doc_ids) < top_k:
+                # Fewer matches than top_k: merge in zero-score documents by the same (-score, doc id) order
+                fill = self._zero_fill(doc_ids, top_k - len(doc_ids), mask)
+                doc_ids = np.concatenate([doc_ids, fill])
+                scores = np.concatenate([scores, np.zeros(len(fill))])
+                merged = np.lexsort((doc_ids, -scores))
+                doc_ids, scores = doc_ids[merged], scores[merged]
+            results.append((doc_ids, scores))
+        return results
+
+    # Number of live documents a query may return
+    def _num_allowed(self, mask):
+        if mask is None:
+            return self.num_live
+        if self.deleted is None:
+            return int(np.count_nonzero(mask))
+        return int(np.count_nonzero(mask & ~self.deleted))
+
+    # First `count` live (and allowed) documents in corpus order not in exclude, used to pad short
+    # result lists
+    def _zero_fill(self, exclude, count, mask=None):
+        if mask is not None:
+            pool = np.flatnonzero(mask if self.deleted is None else mask & ~self.deleted)
+            return np.setdiff1d(pool[:count + len(exclude)], exclude)[:count]
+        limit = count + len(exclude)
+        if self.deleted is None:
+            return np.setdiff1d(np.arange(limit), exclude)[:count]
+        pool = np.arange(min(self.num_docs, limit + self.num_docs - self.num_live))
+        return np.setdiff1d(pool[~self.deleted[pool]], exclude)[:count]
+
+    # k-th largest partial score, lowered by a relative slack so float rounding differences
+    # between accumulation orders can never prune a document that belongs in the top-k
+    @staticmethod
+    def _threshold(partial, top_k):
+        theta = np.partition(partial, len(partial) - top_k)[len(partial) - top_k]
+        return theta - 1e-9 * abs(theta)
+
+    # Locate candidate doc ids inside a sorted postings list by binary search
+    # Returns (matching candidates or their indices, positions in the postings list)
+    @staticmethod
+    def _probe(docs, candidates, return_index=False):
+        pos = np.searchsorted(docs, candidates)
+        valid = pos < len(docs)
+        hit = np.zeros(len(candidates), dtype=bool)
+        hit[valid] = docs[pos[valid]] == candidates[valid]
+        if return_index:
+            return np.flatnonzero(hit), pos[hit]
+        return candidates[hit], pos[hit]
+
+
+# Query-side sparse retriever
+# Opens the persisted index and chunk store on first use and refuses to serve an index
+# whose corpus fingerprint does not match the current chunk file
+
+class SparseRetriever:
+    def __init__(self, index_dir=BM25_INDEX_DIR, store_dir=CHUNK_STORE_DIR, chunks_path=CHUNKS_PATH):
+        self.index_dir = index_dir
+        self.store_dir = store_dir
+        self.chunks_path = chunks_path
+        self._index = None
+        self._chunks = None
+
+    def load(self):
+        if self._index is not None:
+            return self
+        index = BM25Index(self.index_dir)
+        check_fingerprint(index.manifest, 'BM25', self.chunks_path)
+        chunks = ChunkStore(self.store_dir)
+        check_same_corpus(index.manifest, chunks.manifest, 'BM25')
+        if index.num_docs != len(chunks):
+            raise ValueError(f"BM25 index has {index.num_docs} documents but the chunk store has {len(chunks)} chunks.")
+        self._chunks = chunks
+        self._index = index
+        return self
+
+    @property
+    def index(self):
+        return self.load()._index
+
+    @property
+    def chunks(self):
+        return self.load()._chunks
+
+    # Bitset of a metadata filter expression (None passes through)
+    def _mask(self, where):
+        return None if where is None else compile_filter(where, self.chunks)
+
+    # Given a query, returns top_k highest scoring chunks with scores
+    # where: metadata filter expression or bitset (metadata_filter.py) restricting the chunks
+    def search(self, query, top_k=5, where=None):
+        # Tokenize and lowercase the query
+        tokenized_query = tokenize(query)
+        # Score only the postings of the query terms and keep the top_k chunks
+        top_indices, scores = self.index.top_k(tokenized_query, top_k, self._mask(where))
+        results = []
+        # Collect metadata and scores for the top chunks
+        for idx, score in zip(top_indices, scores):
+            meta = self.chunks.meta(idx)
+            meta['score'] = float(score)
+            results.append(meta)
+        return results
+
+    # Batched version of search: one vectorized scoring pass for all queries
+    def search_batch(self, queries, top_k=5, where=None):
+        tokenized_queries = [tokenize(query) for query in queries]
+        batch_results = []
+        for top_indices, scores in self.index.top_k_batch(tokenized_queries, top_k, self._mask(where)):
+            results = []
+            for idx, score in zip(top_indices, scores):
+                meta = self.chunks.meta(idx)
+                meta['score'] = float(score)
+                results.append(meta)
+            batch_results.append(results)
+        return batch_results
+
+
+# Process-wide retriever used by retrieve_sparse (created on first query)
+_default_retriever = None
+
+
+def get_sparse_retriever():
+    global _default_retriever
+    if _default_retriever is None:
+        _default_retriever = SparseRetriever()
+    return _default_retriever
 
-# Build a BM25 index for sparse retrieval
-print('Building BM25 index...')
-bm25 = BM25Okapi(tokenized_corpus)
 
 # Example sparse retrieval function for interactive use
 # Given a query, returns top_k most similar chunks with scores
 
-def retrieve_sparse(query, top_k=5):
-    # Tokenize and lowercase the query
-    tokenized_query = word_tokenize(query.lower())
-    # Get BM25 scores for the query against the corpus
-    scores = bm25.get_scores(tokenized_query)
-    # Retrieve the indices of the top_k highest scoring chunks
-    top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
-    results = []
-    # Collect metadata and scores for the top chunks
-    for idx in top_indices:
-        meta = chunk_meta[idx].copy()
-        meta['score'] = float(scores[idx])
-        results.append(meta)
-    return results
+def retrieve_sparse(query, top_k=5, where=None):
+    return get_sparse_retriever().search(query, top_k=top_k, where=where)
+
+
+# Batched sparse retrieval: returns one result list per query, identical to retrieve_sparse
+
+def retrieve_sparse_batch(queries, top_k=5, where=None):
+    return get_sparse_retriever().search_batch(queries, top_k=top_k, where=where)
+
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build or query the on-disk BM25 index.")
+    parser.add_argument('--build', action='store_true', help='Tokenize the corpus and (re)build the inverted index')
+    args = parser.parse_args()
+    if args.build:
+        build_bm25_index()
     # Example usage: interactive query
     if sys.stdin.isatty():
         # Interactive mode: allow user to query
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+from collections import deque
+from itertools import islice
+
+# =====================================
+# Streaming Ingest Helpers
+# =====================================
+# Building blocks that keep the ingest pipeline (fetch -> clean -> chunk -> index) at bounded
+# memory: an ordered executor map with a bounded number of in-flight tasks, fixed-size batching
+# of iterators, and an append-only JSONL writer with periodic checkpoints so an interrupted run
+# resumes from the last committed article instead of starting over.
+
+CHECKPOINT_EVERY = 25  # Articles between checkpoints
+
+
+# Like executor.map, but submits at most `window` tasks ahead of the consumer
+# (Executor.map submits the whole iterable up front). Results are yielded in input order.
+
+def bounded_map(executor, fn, iterable, window):
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+# Split an iterable into lists of at most `size` items
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+# Fingerprint of the inputs and parameters of a run; a checkpoint is only resumed by a run
+# with the same key
+
+def run_key(**params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+# Append-only JSONL writer with checkpoints
+# Records are appended to <path>.part; every `checkpoint_every` committed articles the file is
+# flushed to disk and <path>.checkpoint.json records how many articles/records (and bytes) are
+# complete. resume() truncates a partial file back to its last checkpoint; finish() renames the
+# .part file to <path>, so a finished output file is always complete.
+
+class JsonlCheckpointWriter:
+    def __init__(self, path, key, checkpoint_every=CHECKPOINT_EVERY):
+        self.path = path
+        self.part_path = path + '.part'
+        self.checkpoint_path = path + '.checkpoint.json'
+        self.key = key
+        self.checkpoint_every = checkpoint_every
+        self.file = None
+        self.articles = 0  # Articles committed so far
+        self.records = 0   # Records written so far
+        self._uncheckpointed = 0
+
+    # Open the output, resuming from a matching checkpoint unless restart is set
+    # Returns (articles already committed, records already written)
+    def resume(self, restart=False):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        checkpoint = None
+        if not restart and os.path.exists(self.checkpoint_path) and os.path.exists(self.part_path):
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            if checkpoint.get('key') != self.key:
+                print(f"[WARN] Checkpoint at {self.checkpoint_path} belongs to a different run; starting over.")
+                checkpoint = None
+        if checkpoint is None:
+            self.file = open(self.part_path, 'wb')
+            self._write_checkpoint()
+        else:
+            self.file = open(self.part_path, 'r+b')
+            self.file.truncate(checkpoint['bytes'])  # Drop records written after the checkpoint
+            self.file.seek(checkpoint['bytes'])
+            self.articles = checkpoint['articles']
+            self.records = checkpoint['records']
+            print(f"[LOG] Resuming from checkpoint: {self.articles} articles, {self.records} records already written")
+        return self.articles, self.records
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.records += 1
+
+    # Mark one article (and all records written for it) as complete
+    def commit_article(self):
+        self.articles += 1
+        self._uncheckpointed += 1
+        if self._uncheckpointed >= self.checkpoint_every:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._write_checkpoint()
+        self._uncheckpointed = 0
+
+    def _write_checkpoint(self):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'key': self.key, 'articles': self.articles, 'records': self.records,
+                       'bytes': self.file.tell()}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    # Publish the complete output file and remove the checkpoint
+    def finish(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.part_path, self.path)
+        os.remove(self.checkpoint_path)
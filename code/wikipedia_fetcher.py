@@ -0,0 +1,287 @@
+import json
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from streaming import bounded_map
+
+# =====================================
+# Concurrent Wikipedia Fetcher
+# =====================================
+# Fetches Wikipedia articles through the MediaWiki API with a thread pool.
+# - Bounded concurrency: at most max_workers requests are in flight.
+# - A global token bucket limits the request rate across all workers.
+# - Every request is retried with exponential backoff (honouring Retry-After on HTTP 429).
+# - api_url can point at a local stand-in server so the fetch stage can be exercised offline.
+# - Title variants of all URLs are resolved in bulk: up to 50 titles per request (titles=A|B|...)
+#   with normalization and redirects mapped back to the original titles, so each article then
+#   costs a single extracts request (intro and full text are both parsed from that response).
+# Results are yielded in input order, so chunking the fetched articles gives exactly the same
+# chunks and ordering as a sequential run (max_workers=1).
+
+WIKI_API_URL = 'https://en.wikipedia.org/w/api.php'
+USER_AGENT = 'HybridRAGStudent/1.0 (2024aa05851@wilp.bits-pilani.ac.in)'
+DEFAULT_WORKERS = 8
+DEFAULT_RATE = 5.0  # Requests per second across all workers (<= 0 disables the limit)
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF = 1.0  # Seconds; doubled on every retry
+DEFAULT_TIMEOUT = 10
+MAX_TITLES_PER_REQUEST = 50  # MediaWiki limit on titles=A|B|... for regular clients
+
+# Section headings in plain-text extracts (same pattern wikipediaapi uses for ExtractFormat.WIKI)
+RE_SECTION = re.compile(r"\n\n *(==+) (.*?) (==+) *\n")
+
+
+class RetryableHTTPError(Exception):
+    """HTTP 429 / 5xx response that should be retried."""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+# Thread-safe token bucket: acquire() blocks until a request may be sent
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Split a plain-text extract into (summary, text) exactly as wikipediaapi's
+# WikipediaPage.summary and WikipediaPage.text do for ExtractFormat.WIKI
+
+def parse_extract(extract):
+    matches = list(RE_SECTION.finditer(extract))
+    summary = extract[:matches[0].start()].strip() if matches else ''
+    if summary == '':
+        summary = extract.strip()  # wikipediaapi falls back to the whole extract
+    text = summary + '\n\n' if summary else ''
+    for i, match in enumerate(matches):
+        if i + 1 < len(matches):
+            body = extract[match.end():matches[i + 1].start()].strip()
+        else:
+            body = extract[match.end():]  # wikipediaapi does not strip the last section
+        text += match.group(2).strip() + '\n' + body
+        if body:
+            text += '\n\n'
+    return summary, text.strip()
+
+
+# Title variants tried for a URL, in the same order as the original sequential chunker
+
+def title_variants(url):
+    raw_title = url.split('/wiki/')[-1]
+    tried_titles = [raw_title]
+    if raw_title and not raw_title[0].isupper():
+        tried_titles.append(raw_title[0].upper() + raw_title[1:])
+    if '_' in raw_title:
+        tried_titles.append(raw_title.replace('_', ' '))
+    return raw_title, tried_titles
+
+
+class WikipediaFetcher:
+    def __init__(self, api_url=WIKI_API_URL, max_workers=DEFAULT_WORKERS, rate=DEFAULT_RATE,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF, timeout=DEFAULT_TIMEOUT):
+        self.api_url = api_url
+        self.max_workers = max(1, max_workers)
+        self.bucket = TokenBucket(rate)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._local = threading.local()  # one requests.Session per worker thread
+        self._count_lock = threading.Lock()
+        self.request_count = 0  # HTTP round trips issued (including retries)
+
+    def _session(self):
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+            self._local.session.headers['User-Agent'] = USER_AGENT
+        return self._local.session
+
+    # Rate-limited GET against the API with retry and exponential backoff
+    def api_get(self, params):
+        params = dict(params, format='json')
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            with self._count_lock:
+                self.request_count += 1
+            try:
+                resp = self._session().get(self.api_url, params=params, timeout=self.timeout)
+                if resp.status_code == 429 or resp.status_code >= 500:
+                    retry_after = resp.headers.get('Retry-After')
+                    raise RetryableHTTPError(resp.status_code, float(retry_after) if retry_after else None)
+                resp.raise_for_status()
+                return resp.json()
+            except (requests.RequestException, ValueError, RetryableHTTPError) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff * (2 ** attempt) + random.uniform(0, self.backoff)
+                if isinstance(e, RetryableHTTPError) and e.retry_after is not None:
+                    delay = max(delay, e.retry_after)
+                print(f"[WARN] Wikipedia API request failed ({e}); retry {attempt+1}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    # Look up one title (following redirects); returns the API page entry (extract, canonical URL
+    # and latest revision id) or None if missing
+    def query_page(self, title):
+        data = self.api_get({
+            'action': 'query',
+            'prop': 'extracts|info',
+            'inprop': 'url',
+            'explaintext': 1,
+            'exsectionformat': 'wiki',
+            'titles': title,
+            'redirects': 1,
+        })
+        for page in data.get('query', {}).get('pages', {}).values():
+            if 'missing' not in page and 'invalid' not in page and int(page.get('pageid', -1)) > 0:
+                return page
+        return None
+
+    # Look up many titles with multi-title queries, following normalization and redirects in bulk
+    # Returns {input title: page info ({'title', 'lastrevid', ...}), or None if the page does not
+    # exist}; titles whose batch request failed are left out
+    def lookup_titles(self, titles):
+        unique = list(dict.fromkeys(titles))
+        batches = [unique[i:i + MAX_TITLES_PER_REQUEST] for i in range(0, len(unique), MAX_TITLES_PER_REQUEST)]
+        pages = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for result in pool.map(self._lookup_batch, batches):
+                pages.update(result)
+        return pages
+
+    def _lookup_batch(self, titles):
+        # '|' separates titles in the request and can never appear in a valid title
+        pages = {t: None for t in titles if '|' in t or not t}
+        titles = [t for t in titles if t not in pages]
+        if not titles:
+            return pages
+        try:
+            data = self.api_get({'action': 'query', 'prop': 'info', 'titles': '|'.join(titles), 'redirects': 1})
+        except Exception as e:
+            print(f"[ERROR] Bulk title lookup failed for {len(titles)} titles: {e}")
+            return pages
+        query = data.get('query', {})
+        normalized = {n['from']: n['to'] for n in query.get('normalized', [])}
+        redirects = {r['from']: r['to'] for r in query.get('redirects', [])}
+        existing = {page['title']: page for page in query.get('pages', {}).values()
+                    if 'missing' not in page and 'invalid' not in page and int(page.get('pageid', -1)) > 0}
+        for t in titles:
+            name = normalized.get(t, t)
+            name = redirects.get(name, name)
+            pages[t] = existing.get(name)
+        return pages
+
+    # Resolve many titles in bulk; returns {input title: final page title, or None if the page
+    # does not exist}. Titles whose batch request failed are left out so callers can fall back to
+    # single-title lookups
+    def resolve_titles(self, titles):
+        return {t: page and page['title'] for t, page in self.lookup_titles(titles).items()}
+
+    # Latest revision id of the article behind each URL (50 titles per request, no extracts)
+    # Returns {url: revision id, or None if the page no longer exists}; URLs whose lookup failed
+    # are left out
+    def latest_revisions(self, urls):
+        urls = list(urls)
+        pages = self.lookup_titles([t for url in urls for t in title_variants(url)[1]])
+        revisions = {}
+        for url in urls:
+            variants = title_variants(url)[1]
+            if not all(t in pages for t in variants):
+                continue
+            found = [pages[t] for t in variants if pages[t] is not None]
+            revisions[url] = found[0].get('lastrevid') if found else None
+        return revisions
+
+    # Top search hit for a query, or None
+    def search_title(self, query):
+        data = self.api_get({'action': 'query', 'list': 'search', 'srsearch': query})
+        results = data.get('query', {}).get('search', [])
+        return results[0]['title'] if results else None
+
+    # Resolve and download one article URL
+    # resolved: optional output of resolve_titles; variants known to be missing are skipped and
+    # known pages are fetched directly by their final title
+    # Returns {'url', 'title', 'resolved_url', 'revid', 'summary', 'text'} or None if the page could not be found
+    def fetch_article(self, url, resolved=None):
+        raw_title, tried_titles = title_variants(url)
+        page = None
+        for t in tried_titles:
+            if resolved is not None and t in resolved:
+                if resolved[t] is None:
+                    continue
+                t = resolved[t]
+            try:
+                page = self.query_page(t)
+            except Exception as e:
+                print(f"[ERROR] Exception during page lookup for '{t}': {e}")
+            if page:
+                break
+        # Fallback: use Wikipedia search API if direct lookup fails
+        if not page:
+            try:
+                top_title = self.search_title(raw_title)
+                if top_title:
+                    page = self.query_page(top_title)
+                    if page:
+                        print(f"[LOG] Fallback used for URL: {url} | Fallback title: {top_title}")
+                else:
+                    print(f"[DEBUG] No search results for URL: {url} | Query: {raw_title}")
+            except Exception as e:
+                print(f"[WARN] Wikipedia search API failed for {raw_title}: {e}")
+        if not page:
+            print(f"[WARN] Page does not exist for URL: {url} (tried: {tried_titles})")
+            return None
+        summary, text = parse_extract(page.get('extract', ''))
+        return {'url': url, 'title': page['title'], 'resolved_url': page.get('fullurl'),
+                'revid': page.get('lastrevid'), 'summary': summary, 'text': text}
+
+    # Fetch many URLs concurrently; yields (url, article_or_None) in input order
+    # All title variants are resolved up front in bulk (50 titles per request); at most a few
+    # articles per worker are fetched ahead of the consumer, so memory stays bounded
+    def fetch_all(self, urls):
+        urls = list(urls)
+        resolved = self.resolve_titles([t for url in urls for t in title_variants(url)[1]])
+        if self.max_workers == 1:
+            for url in urls:
+                yield url, self.fetch_article(url, resolved)
+            return
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            articles = bounded_map(pool, lambda u: self.fetch_article(u, resolved), urls, window=4 * self.max_workers)
+            for url, article in zip(urls, articles):
+                yield url, article
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Fetch Wikipedia articles concurrently (prints titles and sizes).")
+    parser.add_argument('urls', nargs='+', help='Wikipedia article URLs')
+    parser.add_argument('--api-url', default=WIKI_API_URL, help='MediaWiki API endpoint (e.g. a local stand-in server)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Maximum concurrent requests')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help='Global request rate limit (requests/s)')
+    args = parser.parse_args()
+    fetcher = WikipediaFetcher(api_url=args.api_url, max_workers=args.workers, rate=args.rate)
+    for url, article in fetcher.fetch_all(args.urls):
+        print(json.dumps({'url': url, 'title': article and article['title'],
+                          'chars': article and len(article['text'])}, ensure_ascii=False))
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from rank_bm25 import BM25Okapi
+import sparse_retrieval_bm25
+from sparse_retrieval_bm25 import BM25Index, write_bm25_index
+
+# =====================================
+# BM25Index vs rank_bm25.BM25Okapi
+# =====================================
+# The on-disk index must give the scores and rankings of BM25Okapi on the same tokens.
+# Whitespace tokenization keeps the test independent of the NLTK punkt data.
+
+VOCAB = [f'w{i}' for i in range(40)]
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    monkeypatch.setattr(sparse_retrieval_bm25, 'tokenize', str.split)
+    rng = np.random.default_rng(0)
+    # Skewed term frequencies, so common terms get a negative idf (epsilon floor) and rare terms a high one
+    weights = 1.0 / np.arange(1, len(VOCAB) + 1)
+    docs = [list(rng.choice(VOCAB, size=rng.integers(1, 30), p=weights / weights.sum())) for _ in range(200)]
+    chunks = [{'chunk_id': str(i), 'text': ' '.join(doc)} for i, doc in enumerate(docs)]
+    # Small segments exercise the spill-and-merge path of the build
+    write_bm25_index(iter(chunks), str(tmp_path), 'test', segment_docs=64)
+    queries = [['w0'], ['w3', 'w17'], ['w5', 'w5', 'w30'], ['w39', 'unknown'], ['unknown'], VOCAB[:8]]
+    return BM25Index(str(tmp_path)), BM25Okapi(docs), queries
+
+
+def test_scores_match_bm25okapi(corpus):
+    index, okapi, queries = corpus
+    for query in queries:
+        np.testing.assert_allclose(index.get_scores(query), okapi.get_scores(query), rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize('top_k', [1, 5, 50, 500])
+def test_top_k_matches_bm25okapi(corpus, top_k):
+    index, okapi, queries = corpus
+    batch = index.top_k_batch(queries, top_k)
+    for query, (batch_ids, batch_scores) in zip(queries, batch):
+        expected = okapi.get_scores(query)
+        # Ties are broken by lower doc id
+        expected_ids = np.argsort(-expected, kind='stable')[:top_k]
+        ids, scores = index.top_k(query, top_k)
+        np.testing.assert_array_equal(ids, expected_ids)
+        np.testing.assert_allclose(scores, expected[expected_ids], rtol=1e-12, atol=1e-12)
+        np.testing.assert_array_equal(batch_ids, expected_ids)
+        np.testing.assert_allclose(batch_scores, expected[expected_ids], rtol=1e-12, atol=1e-12)
@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+import numpy as np
+import sparse_retrieval_bm25
+from cascade_retrieval import CascadeRetriever
+from sparse_retrieval_bm25 import BM25Index, write_bm25_index
+
+# =====================================
+# Cascade candidates
+# =====================================
+# Only chunks matching a query term are rescored, even when BM25 pads a short candidate list.
+
+TEXTS = ['red fox', 'blue whale', 'green frog', 'red panda', 'grey wolf', 'brown bear']
+
+
+def cascade(tmp_path, monkeypatch, candidates):
+    monkeypatch.setattr(sparse_retrieval_bm25, 'tokenize', str.split)
+    write_bm25_index([{'chunk_id': str(i), 'text': t} for i, t in enumerate(TEXTS)], str(tmp_path), 'test')
+    retriever = CascadeRetriever(candidates, sparse=SimpleNamespace(index=BM25Index(str(tmp_path))))
+    # One-hot chunk embeddings: a chunk's dense score is its entry of the query embedding
+    retriever._vectors = np.eye(len(TEXTS), dtype=np.float32)  # Set instead of loaded, so load() is a no-op
+    return retriever
+
+
+def test_short_candidate_list_keeps_only_matches(tmp_path, monkeypatch):
+    retriever = cascade(tmp_path, monkeypatch, candidates=5)
+    # The query embedding prefers chunk 1, which does not contain 'red'
+    q = np.array([[0.1, 1.0, 0.0, 0.3, 0.0, 0.0]], dtype=np.float32)
+    ids, dense_scores, sparse_scores = retriever.rank_embedded(q, [['red']], top_k=5)[0]
+    np.testing.assert_array_equal(ids, [3, 0])
+    np.testing.assert_allclose(dense_scores, [0.3, 0.1], rtol=1e-6)
+    assert (sparse_scores > 0).all()
+
+
+def test_no_match_returns_nothing(tmp_path, monkeypatch):
+    retriever = cascade(tmp_path, monkeypatch, candidates=5)
+    q = np.ones((1, len(TEXTS)), dtype=np.float32)
+    ids, _, _ = retriever.rank_embedded(q, [['unknown']], top_k=3)[0]
+    assert len(ids) == 0
+
+
+def test_candidates_cut_before_rescoring(tmp_path, monkeypatch):
+    retriever = cascade(tmp_path, monkeypatch, candidates=1)
+    # 'red fox' matches both terms and 'red panda' one: only the BM25 top-1 is rescored
+    q = np.ones((1, len(TEXTS)), dtype=np.float32)
+    ids, _, sparse_scores = retriever.rank_embedded(q, [['red', 'fox']], top_k=3)[0]
+    np.testing.assert_array_equal(ids, [0])
+    assert sparse_scores[0] > 0
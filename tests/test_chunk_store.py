@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from chunk_store import ChunkStore, append_chunk_store, write_chunk_store
+
+# =====================================
+# Chunk Store Round-Trips
+# =====================================
+# Every chunk written (or appended) must come back unchanged from the memory-mapped store.
+
+
+def make_chunks(start, count):
+    titles = ['Alan Turing', 'Ada Lovelace', 'Zürich']
+    chunks = []
+    for i in range(start, start + count):
+        title = titles[i % len(titles)]
+        chunks.append({
+            'chunk_id': str(i),
+            'url': f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}",
+            'title': title,
+            'chunk_index': i // len(titles),
+            # Non-ASCII text and an empty chunk check the byte offsets
+            'text': '' if i == 3 else f'chunk {i}: naïve café — ∑ {"x" * i}',
+        })
+    return chunks
+
+
+def test_write_round_trip(tmp_path):
+    chunks = make_chunks(0, 10)
+    write_chunk_store(iter(chunks), str(tmp_path), fingerprint='test')
+    store = ChunkStore(str(tmp_path))
+    assert len(store) == len(chunks)
+    assert store.deleted is None
+    for chunk in chunks:
+        assert store.chunk(chunk['chunk_id']) == chunk
+        assert store.meta(int(chunk['chunk_id'])) == {k: v for k, v in chunk.items() if k != 'text'}
+        assert bytes(store.text_bytes(chunk['chunk_id'])) == chunk['text'].encode('utf-8')
+    assert len(store.titles) == 3 and len(store.urls) == 3
+
+
+def test_append_round_trip(tmp_path):
+    chunks = make_chunks(0, 6)
+    write_chunk_store(chunks, str(tmp_path), fingerprint='test')
+    appended = make_chunks(6, 5) + [{'chunk_id': '11', 'url': 'https://en.wikipedia.org/wiki/New', 'title': 'New',
+                                     'chunk_index': 0, 'text': 'new article'}]
+    append_chunk_store(appended, deleted_ids=[1, 4], revisions={'https://en.wikipedia.org/wiki/New': 42},
+                       store_dir=str(tmp_path), fingerprint='test2')
+    store = ChunkStore(str(tmp_path))
+    assert len(store) == 12
+    for chunk in chunks + appended:
+        assert store.chunk(chunk['chunk_id']) == chunk
+    np.testing.assert_array_equal(store.deleted_ids(), [1, 4])
+    assert store.url_revids[len(store.urls) - 1] == 42
+    assert store.manifest['num_chunks'] == 12 and store.manifest['num_deleted'] == 2
+
+
+def test_non_consecutive_ids_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        write_chunk_store([{'chunk_id': '1', 'url': 'u', 'title': 't', 'chunk_index': 0, 'text': 'x'}], str(tmp_path))
@@ -0,0 +1,71 @@
+import os
+import numpy as np
+from embedding_cache import HASH_SIZE, HASHES_FILE, VECTORS_FILE, EmbeddingCache
+
+# =====================================
+# Embedding cache
+# =====================================
+# Only unseen texts are encoded, entries survive reopening, and a torn tail left by an interrupted
+# append is dropped instead of being read as a vector.
+
+DIM = 4
+
+
+class Encoder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return np.array([[len(t), ord(t[0]), i, 1.0] for i, t in enumerate(texts)], dtype=np.float32)
+
+
+def test_encodes_each_new_text_once(tmp_path):
+    encoder = Encoder()
+    cache = EmbeddingCache('test/model', cache_dir=str(tmp_path))
+    first = cache.embed(['a', 'bb', 'a'], encoder)
+    np.testing.assert_array_equal(first[0], first[2])
+    second = cache.embed(['bb', 'ccc'], encoder)
+    assert encoder.calls == [['a', 'bb'], ['ccc']]
+    np.testing.assert_array_equal(second[0], first[1])
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_reopen_reads_from_disk(tmp_path):
+    encoder = Encoder()
+    vectors = EmbeddingCache('test/model', cache_dir=str(tmp_path)).embed(['x', 'yy'], encoder)
+    reopened = EmbeddingCache('test/model', cache_dir=str(tmp_path))
+    assert len(reopened) == 2
+    np.testing.assert_array_equal(reopened.embed(['yy', 'x'], encoder), vectors[::-1])
+    assert len(encoder.calls) == 1
+    # Another model or normalization gets its own cache
+    assert len(EmbeddingCache('test/model', normalize=False, cache_dir=str(tmp_path))) == 0
+    assert len(EmbeddingCache('other/model', cache_dir=str(tmp_path))) == 0
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    encoder = Encoder()
+    cache = EmbeddingCache('test/model', cache_dir=str(tmp_path))
+    vectors = cache.embed(['one', 'two'], encoder)
+    # Interrupted appends: a complete vector without its hash, then half of the next vector
+    with open(os.path.join(cache.path, VECTORS_FILE), 'ab') as f:
+        f.write(np.ones(DIM, dtype=np.float32).tobytes() + np.ones(DIM // 2, dtype=np.float32).tobytes())
+    with open(os.path.join(cache.path, HASHES_FILE), 'ab') as f:
+        f.write(b'\x00' * (HASH_SIZE // 2))
+    reopened = EmbeddingCache('test/model', cache_dir=str(tmp_path))
+    assert len(reopened) == 2
+    assert os.path.getsize(os.path.join(cache.path, VECTORS_FILE)) == 2 * DIM * 4
+    assert os.path.getsize(os.path.join(cache.path, HASHES_FILE)) == 2 * HASH_SIZE
+    # Appending after recovery keeps rows and hashes aligned
+    three = reopened.embed(['three'], encoder)
+    again = EmbeddingCache('test/model', cache_dir=str(tmp_path))
+    np.testing.assert_array_equal(again.embed(['one', 'two', 'three'], encoder), np.vstack([vectors, three]))
+    assert len(encoder.calls) == 2
+
+
+def test_float16_storage(tmp_path):
+    cache = EmbeddingCache('test/model', cache_dir=str(tmp_path), dtype='float16')
+    vectors = cache.embed(['abc'], lambda texts: np.full((len(texts), DIM), 0.1, dtype=np.float32))
+    assert vectors.dtype == np.float32
+    np.testing.assert_array_equal(vectors, np.float16(0.1).astype(np.float32))
+    assert os.path.getsize(os.path.join(cache.path, VECTORS_FILE)) == DIM * 2
@@ -0,0 +1,38 @@
+import numpy as np
+from hybrid_retrieval import fuse_scores, score_ranks
+
+# =====================================
+# Hybrid scorer fusion
+# =====================================
+# fuse_scores on one candidate set with hand-computed results (no indexes needed).
+
+IDS = np.array([3, 7, 9])
+# Cosines close together and BM25 scores on a larger scale: min-max puts both on [0, 1]
+DENSE = np.array([0.80, 0.90, 0.85])
+SPARSE = np.array([12.0, 10.0, 0.0])
+
+
+def test_combsum():
+    # dense -> [0, 1, 0.5], sparse -> [1, 5/6, 0]
+    ids, fused, top = fuse_scores(IDS, DENSE, SPARSE, method='combsum', top_n=3)
+    np.testing.assert_array_equal(ids, [7, 3, 9])
+    np.testing.assert_array_equal(top, [1, 0, 2])
+    np.testing.assert_allclose(fused, [1 + 5 / 6, 1.0, 0.5])
+
+
+def test_combsum_weights():
+    ids, fused, _ = fuse_scores(IDS, DENSE, SPARSE, method='combsum', weights=(0.0, 1.0), top_n=2)
+    np.testing.assert_array_equal(ids, [3, 7])
+    np.testing.assert_allclose(fused, [1.0, 5 / 6])
+
+
+def test_score_ranks_share_ties():
+    np.testing.assert_array_equal(score_ranks(np.array([0.5, 0.0, 0.9, 0.0, 0.5])), [2, 4, 1, 4, 2])
+
+
+def test_rrf_skips_unmatched_sparse():
+    ids, fused, _ = fuse_scores(IDS, DENSE, SPARSE, method='rrf', k=60, top_n=3)
+    # 9 has no BM25 match, so only its dense rank (2) counts
+    expected = {3: 1 / 63 + 1 / 61, 7: 1 / 61 + 1 / 62, 9: 1 / 62}
+    np.testing.assert_array_equal(ids, [7, 3, 9])
+    np.testing.assert_allclose(fused, [expected[i] for i in (7, 3, 9)])
@@ -0,0 +1,128 @@
+import json
+import os
+from functools import partial
+import numpy as np
+import pytest
+import faiss
+import incremental_index
+import sparse_retrieval_bm25
+from chunk_store import ChunkStore, append_chunk_store, write_chunk_store
+from dense_retrieval_faiss import compact_dense_index, update_dense_index
+from index_artifacts import TOMBSTONE_KEY, corpus_fingerprint, read_manifest, write_manifest
+from sparse_retrieval_bm25 import BM25Index, update_bm25_index, write_bm25_index
+
+# =====================================
+# Compaction after incremental updates
+# =====================================
+# An article is replaced and another deleted (tombstones, delta index, BM25 overlay), then
+# compact() must renumber the live chunks 0..n-1 in order consistently in the corpus, the chunk
+# store, the FAISS index, the float vectors file and the BM25 index.
+
+DIM = 8
+
+
+def chunk(chunk_id, url, index, text):
+    return {'chunk_id': str(chunk_id), 'url': f'https://en.wikipedia.org/wiki/{url}', 'title': url,
+            'chunk_index': index, 'text': text}
+
+
+BASE = [chunk(0, 'A', 0, 'alpha one'), chunk(1, 'A', 1, 'alpha two'), chunk(2, 'B', 0, 'beta old'),
+        chunk(3, 'B', 1, 'beta stale'), chunk(4, 'C', 0, 'gamma gone'), chunk(5, 'D', 0, 'delta kept')]
+# New revision of B (replaces chunks 2 and 3); C is deleted (chunk 4)
+NEW = [chunk(6, 'B', 0, 'beta new'), chunk(7, 'B', 1, 'beta fresh')]
+DELETED = [2, 3, 4]
+
+
+def vector(chunk_id):
+    v = np.zeros(DIM, dtype=np.float32)
+    v[chunk_id % DIM] = 1.0
+    v[(chunk_id + 3) % DIM] = 0.5
+    return v / np.linalg.norm(v)
+
+
+@pytest.fixture
+def updated_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(sparse_retrieval_bm25, 'tokenize', str.split)
+    paths = {name: str(tmp_path / name) for name in
+             ('chunks.jsonl', 'store', 'bm25', 'meta.json', 'index.bin', 'delta.bin', 'index.json', 'vectors.f32')}
+    dense = dict(index_path=paths['index.bin'], delta_path=paths['delta.bin'], manifest_path=paths['index.json'],
+                 vectors_path=paths['vectors.f32'])
+
+    # Full build of the base corpus
+    with open(paths['chunks.jsonl'], 'w', encoding='utf-8') as f:
+        for c in BASE:
+            f.write(json.dumps(c) + '\n')
+    fingerprint = corpus_fingerprint(paths['chunks.jsonl'])
+    write_chunk_store(BASE, paths['store'], fingerprint=fingerprint, revisions={BASE[0]['url']: 11})
+    write_bm25_index(BASE, paths['bm25'], fingerprint)
+    index = faiss.IndexIDMap(faiss.IndexFlatIP(DIM))
+    base_vectors = np.stack([vector(i) for i in range(len(BASE))])
+    index.add_with_ids(base_vectors, np.arange(len(BASE), dtype=np.int64))
+    faiss.write_index(index, paths['index.bin'])
+    base_vectors.tofile(paths['vectors.f32'])
+    write_manifest(paths['index.json'], {'corpus_fingerprint': fingerprint, 'model': 'test', 'index_type': 'flat',
+                                         'num_chunks': len(BASE), 'dim': DIM})
+
+    # Incremental update, as update_articles applies it
+    store = ChunkStore(paths['store'])
+    deleted = [(i, store.text(i)) for i in DELETED]
+    with open(paths['chunks.jsonl'], 'a', encoding='utf-8') as f:
+        for c in NEW:
+            f.write(json.dumps(c) + '\n')
+        for i in DELETED:
+            f.write(json.dumps({TOMBSTONE_KEY: str(i)}) + '\n')
+    fingerprint = corpus_fingerprint(paths['chunks.jsonl'])
+    append_chunk_store(NEW, DELETED, {NEW[0]['url']: 22, BASE[4]['url']: None}, paths['store'], fingerprint=fingerprint)
+    update_dense_index(NEW, np.stack([vector(int(c['chunk_id'])) for c in NEW]), fingerprint, **dense)
+    update_bm25_index(NEW, deleted, paths['bm25'], fingerprint=fingerprint)
+
+    # compact() rebuilds the dense index at the default paths; point it at this index
+    monkeypatch.setattr(incremental_index, 'compact_dense_index', partial(compact_dense_index, **dense))
+    incremental_index.compact(paths['chunks.jsonl'], paths['store'], paths['bm25'], paths['meta.json'])
+    return paths
+
+
+# Live chunks in their old id order, i.e. the order of their new ids
+LIVE = [c for c in BASE + NEW if int(c['chunk_id']) not in DELETED]
+
+
+def test_corpus_renumbered(updated_index):
+    with open(updated_index['chunks.jsonl'], 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    assert records == [dict(c, chunk_id=str(i)) for i, c in enumerate(LIVE)]
+
+
+def test_chunk_store_renumbered(updated_index):
+    store = ChunkStore(updated_index['store'])
+    assert len(store) == len(LIVE)
+    assert store.deleted is None
+    for i, c in enumerate(LIVE):
+        assert store.chunk(i) == dict(c, chunk_id=str(i))
+    # Recorded revision ids survive compaction
+    revids = {store.urls[i]: int(r) for i, r in enumerate(store.url_revids)}
+    assert revids[BASE[0]['url']] == 11 and revids[NEW[0]['url']] == 22
+    assert store.manifest['corpus_fingerprint'] == corpus_fingerprint(updated_index['chunks.jsonl'])
+
+
+def test_dense_index_renumbered(updated_index):
+    assert not os.path.exists(updated_index['delta.bin'])
+    index = faiss.read_index(updated_index['index.bin'])
+    ids = faiss.vector_to_array(index.id_map)
+    expected = np.stack([vector(int(c['chunk_id'])) for c in LIVE])
+    np.testing.assert_array_equal(ids, np.arange(len(LIVE)))
+    np.testing.assert_allclose(index.index.reconstruct_n(0, index.ntotal), expected)
+    np.testing.assert_allclose(np.fromfile(updated_index['vectors.f32'], dtype=np.float32).reshape(-1, DIM), expected)
+    manifest = read_manifest(updated_index['index.json'])
+    assert manifest['num_chunks'] == len(LIVE) and 'num_delta_chunks' not in manifest
+    # A chunk's own vector finds its new id
+    _, found = index.search(vector(7)[None], 1)
+    assert found[0, 0] == LIVE.index(NEW[1])
+
+
+def test_bm25_index_renumbered(updated_index):
+    index = BM25Index(updated_index['bm25'])
+    assert index.num_docs == len(LIVE)
+    assert index.updates is None and index.deleted is None
+    ids, scores = index.top_k(['beta'], 5)
+    np.testing.assert_array_equal(ids[scores > 0], [LIVE.index(NEW[0]), LIVE.index(NEW[1])])
+    assert (index.get_scores(['gamma']) == 0).all()
@@ -0,0 +1,92 @@
+import json
+from urllib.parse import urlparse
+import numpy as np
+import pytest
+from chunk_store import ChunkStore, write_chunk_store
+from metadata_filter import compile_filter
+
+# =====================================
+# Metadata filter compiler
+# =====================================
+# Compiled bitsets must select exactly the chunks for which the expression, evaluated by Python
+# on that chunk's fields, is true.
+
+ARTICLES = [('Alan Turing', 'https://en.wikipedia.org/wiki/Alan_Turing', 4),
+            ('Ada Lovelace', 'https://en.wikipedia.org/wiki/Ada_Lovelace', 2),
+            ('Computer science', 'https://en.wikipedia.org/wiki/Computer_science', 5),
+            ('Informatik', 'https://de.wikipedia.org/wiki/Informatik', 3)]
+FIXED = ['https://en.wikipedia.org/wiki/Alan_Turing', 'https://en.wikipedia.org/wiki/Computer_science']
+RANDOM = ['https://en.wikipedia.org/wiki/Ada_Lovelace']
+
+
+@pytest.fixture
+def store(tmp_path):
+    chunks = [{'chunk_id': str(i), 'url': url, 'title': title, 'chunk_index': idx, 'text': f'{title} {idx}'}
+              for i, (title, url, idx) in enumerate((t, u, j) for t, u, n in ARTICLES for j in range(n))]
+    write_chunk_store(chunks, str(tmp_path / 'store'), fingerprint='test')
+    for name, urls in (('fixed.json', FIXED), ('random.json', RANDOM)):
+        with open(tmp_path / name, 'w', encoding='utf-8') as f:
+            json.dump(urls, f)
+    return ChunkStore(str(tmp_path / 'store')), str(tmp_path / 'fixed.json'), str(tmp_path / 'random.json'), chunks
+
+
+def expected_mask(chunks, expression):
+    rows = []
+    for c in chunks:
+        source = 'fixed' if c['url'] in FIXED else 'random' if c['url'] in RANDOM else ''
+        fields = {'title': c['title'], 'url': c['url'], 'domain': urlparse(c['url']).netloc, 'source': source,
+                  'chunk_index': c['chunk_index']}
+        rows.append(bool(eval(expression, {'__builtins__': {}}, fields)))
+    return np.array(rows)
+
+
+@pytest.mark.parametrize('expression', [
+    "source == 'fixed' and chunk_index < 3",
+    "title in ['Alan Turing', 'Ada Lovelace'] or 'Computer' in title",
+    "0 < chunk_index <= 2",
+    "2 > chunk_index",
+    "3 <= chunk_index",
+    "not (source == 'random') and chunk_index != 0",
+    "title not in ['Informatik'] and 'ing' not in title",
+    "chunk_index in [0, 4]",
+    "chunk_index not in [1, 2, 3]",
+    "title.startswith('A') or url.endswith('_science')",
+    "title.startswith(('Ada', 'Info'))",
+    "domain == 'de.wikipedia.org' or source == ''",
+    "'en.' in domain and (chunk_index == 1 or chunk_index == 3)",
+    "True",
+    "False or chunk_index > 3",
+])
+def test_matches_python(store, expression):
+    chunk_store, fixed, random, chunks = store
+    mask = compile_filter(expression, chunk_store, fixed, random)
+    assert mask.dtype == bool and mask.shape == (len(chunks),)
+    np.testing.assert_array_equal(mask, expected_mask(chunks, expression))
+
+
+@pytest.mark.parametrize('expression', [
+    "body == 'x'",              # Unknown field
+    "title < 'B'",              # Ordering on a string field
+    "title == url",             # Not a literal
+    "'x' in chunk_index",       # Substring test on a number
+    "title in 'Alan'",          # in needs a list
+    "chunk_index +",            # Syntax error
+    "len(title) > 3",           # Unsupported call
+    "1 < 2",                    # No field
+])
+def test_invalid_expressions(store, expression):
+    chunk_store, fixed, random, _ = store
+    with pytest.raises(ValueError):
+        compile_filter(expression, chunk_store, fixed, random)
+
+
+def test_bitsets_pass_through_and_cache(store):
+    chunk_store, fixed, random, chunks = store
+    bitset = np.zeros(len(chunks), dtype=bool)
+    bitset[[1, 5]] = True
+    np.testing.assert_array_equal(compile_filter(bitset, chunk_store), bitset)
+    with pytest.raises(ValueError):
+        compile_filter(bitset[:-1], chunk_store)
+    mask = compile_filter("chunk_index == 0", chunk_store, fixed, random)
+    assert compile_filter("chunk_index == 0", chunk_store, fixed, random) is mask
+    assert not mask.flags.writeable
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from rank_fusion import fuse, normalize_scores, top_n_indices
+
+# =====================================
+# rank_fusion: normalization and fusion
+# =====================================
+# RRF is checked against the original reciprocal_rank_fusion loop (per-document rank lookup in
+# every list), extended to weights and any number of lists; CombSUM / CombMNZ and the score
+# normalizations against hand-computed results.
+
+
+def baseline_rrf(ranked_ids, weights, k, top_n):
+    scores = {}
+    for weight, ids in zip(weights, ranked_ids):
+        for rank, cid in enumerate(ids):
+            scores[cid] = scores.get(cid, 0.0) + weight / (k + rank + 1)
+    # Ties: first occurrence across the lists (earlier lists win), as fuse documents
+    first = {}
+    for cid in (cid for ids in ranked_ids for cid in ids):
+        first.setdefault(cid, len(first))
+    ordered = sorted(scores, key=lambda cid: (-scores[cid], first[cid]))[:top_n]
+    return ordered, [scores[cid] for cid in ordered]
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('num_lists', [1, 2, 3])
+def test_rrf_matches_baseline(seed, num_lists):
+    rng = np.random.default_rng(seed)
+    ranked_ids = [list(rng.choice(60, size=rng.integers(0, 25), replace=False)) for _ in range(num_lists)]
+    weights = list(rng.uniform(0.5, 2.0, size=num_lists))
+    for top_n in (1, 5, 100):
+        ids, scores = fuse(ranked_ids, weights=weights, method='rrf', k=60, top_n=top_n)
+        expected_ids, expected_scores = baseline_rrf(ranked_ids, weights, 60, top_n)
+        np.testing.assert_array_equal(ids, np.array(expected_ids, dtype=np.int64))
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-12)
+
+
+def test_rrf_tie_break_prefers_earlier_list():
+    # 1 and 2 both have rank 1 in one list: the document of the first list comes first
+    ids, scores = fuse([[1], [2]], method='rrf', top_n=2)
+    np.testing.assert_array_equal(ids, [1, 2])
+    assert scores[0] == scores[1]
+
+
+def test_empty_lists():
+    ids, scores = fuse([[], []], method='rrf')
+    assert len(ids) == 0 and len(scores) == 0
+
+
+def test_top_n_indices_orders_ties_by_key():
+    values = np.array([1.0, 3.0, 3.0, 2.0, 3.0])
+    np.testing.assert_array_equal(top_n_indices(values, 2, tie_key=np.array([9, 5, 7, 0, 1])), [4, 1])
+
+
+@pytest.mark.parametrize('scores, expected', [
+    ([5.0, 10.0], [0.0, 1.0]),
+    ([-3.0, -1.0, -2.0], [0.0, 1.0, 0.5]),
+    ([0.2, 0.9, 0.55], [0.0, 1.0, 0.5]),
+    ([4.0, 4.0], [1.0, 1.0]),
+    ([], []),
+])
+def test_minmax(scores, expected):
+    np.testing.assert_allclose(normalize_scores(scores, 'minmax'), expected, atol=1e-12)
+
+
+def test_zscore():
+    np.testing.assert_allclose(normalize_scores([1.0, 2.0, 3.0], 'zscore'), [-1.5 ** 0.5, 0.0, 1.5 ** 0.5])
+    np.testing.assert_array_equal(normalize_scores([7.0, 7.0], 'zscore'), [0.0, 0.0])
+    np.testing.assert_array_equal(normalize_scores([], 'zscore'), [])
+
+
+def test_unknown_normalization():
+    with pytest.raises(ValueError):
+        normalize_scores([], 'rank')
+
+
+# Two lists on different scales: after min-max, list 1 is [1, 0.5, 0] and list 2 is [1, 0]
+RANKED_IDS = [[1, 2, 3], [3, 4]]
+SCORES = [[0.9, 0.5, 0.1], [20.0, 10.0]]
+
+
+def test_combsum():
+    ids, scores = fuse(RANKED_IDS, method='combsum', scores=SCORES, top_n=4)
+    # 1 and 3 tie at 1.0; 1 occurs first
+    np.testing.assert_array_equal(ids, [1, 3, 2, 4])
+    np.testing.assert_allclose(scores, [1.0, 1.0, 0.5, 0.0])
+
+
+def test_combsum_weights():
+    ids, scores = fuse(RANKED_IDS, weights=[1.0, 3.0], method='combsum', scores=SCORES, top_n=4)
+    np.testing.assert_array_equal(ids, [3, 1, 2, 4])
+    np.testing.assert_allclose(scores, [3.0, 1.0, 0.5, 0.0])
+
+
+def test_combmnz():
+    ids, scores = fuse(RANKED_IDS, method='combmnz', scores=SCORES, top_n=4)
+    # 3 is returned by both lists, so its sum is doubled
+    np.testing.assert_array_equal(ids, [3, 1, 2, 4])
+    np.testing.assert_allclose(scores, [2.0, 1.0, 0.5, 0.0])
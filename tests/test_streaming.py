@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from streaming import JsonlCheckpointWriter, batched, bounded_map, run_key
+
+# =====================================
+# Streaming ingest helpers
+# =====================================
+# A run interrupted after a checkpoint resumes from it without losing or duplicating records;
+# bounded_map keeps input order with a bounded number of tasks in flight.
+
+
+def write_articles(writer, articles):
+    for article in articles:
+        for record in range(article % 3 + 1):
+            writer.write({'article': article, 'record': record})
+        writer.commit_article()
+
+
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_resume_after_interruption(tmp_path):
+    path = str(tmp_path / 'out' / 'chunks.jsonl')
+    key = run_key(urls=['a', 'b'], chunk_size=200)
+    writer = JsonlCheckpointWriter(path, key, checkpoint_every=2)
+    assert writer.resume() == (0, 0)
+    write_articles(writer, range(5))  # Checkpoints after articles 2 and 4
+    writer.file.close()  # Interrupted: article 5's records are not checkpointed
+
+    resumed = JsonlCheckpointWriter(path, key, checkpoint_every=2)
+    articles, records = resumed.resume()
+    assert articles == 4
+    assert records == sum(a % 3 + 1 for a in range(4))
+    write_articles(resumed, range(articles, 7))
+    resumed.finish()
+
+    expected = [{'article': a, 'record': r} for a in range(7) for r in range(a % 3 + 1)]
+    assert read_jsonl(path) == expected
+    assert not os.path.exists(path + '.part') and not os.path.exists(path + '.checkpoint.json')
+
+
+def test_other_run_starts_over(tmp_path):
+    path = str(tmp_path / 'chunks.jsonl')
+    writer = JsonlCheckpointWriter(path, run_key(chunk_size=200), checkpoint_every=1)
+    writer.resume()
+    write_articles(writer, range(3))
+    writer.file.close()
+
+    for restart, key in ((False, run_key(chunk_size=300)), (True, run_key(chunk_size=200))):
+        other = JsonlCheckpointWriter(path, key, checkpoint_every=1)
+        assert other.resume(restart=restart) == (0, 0)
+        write_articles(other, [9])
+        other.file.close()
+        assert read_jsonl(path + '.part') == [{'article': 9, 'record': 0}]
+
+
+def test_bounded_map_order_and_window():
+    in_flight, peak = 0, 0
+    lock = threading.Lock()
+
+    def work(i):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(0.001 * (i % 4))
+        with lock:
+            in_flight -= 1
+        return i * i
+
+    submitted = []
+
+    def items():
+        for i in range(40):
+            submitted.append(i)
+            yield i
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for n, result in enumerate(bounded_map(executor, work, items(), window=3)):
+            assert result == n * n
+            # Never more than `window` items taken ahead of the consumer
+            assert len(submitted) <= n + 3
+    assert peak <= 3
+
+
+def test_batched():
+    assert list(batched(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(batched([], 3)) == []